@@ -0,0 +1,13 @@
+import argparse
+
+
+def positive_int(arg_value: str) -> int:
+    try:
+        value = int(arg_value)
+    except ValueError:
+        msg = f"Invalid number: {arg_value}"
+        raise argparse.ArgumentTypeError(msg) from None
+    if value < 1:
+        msg = f"Must be at least 1, got {value}"
+        raise argparse.ArgumentTypeError(msg)
+    return value
@@ -77,7 +77,7 @@ def create_machine(
                 flake_dir=clan_dir,
                 commit_message=f"machines: add {machine_name}",
             )
-        opts.clan_dir.invalidate_cache()
+        opts.clan_dir.invalidate_cache(changed_paths=[machine_dir])
         inventory = inventory_store.read()
 
         curr_machine = inventory.get("machines", {}).get(machine_name)
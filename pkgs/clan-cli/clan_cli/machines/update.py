@@ -3,9 +3,16 @@ import logging
 import os
 import sys
 from functools import partial
-from typing import TYPE_CHECKING, get_args
+from typing import get_args
 
 from clan_lib.async_run import AsyncContext, AsyncOpts, AsyncRuntime
+from clan_lib.async_run.scheduler import (
+    BUILD_HOST,
+    LOCAL_BUILD,
+    TASK,
+    UPLOAD,
+    Scheduler,
+)
 from clan_lib.docs import guides_url
 from clan_lib.errors import ClanError
 from clan_lib.flake import require_flake
@@ -14,8 +21,8 @@ from clan_lib.machines.actions import ListOptions, MachineFilter, list_machines
 from clan_lib.machines.list import instantiate_inventory_to_machines
 from clan_lib.machines.machines import Machine
 from clan_lib.machines.suggestions import validate_machine_names
-from clan_lib.machines.update import run_machine_update
-from clan_lib.network.network import get_best_remote
+from clan_lib.machines.update import build_machines, run_machine_update
+from clan_lib.network.network import get_best_remote, probe_machines
 from clan_lib.nix import nix_config
 from clan_lib.nix_selectors import (
     deployment_require_explicit_update,
@@ -27,6 +34,7 @@ from clan_lib.ssh.remote import Remote
 from clan_lib.vars.generate import run_generators
 from clan_lib.vars.generator import get_machine_selectors
 
+from clan_cli.arg_types import positive_int
 from clan_cli.completions import (
     add_dynamic_completer,
     complete_build_host,
@@ -35,9 +43,6 @@ from clan_cli.completions import (
 )
 from clan_cli.hyperlink import help_hyperlink
 
-if TYPE_CHECKING:
-    from clan_lib.ssh.host import Host
-
 log = logging.getLogger(__name__)
 
 
@@ -62,6 +67,7 @@ def run_update_with_network(
     host_key_check: HostKeyCheck,
     target_host_override: str | None = None,
     specialisation: str | None = None,
+    prebuilt_config_path: str | None = None,
 ) -> None:
     """Run machine update with proper network context handling.
 
@@ -85,6 +91,7 @@ def run_update_with_network(
             build_host=build_host,
             upload_inputs=upload_inputs,
             specialisation=specialisation,
+            prebuilt_config_path=prebuilt_config_path,
         )
     else:
         # Use network context
@@ -96,6 +103,7 @@ def run_update_with_network(
                 build_host=build_host,
                 upload_inputs=upload_inputs,
                 specialisation=specialisation,
+                prebuilt_config_path=prebuilt_config_path,
             )
 
 
@@ -181,6 +189,38 @@ def get_machines_for_update(
     return machines_to_update
 
 
+def update_priority(flake: Flake, machine: Machine, priority_tags: list[str]) -> int:
+    """Machines with any of the priority tags (e.g. canaries) are updated first."""
+    if not priority_tags:
+        return 0
+    tags = list_machines(flake)[machine.name].data.get("tags", [])
+    return 0 if any(tag in tags for tag in priority_tags) else 1
+
+
+def fleet_build(
+    machines: list[Machine],
+    build_hosts: dict[str, Remote | LocalHost | None],
+) -> dict[str, str]:
+    """Build all NixOS machines that are built locally in a single nix build.
+
+    Falls back to building every machine on its own in its update task, if the
+    fleet build fails.
+    """
+    local_machines = [
+        machine
+        for machine in machines
+        if machine._class_ == "nixos"
+        and isinstance(build_hosts[machine.name], LocalHost)
+    ]
+    if not local_machines:
+        return {}
+    try:
+        return build_machines(local_machines)
+    except ClanError as e:
+        log.warning(f"Fleet build failed, building machines one by one: {e}")
+        return {}
+
+
 def update_command(args: argparse.Namespace) -> None:
     if args.no_check:
         os.environ["NIXOS_NO_CHECK"] = "1"
@@ -209,39 +249,76 @@ def update_command(args: argparse.Namespace) -> None:
 
         run_generators(all_machines, full_closure=False)
 
-        with AsyncRuntime() as runtime:
-            for machine in machines_to_update:
-                # figure out on which machine to build on
-                build_host: Host | None = None
-                if args.build_host:
-                    if args.build_host == "localhost":
-                        build_host = LocalHost()
-                    else:
-                        build_host = _remote_from_cli_override(
-                            machine=machine,
-                            address=args.build_host,
-                            host_key_check=args.host_key_check,
-                        )
-                else:
-                    build_host = machine.build_host()
+        priorities = {
+            machine.name: update_priority(flake, machine, args.priority_tags)
+            for machine in machines_to_update
+        }
+        # machines with the same priority are started in the given order
+        machines_to_update.sort(key=lambda machine: priorities[machine.name])
+        scheduler = Scheduler(
+            {
+                TASK: args.max_parallel,
+                LOCAL_BUILD: args.max_local_builds,
+                UPLOAD: args.max_uploads,
+                BUILD_HOST: args.max_builds_per_host,
+            }
+        )
 
-                if machine._class_ == "darwin" and args.specialisation:
-                    msg = f"--specialisation is not supported for darwin machine {machine.name}"
-                    raise ClanError(msg)
+        # figure out on which machine to build on
+        build_hosts: dict[str, Remote | LocalHost | None] = {}
+        for machine in machines_to_update:
+            if args.build_host:
+                if args.build_host == "localhost":
+                    build_hosts[machine.name] = LocalHost()
+                else:
+                    build_hosts[machine.name] = _remote_from_cli_override(
+                        machine=machine,
+                        address=args.build_host,
+                        host_key_check=args.host_key_check,
+                    )
+            else:
+                build_hosts[machine.name] = machine.build_host()
+
+            if machine._class_ == "darwin" and args.specialisation:
+                msg = f"--specialisation is not supported for darwin machine {machine.name}"
+                raise ClanError(msg)
+
+        config_paths: dict[str, str] = {}
+        if args.fleet_build:
+            config_paths = fleet_build(machines_to_update, build_hosts)
+
+        if args.target_host is None:
+            # Probe the networks of all machines at once, get_best_remote of
+            # the single machines is then answered from the cache. Probed
+            # after the build, the results expire after a minute.
+            probe_machines(
+                flake,
+                [
+                    machine.name
+                    for machine in machines_to_update
+                    if not machine.get_inv_machine().get("deploy", {}).get("targetHost")
+                ],
+            )
 
+        with AsyncRuntime(scheduler=scheduler) as runtime:
+            for machine in machines_to_update:
                 # Schedule the update with network handling
                 runtime.async_run(
                     AsyncOpts(
                         tid=machine.name,
-                        async_ctx=AsyncContext(prefix=machine.name),
+                        async_ctx=AsyncContext(
+                            prefix=machine.name,
+                            priority=priorities[machine.name],
+                        ),
                     ),
                     run_update_with_network,
                     machine=machine,
-                    build_host=build_host,
+                    build_host=build_hosts[machine.name],
                     upload_inputs=args.upload_inputs,
                     host_key_check=args.host_key_check,
                     target_host_override=args.target_host,
                     specialisation=args.specialisation,
+                    prebuilt_config_path=config_paths.get(machine.name),
                 )
             runtime.join_all()
             runtime.check_all()
@@ -311,6 +388,41 @@ def register_update_parser(parser: argparse.ArgumentParser) -> None:
         "that can be switched to without rebuilding. "
         f"See {specialisation_guide}",
     )
+    parser.add_argument(
+        "--max-parallel",
+        type=positive_int,
+        help="Maximum number of machines that are updated at the same time.",
+    )
+    parser.add_argument(
+        "--max-local-builds",
+        type=positive_int,
+        help="Maximum number of machines that are built on the local machine at the same time.",
+    )
+    parser.add_argument(
+        "--max-uploads",
+        type=positive_int,
+        help="Maximum number of concurrent uploads (secrets, sources and closures) from the local machine.",
+    )
+    parser.add_argument(
+        "--max-builds-per-host",
+        type=positive_int,
+        help="Maximum number of machines that are built on the same remote build host at the same time.",
+    )
+    priority_tags_parser = parser.add_argument(
+        "--priority-tags",
+        nargs="+",
+        default=[],
+        help="Machines with any of these tags (e.g. canaries) are updated before all others, "
+        "in combination with --max-parallel.",
+    )
+    add_dynamic_completer(priority_tags_parser, complete_tags)
+    parser.add_argument(
+        "--fleet-build",
+        action="store_true",
+        help="Build all machines that are built on the local machine in a single nix build "
+        "before deploying them, so derivations shared between machines are only evaluated "
+        "and built once.",
+    )
     parser.add_argument(
         "--no-check",
         action="store_true",
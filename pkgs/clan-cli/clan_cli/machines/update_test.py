@@ -8,6 +8,7 @@ from clan_lib.errors import ClanError
 from clan_lib.flake import Flake
 from clan_lib.machines.update import (
     _build_darwin_rebuild_cmd,
+    build_machines,
     upload_sources,
 )
 
@@ -609,3 +610,82 @@ def test_nixos_activate_omits_nixos_no_check_when_unset() -> None:
         assert "NIXOS_NO_CHECK" not in cmd_str, (
             f"NIXOS_NO_CHECK should not appear when unset: {call.args[0]}"
         )
+
+
+def test_build_machines_maps_out_paths_to_machines() -> None:
+    # separate Flake instances of the same flake
+    machines = [_make_machine("nixos", name) for name in ["a", "b"]]
+    stdout = f"some build log\n{_FAKE_CONFIG_PATH}-a\n{_FAKE_CONFIG_PATH}-b\n"
+
+    with (
+        patch(
+            "clan_lib.machines.update.nix_metadata",
+            return_value={"path": _FAKE_FLAKE_PATH},
+        ),
+        patch("clan_lib.machines.update.nix_build", side_effect=lambda cmd: cmd),
+        patch(
+            "clan_lib.machines.update.run", return_value=_run_result(stdout=stdout)
+        ) as mock_run,
+    ):
+        config_paths = build_machines(machines)
+
+    # a single nix build for all machines
+    mock_run.assert_called_once()
+    cmd = mock_run.call_args.args[0]
+    assert cmd[:2] == [
+        f'{_FAKE_FLAKE_PATH}#nixosConfigurations."a".config.system.build.toplevel',
+        f'{_FAKE_FLAKE_PATH}#nixosConfigurations."b".config.system.build.toplevel',
+    ]
+    assert config_paths == {
+        "a": f"{_FAKE_CONFIG_PATH}-a",
+        "b": f"{_FAKE_CONFIG_PATH}-b",
+    }
+
+    with (
+        patch(
+            "clan_lib.machines.update.nix_metadata",
+            return_value={"path": _FAKE_FLAKE_PATH},
+        ),
+        patch(
+            "clan_lib.machines.update.run",
+            return_value=_run_result(stdout=f"{_FAKE_CONFIG_PATH}-a\n"),
+        ),
+        pytest.raises(ClanError, match="Expected 2 store paths"),
+    ):
+        build_machines(machines)
+
+    machines[1].flake.identifier = "/other/flake"
+    with pytest.raises(ClanError, match="same flake"):
+        build_machines(machines)
+
+
+def test_run_update_with_prebuilt_config_skips_build() -> None:
+    machine = _make_machine("nixos")
+
+    with (
+        patch("clan_cli.machines.update.Remote") as mock_remote_cls,
+        patch("clan_lib.machines.update.upload_secret_vars"),
+        patch(
+            "clan_lib.machines.update.nix_metadata",
+            return_value={"path": _FAKE_FLAKE_PATH},
+        ),
+        patch("clan_lib.machines.update._nixos_build") as mock_nixos_build,
+        patch("clan_lib.machines.update.is_async_cancelled", return_value=False),
+    ):
+        mock_target_host_root = _setup_host_chain(mock_remote_cls)
+        mock_target_host_root.run.return_value = _run_result(0)
+
+        run_update_with_network(
+            machine=machine,
+            build_host=None,
+            upload_inputs=False,
+            host_key_check="none",
+            target_host_override="root@192.0.2.1",
+            prebuilt_config_path=_FAKE_CONFIG_PATH,
+        )
+
+    mock_nixos_build.assert_not_called()
+    commands = [" ".join(c.args[0]) for c in mock_target_host_root.run.call_args_list]
+    assert any(
+        f"{_FAKE_CONFIG_PATH}/bin/switch-to-configuration" in cmd for cmd in commands
+    )
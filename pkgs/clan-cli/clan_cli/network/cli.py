@@ -47,7 +47,7 @@ This subcommand allows pinging a machine to check if it's online
 Examples:
 
   $ clan network ping machine1
-  Check machine1 on all networks (in priority order)
+  Check machine1 on all networks at once
 
   $ clan network ping machine1 --network tor
   Check machine1 only on the tor network
@@ -1,9 +1,10 @@
 import argparse
 import logging
+from contextlib import ExitStack
 
 from clan_lib.errors import ClanError
 from clan_lib.flake import require_flake
-from clan_lib.network.network import networks_from_flake
+from clan_lib.network.network import networks_from_flake, probe_networks
 
 log = logging.getLogger(__name__)
 
@@ -26,28 +27,30 @@ def ping_command(args: argparse.Namespace) -> None:
         # Sort networks by priority (highest first)
         networks_to_check = sorted(networks.items(), key=lambda x: -x[1].priority)
 
-    found = False
-    for net_name, network in networks_to_check:
-        if machine in network.peers:
-            found = True
-
-            with network.module.connection(network) as conn:
-                log.info(f"Pinging '{machine}' in network '{net_name}' ...")
-                res = ""
-                # Check if peer is online
-                ping = conn.ping(machine)
-                if ping is None:
-                    res = "not reachable"
-                    log.info(f"{machine} ({net_name}): {res}")
-                else:
-                    res = f"reachable, ping: {ping:.2f} ms"
-                    log.info(f"{machine} ({net_name}): {res}")
-                    break
-
-    if not found:
+    networks_to_check = [
+        (net_name, network)
+        for net_name, network in networks_to_check
+        if machine in network.peers
+    ]
+    if not networks_to_check:
         msg = f"Machine '{machine}' not found in any network"
         raise ClanError(msg)
 
+    with ExitStack() as stack:
+        connected = {
+            net_name: stack.enter_context(network.module.connection(network))
+            for net_name, network in networks_to_check
+        }
+        log.info(f"Pinging '{machine}' in networks {', '.join(connected)} ...")
+        latencies = probe_networks(connected, peers=[machine], refresh=True)
+
+    for net_name in connected:
+        ping = latencies[net_name][machine]
+        if ping is None:
+            log.info(f"{machine} ({net_name}): not reachable")
+        else:
+            log.info(f"{machine} ({net_name}): reachable, ping: {ping:.2f} ms")
+
 
 def register_ping_parser(parser: argparse.ArgumentParser) -> None:
     parser.add_argument(
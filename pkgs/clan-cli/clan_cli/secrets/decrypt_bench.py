@@ -0,0 +1,67 @@
+"""Benchmark of decrypting many sops secrets.
+
+Encrypts a number of secrets for a fresh age key and compares decrypting
+them one after another with `decrypt_file_raw`, like the var stores used
+to, with one batch of `decrypt_files_raw`.
+
+Usage: python -m clan_cli.secrets.decrypt_bench [--count 1000] [--jobs N]
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from clan_cli.secrets.sops import (
+    KeyType,
+    SopsKey,
+    decrypt_file_raw,
+    decrypt_files_raw,
+    encrypt_file,
+    generate_private_key,
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--jobs", type=int, default=None)
+    args = parser.parse_args()
+
+    with TemporaryDirectory(prefix="decrypt-bench-") as _tmpdir:
+        tmpdir = Path(_tmpdir)
+        key_file = tmpdir / "key.txt"
+        _, pubkey = generate_private_key(key_file)
+        os.environ["SOPS_AGE_KEY_FILE"] = str(key_file)
+        recipient = SopsKey(pubkey, "bench", KeyType.AGE, source="bench")
+
+        paths = [tmpdir / "secrets" / str(i) / "secret" for i in range(args.count)]
+        start = time.perf_counter()
+        for i, path in enumerate(paths):
+            encrypt_file(path, f"secret-{i}", [recipient], age_plugins=[])
+        print(f"encrypted {args.count} secrets in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        sequential = {path: decrypt_file_raw(path, age_plugins=[]) for path in paths}
+        sequential_duration = time.perf_counter() - start
+
+        start = time.perf_counter()
+        batched = decrypt_files_raw(paths, age_plugins=[], jobs=args.jobs)
+        batched_duration = time.perf_counter() - start
+
+        if batched != sequential:
+            msg = "Batched decryption returned different values"
+            raise AssertionError(msg)
+
+        for name, duration in [
+            ("decrypt_file_raw loop", sequential_duration),
+            ("decrypt_files_raw", batched_duration),
+        ]:
+            print(
+                f"{name:<22} {duration:>8.2f}s {args.count / duration:>10.1f} secrets/s"
+            )
+
+
+if __name__ == "__main__":
+    main()
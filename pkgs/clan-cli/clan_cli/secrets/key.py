@@ -9,6 +9,8 @@ from clan_lib.errors import ClanError
 from clan_lib.flake import Flake  # noqa: TC002
 from clan_lib.git import commit_files
 
+from clan_cli.arg_types import positive_int
+
 from . import sops
 from .secrets import update_secrets
 from .sops import (
@@ -119,6 +121,7 @@ def update_command(args: argparse.Namespace) -> None:
         update_secrets(
             clan_dir,
             load_age_plugins(flake) if should_load_age_plugins else [],
+            jobs=args.jobs,
         ),
         flake.path,
         "secrets: update with new keys",
@@ -158,4 +161,14 @@ def register_key_parser(parser: argparse.ArgumentParser) -> None:
         "update",
         help="re-encrypt all secrets with current keys (useful when changing keys)",
     )
+    parser_update.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        help=(
+            "number of secrets to re-encrypt in parallel "
+            "(default: number of CPUs, or 1 when age plugins are used)"
+        ),
+        default=None,
+    )
     parser_update.set_defaults(func=update_command)
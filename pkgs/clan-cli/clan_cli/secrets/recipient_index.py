@@ -0,0 +1,162 @@
+"""Persistent index of the recipients of sops secrets.
+
+Checking whether a secret needs to be re-encrypted compares the recipients
+it is encrypted for with the keys of the machines, users and groups it is
+shared with. Both are expensive to collect for many secrets: every secret's
+JSON has to be parsed, and every symlink of the machines/users/groups
+folders has to be followed to its key.json.
+
+The index keeps the parsed recipients, key files and folder listings in the
+clan tmp dir, `secrets.collect_keys_for_path` reads through it when given
+one. Every entry is stamped with the inode, size and timestamps of the file
+or folder it was read from, and re-read once they change. Entries of
+files modified within the last `RACY_SECONDS` are not stored, as further
+modifications within the timestamp granularity of the filesystem would go
+unnoticed.
+"""
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from functools import cache
+from pathlib import Path
+from typing import Any
+
+from clan_lib.dirs import clan_tmp_dir
+
+from . import sops
+
+log = logging.getLogger(__name__)
+
+INDEX_VERSION = 2
+RACY_SECONDS = 2
+# Minimum time between two writes of the index, see RecipientIndex.save
+SAVE_INTERVAL_SECONDS = 5
+
+type Stamp = list[int]
+
+
+def _stamp(path: Path) -> Stamp | None:
+    try:
+        st = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return [st.st_ino, st.st_size, st.st_mtime_ns, st.st_ctime_ns]
+
+
+def _dump_keys(keys: set[sops.SopsKey]) -> list[list[str]]:
+    return sorted(
+        [key.key_type.name, key.pubkey, key.username, key.source] for key in keys
+    )
+
+
+def _load_keys(data: list[list[str]]) -> set[sops.SopsKey]:
+    return {
+        sops.SopsKey(
+            pubkey=pubkey,
+            username=username,
+            key_type=sops.KeyType[key_type],
+            source=source,
+        )
+        for key_type, pubkey, username, source in data
+    }
+
+
+def _read_entries(folder: Path) -> dict[str, bool]:
+    return {p.name: p.is_symlink() for p in folder.iterdir()}
+
+
+class RecipientIndex:
+    def __init__(self, clan_dir: Path, index_file: Path) -> None:
+        self.clan_dir = clan_dir
+        self.index_file = index_file
+        self._lock = threading.Lock()
+        # key -> [stamp, value]
+        self._entries: dict[str, list[Any]] = {}
+        self._dirty = False
+        self._last_save = float("-inf")
+        try:
+            data = json.loads(index_file.read_text())
+            if data.get("version") == INDEX_VERSION:
+                self._entries = data["entries"]
+        except FileNotFoundError:
+            pass
+        except (json.JSONDecodeError, KeyError, AttributeError) as e:
+            log.debug(f"Ignoring invalid recipient index {index_file}: {e}")
+
+    def _cached(self, kind: str, path: Path, load: Any) -> Any:
+        """Return the cached result of load(), if path did not change since."""
+        key = f"{kind}:{path}"
+        stamp = _stamp(path)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None and stamp is not None and entry[0] == stamp:
+            return entry[1]
+        value = load()
+        racy = stamp is None or max(stamp[2:]) > time.time_ns() - RACY_SECONDS * 10**9
+        with self._lock:
+            if racy:
+                self._dirty |= self._entries.pop(key, None) is not None
+            else:
+                self._entries[key] = [stamp, value]
+                self._dirty = True
+        return value
+
+    def recipients(self, secret_path: Path) -> set[sops.SopsKey]:
+        """The recipients secret_path is currently encrypted for."""
+        return _load_keys(
+            self._cached(
+                "recipients",
+                secret_path / "secret",
+                lambda: _dump_keys(sops.get_recipients(secret_path)),
+            )
+        )
+
+    def keys(self, key_dir: Path) -> set[sops.SopsKey]:
+        """The keys of a machine or user folder, like `sops.read_keys`."""
+        return _load_keys(
+            self._cached(
+                "keys",
+                key_dir / "key.json",
+                lambda: _dump_keys(sops.read_keys(key_dir)),
+            )
+        )
+
+    def entries(self, folder: Path) -> dict[str, bool]:
+        """The entries of folder by name, and whether they are symlinks."""
+        return self._cached("entries", folder, lambda: _read_entries(folder))
+
+    def save(self, force: bool = False) -> None:
+        """Write the index back to disk, if anything changed.
+
+        Unless forced, the index is written at most every
+        SAVE_INTERVAL_SECONDS, the remaining changes are written on exit.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.monotonic()
+            if not force and now - self._last_save < SAVE_INTERVAL_SECONDS:
+                return
+            data = json.dumps({"version": INDEX_VERSION, "entries": self._entries})
+            self._dirty = False
+            self._last_save = now
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.index_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(data)
+        tmp_file.replace(self.index_file)
+
+
+@cache
+def recipient_index(clan_dir: Path) -> RecipientIndex:
+    """The recipient index of a clan, shared within the process."""
+    digest = hashlib.sha256(str(clan_dir.resolve()).encode()).hexdigest()[:16]
+    index = RecipientIndex(
+        clan_dir, clan_tmp_dir() / "sops-recipients" / f"{digest}.json"
+    )
+    atexit.register(index.save, force=True)
+    return index
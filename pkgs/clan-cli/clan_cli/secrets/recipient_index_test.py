@@ -0,0 +1,72 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from clan_cli.secrets import recipient_index, sops
+from clan_cli.secrets.secrets import collect_keys_for_path
+
+
+def write_key(path: Path, pubkey: str) -> None:
+    path.mkdir(parents=True)
+    (path / "key.json").write_text(json.dumps({"publickey": pubkey, "type": "age"}))
+
+
+def write_secret(path: Path, recipients: list[str]) -> None:
+    path.mkdir(parents=True, exist_ok=True)
+    sops_attrs = {"age": [{"recipient": r} for r in recipients]}
+    (path / "secret").write_text(json.dumps({"data": "", "sops": sops_attrs}))
+
+
+def link(path: Path, target: Path) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.symlink_to(os.path.relpath(target, path.parent))
+
+
+def test_recipient_index(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    # files are only indexed once they are older than RACY_SECONDS
+    monkeypatch.setattr(recipient_index, "RACY_SECONDS", 0)
+    sops_dir = tmp_path / "sops"
+    write_key(sops_dir / "machines" / "jon", "age1jon")
+    write_key(sops_dir / "users" / "alice", "age1alice")
+    write_key(sops_dir / "users" / "bob", "age1bob")
+    link(sops_dir / "groups" / "admins" / "users" / "bob", sops_dir / "users" / "bob")
+    secret = tmp_path / "vars" / "per-machine" / "jon" / "foo" / "bar"
+    write_secret(secret, ["age1jon", "age1alice"])
+    link(secret / "machines" / "jon", sops_dir / "machines" / "jon")
+    link(secret / "users" / "alice", sops_dir / "users" / "alice")
+    link(secret / "groups" / "admins", sops_dir / "groups" / "admins")
+
+    index_file = tmp_path / "index.json"
+    index = recipient_index.RecipientIndex(tmp_path, index_file)
+    assert collect_keys_for_path(secret, index) == collect_keys_for_path(secret)
+    assert index.recipients(secret) == sops.get_recipients(secret)
+    index.save(force=True)
+
+    # a new index answers from the persisted entries
+    def fail(*_args: object) -> None:
+        msg = "not cached"
+        raise AssertionError(msg)
+
+    monkeypatch.setattr(sops, "get_recipients", fail)
+    monkeypatch.setattr(sops, "read_keys", fail)
+    index = recipient_index.RecipientIndex(tmp_path, index_file)
+    keys = collect_keys_for_path(secret, index)
+    assert {(key.pubkey, key.source) for key in keys} == {
+        ("age1jon", "machines/jon"),
+        ("age1alice", "users/alice"),
+        ("age1bob", "users/bob"),
+    }
+    assert {key.pubkey for key in index.recipients(secret)} == {"age1jon", "age1alice"}
+
+    # changed files are read again
+    monkeypatch.undo()
+    write_secret(secret, ["age1jon", "age1alice", "age1bob"])
+    (secret / "users" / "alice").unlink()
+    assert {key.pubkey for key in index.recipients(secret)} == {
+        "age1jon",
+        "age1alice",
+        "age1bob",
+    }
+    assert collect_keys_for_path(secret, index) == collect_keys_for_path(secret)
@@ -5,7 +5,7 @@ import logging
 import os
 import shutil
 import sys
-from collections.abc import Callable
+from collections.abc import Callable, Sequence
 from pathlib import Path
 from typing import IO
 
@@ -22,13 +22,16 @@ from .folders import (
     sops_secrets_folder,
     sops_users_folder,
 )
+from .recipient_index import RecipientIndex, recipient_index
 from .sops import (
     decrypt_file,
     decrypt_file_raw,
+    decrypt_files_raw,
     encrypt_file,
     load_age_plugins,
     read_keys,
     update_keys,
+    update_keys_many,
 )
 from .types import VALID_SECRET_NAME, secret_name_type
 
@@ -76,11 +79,19 @@ def update_secrets(
     flake_dir: Path,
     age_plugins: list[str],
     filter_secrets: Callable[[Path], bool] = lambda _: True,
+    jobs: int | None = None,
 ) -> list[Path]:
+    """Re-encrypt the secrets matching filter_secrets for their current members.
+
+    Secrets that are already encrypted for exactly their members are skipped,
+    the others are re-encrypted by up to `jobs` sops processes at a time.
+    """
     changed_files = []
     secret_paths = [sops_secrets_folder(flake_dir) / s for s in list_secrets(flake_dir)]
     secret_paths.extend(list_vars_secrets(flake_dir))
 
+    index = recipient_index(flake_dir)
+    outdated: list[tuple[Path, set[sops.SopsKey]]] = []
     for path in secret_paths:
         if not filter_secrets(path):
             continue
@@ -89,9 +100,14 @@ def update_secrets(
         changed_files.extend(cleanup_dangling_symlinks(path / "users"))
         changed_files.extend(cleanup_dangling_symlinks(path / "groups"))
         changed_files.extend(cleanup_dangling_symlinks(path / "machines"))
-        changed_files.extend(
-            update_keys(path, collect_keys_for_path(path), age_plugins=age_plugins),
-        )
+        keys = collect_keys_for_path(path, index)
+        if index.recipients(path) != keys:
+            outdated.append((path, keys))
+    index.save()
+
+    if outdated:
+        log.info(f"Updating the keys of {len(outdated)} secrets")
+    changed_files.extend(update_keys_many(outdated, age_plugins=age_plugins, jobs=jobs))
     return changed_files
 
 
@@ -106,13 +122,29 @@ def cleanup_dangling_symlinks(folder: Path) -> list[Path]:
     return removed
 
 
-def collect_keys_for_type(folder: Path) -> set[sops.SopsKey]:
+def _symlinks(folder: Path, index: RecipientIndex | None) -> list[Path]:
+    if index is None:
+        return [p for p in folder.iterdir() if p.is_symlink()]
+    return [folder / name for name, link in index.entries(folder).items() if link]
+
+
+def _subfolders(folder: Path, index: RecipientIndex | None) -> list[Path]:
+    if index is None:
+        return list(folder.iterdir())
+    return [folder / name for name in index.entries(folder)]
+
+
+def collect_keys_for_type(
+    folder: Path, index: RecipientIndex | None = None
+) -> set[sops.SopsKey]:
+    """Collect the keys of the machines or users linked in folder.
+
+    With an index, the folder listings and key files are read through it.
+    """
     if not folder.exists():
         return set()
     keys = set()
-    for p in folder.iterdir():
-        if not p.is_symlink():
-            continue
+    for p in _symlinks(folder, index):
         try:
             target = p.resolve(strict=True)
         except FileNotFoundError:
@@ -124,7 +156,7 @@ def collect_keys_for_type(folder: Path) -> set[sops.SopsKey]:
                 f"Expected {p} to point to {folder} but points to {target.parent}",
             )
             continue
-        for key in read_keys(target):
+        for key in read_keys(target) if index is None else index.keys(target):
             keys.add(
                 sops.SopsKey(
                     pubkey=key.pubkey,
@@ -136,16 +168,18 @@ def collect_keys_for_type(folder: Path) -> set[sops.SopsKey]:
     return keys
 
 
-def collect_keys_for_path(path: Path) -> set[sops.SopsKey]:
+def collect_keys_for_path(
+    path: Path, index: RecipientIndex | None = None
+) -> set[sops.SopsKey]:
     keys = set()
-    keys.update(collect_keys_for_type(path / "machines"))
-    keys.update(collect_keys_for_type(path / "users"))
+    keys.update(collect_keys_for_type(path / "machines", index))
+    keys.update(collect_keys_for_type(path / "users", index))
     groups = path / "groups"
     if not groups.is_dir():
         return keys
-    for group in groups.iterdir():
-        keys.update(collect_keys_for_type(group / "machines"))
-        keys.update(collect_keys_for_type(group / "users"))
+    for group in _subfolders(groups, index):
+        keys.update(collect_keys_for_type(group / "machines", index))
+        keys.update(collect_keys_for_type(group / "users", index))
     return keys
 
 
@@ -419,6 +453,21 @@ def decrypt_secret_raw(secret_path: Path, age_plugins: list[str]) -> bytes:
     return decrypt_file_raw(path, age_plugins=age_plugins)
 
 
+def decrypt_secrets_raw(
+    secret_paths: Sequence[Path], age_plugins: list[str]
+) -> dict[Path, bytes]:
+    """Decrypt many secrets at once, see `sops.decrypt_files_raw`."""
+    for secret_path in secret_paths:
+        if not (secret_path / "secret").exists():
+            msg = f"Secret '{secret_path!s}' does not exist"
+            raise ClanError(msg)
+    values = decrypt_files_raw(
+        [secret_path / "secret" for secret_path in secret_paths],
+        age_plugins=age_plugins,
+    )
+    return {secret_path: values[secret_path / "secret"] for secret_path in secret_paths}
+
+
 def get_command(args: argparse.Namespace) -> None:
     clan_dir = get_clan_dir(args.flake)
     print(
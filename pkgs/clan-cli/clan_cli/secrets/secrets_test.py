@@ -0,0 +1,53 @@
+import json
+import os
+from collections.abc import Iterable
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from clan_cli.secrets import recipient_index, secrets, sops
+
+
+def write_key(path: Path, pubkey: str) -> None:
+    path.mkdir(parents=True)
+    (path / "key.json").write_text(json.dumps({"publickey": pubkey, "type": "age"}))
+
+
+def write_secret(path: Path, recipients: list[str], members: list[Path]) -> None:
+    path.mkdir(parents=True)
+    sops_attrs = {"age": [{"recipient": r} for r in recipients]}
+    (path / "secret").write_text(json.dumps({"data": "", "sops": sops_attrs}))
+    for member in members:
+        link = path / member.parent.name / member.name
+        link.parent.mkdir(exist_ok=True)
+        link.symlink_to(os.path.relpath(member, link.parent))
+
+
+def test_update_secrets_skips_up_to_date(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(recipient_index, "RACY_SECONDS", 0)
+    monkeypatch.setattr(recipient_index, "clan_tmp_dir", lambda: tmp_path / "tmp")
+    alice = tmp_path / "sops" / "users" / "alice"
+    bob = tmp_path / "sops" / "users" / "bob"
+    write_key(alice, "age1alice")
+    write_key(bob, "age1bob")
+    secrets_dir = tmp_path / "sops" / "secrets"
+    write_secret(secrets_dir / "current", ["age1alice"], [alice])
+    # bob was added as a member, but the secret is not encrypted for him yet
+    write_secret(secrets_dir / "outdated", ["age1alice"], [alice, bob])
+
+    updated: list[tuple[Path, set[str]]] = []
+
+    def update_keys_many(
+        outdated: Iterable[tuple[Path, Iterable[sops.SopsKey]]], **_kwargs: object
+    ) -> list[Path]:
+        updated.extend((path, {key.pubkey for key in keys}) for path, keys in outdated)
+        return [path / "secret" for path, _ in updated]
+
+    with patch.object(secrets, "update_keys_many", side_effect=update_keys_many):
+        changed = secrets.update_secrets(tmp_path, age_plugins=[])
+
+    assert updated == [(secrets_dir / "outdated", {"age1alice", "age1bob"})]
+    assert changed == [secrets_dir / "outdated" / "secret"]
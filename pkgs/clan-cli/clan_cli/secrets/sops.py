@@ -7,7 +7,9 @@ import os
 import re
 import shutil
 import subprocess
-from collections.abc import Iterable
+import time
+from collections.abc import Iterable, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from contextlib import suppress
 from pathlib import Path
 from tempfile import NamedTemporaryFile
@@ -233,6 +235,25 @@ def load_age_plugins(flake: Flake) -> list[str]:
     raise ClanError(msg)
 
 
+def _sops_command(sops_cmd: list[str], age_plugins: list[str]) -> list[str]:
+    """Wrap a sops command, so that sops and the age plugins are available."""
+    # Separate nixpkgs packages from flake references
+    nixpkgs_plugins = [p for p in age_plugins if "#" not in p]
+    flake_refs = [p for p in age_plugins if "#" in p]
+
+    cmd = nix_shell(["sops", "gnupg", *nixpkgs_plugins], sops_cmd)
+
+    # Wrap with nix shell for flake refs if needed
+    if flake_refs and not os.environ.get("IN_NIX_SANDBOX"):
+        cmd = [
+            *nix_command(["shell", "--inputs-from", str(runtime_deps_flake())]),
+            *flake_refs,
+            "-c",
+            *cmd,
+        ]
+    return cmd
+
+
 def sops_run(
     call: Operation,
     secret_path: Path,
@@ -247,7 +268,7 @@ def sops_run(
     # exist in multiple places.
     sops_cmd = ["sops"]
     environ = os.environ.copy()
-    with NamedTemporaryFile(delete=False, mode="w") as manifest:
+    with NamedTemporaryFile(mode="w") as manifest:
         if call == Operation.DECRYPT:
             sops_cmd.append("decrypt")
         else:
@@ -291,21 +312,7 @@ def sops_run(
                 )
                 raise ClanError(msg)
         sops_cmd.append(str(secret_path))
-
-        # Separate nixpkgs packages from flake references
-        nixpkgs_plugins = [p for p in age_plugins if "#" not in p]
-        flake_refs = [p for p in age_plugins if "#" in p]
-
-        cmd = nix_shell(["sops", "gnupg", *nixpkgs_plugins], sops_cmd)
-
-        # Wrap with nix shell for flake refs if needed
-        if flake_refs and not os.environ.get("IN_NIX_SANDBOX"):
-            cmd = [
-                *nix_command(["shell", "--inputs-from", str(runtime_deps_flake())]),
-                *flake_refs,
-                "-c",
-                *cmd,
-            ]
+        cmd = _sops_command(sops_cmd, age_plugins)
 
         opts = (
             dataclasses.replace(run_opts, env=environ)
@@ -493,6 +500,58 @@ def update_keys(
     return [secret_path] if was_modified else []
 
 
+def update_keys_many(
+    secrets: Sequence[tuple[Path, Iterable[SopsKey]]],
+    age_plugins: list[str],
+    jobs: int | None = None,
+) -> list[Path]:
+    """Update the keys of many secrets, like `update_keys` for each of them.
+
+    Up to `jobs` secrets are re-encrypted at the same time (default: the
+    number of CPUs). The changed files are returned in the order of secrets.
+    With age plugins or PGP recipients the secrets are updated one after
+    another by default, as plugins might ask for user interaction like
+    touching a hardware key, and gpg for a passphrase.
+    """
+    if jobs is None:
+        serial = age_plugins or any(
+            _has_pgp_recipients(secret_path / "secret") for secret_path, _ in secrets
+        )
+        jobs = 1 if serial else os.cpu_count() or 1
+    if not secrets:
+        return []
+
+    start = last_report = time.monotonic()
+
+    def report(done: int) -> None:
+        nonlocal last_report
+        now = time.monotonic()
+        # report about once a second, and when finished
+        if done < len(secrets) and now - last_report < 1:
+            return
+        last_report = now
+        rate = done / (now - start) if now > start else 0.0
+        log.info(
+            f"Updated keys of {done}/{len(secrets)} secrets ({rate:.1f} secrets/s)"
+        )
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="sops") as pool:
+        futures = [
+            pool.submit(update_keys, secret_path, keys, age_plugins)
+            for secret_path, keys in secrets
+        ]
+        try:
+            for done, future in enumerate(as_completed(futures), start=1):
+                future.result()
+                report(done)
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+    # in the order of secrets, regardless of which finished first
+    return [path for future in futures for path in future.result()]
+
+
 def encrypt_file(
     secret_path: Path,
     content: str | IO[bytes] | bytes | None,
@@ -591,6 +650,40 @@ def decrypt_file_raw(secret_path: Path, age_plugins: list[str]) -> bytes:
     return raw
 
 
+def _has_pgp_recipients(secret_path: Path) -> bool:
+    try:
+        return bool(json.loads(secret_path.read_bytes())["sops"].get("pgp"))
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return False
+
+
+def decrypt_files_raw(
+    secret_paths: Sequence[Path],
+    age_plugins: list[str],
+    jobs: int | None = None,
+) -> dict[Path, bytes]:
+    """Decrypt many sops-encrypted files, returns the raw bytes by path.
+
+    The files are decrypted with `decrypt_file_raw` by up to `jobs` sops
+    processes at the same time (default: the number of CPUs). With age
+    plugins, or if any file is encrypted for PGP keys, the files are
+    decrypted one after another, as plugins and gpg might ask for user
+    interaction like touching a hardware key or entering a passphrase.
+    """
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if age_plugins or any(map(_has_pgp_recipients, secret_paths)):
+        jobs = 1
+
+    def decrypt(secret_path: Path) -> bytes:
+        return decrypt_file_raw(secret_path, age_plugins=age_plugins)
+
+    if jobs == 1 or len(secret_paths) <= 1:
+        return {secret_path: decrypt(secret_path) for secret_path in secret_paths}
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="sops") as pool:
+        return dict(zip(secret_paths, pool.map(decrypt, secret_paths), strict=True))
+
+
 def get_recipients(secret_path: Path) -> set[SopsKey]:
     sops_attrs = json.loads((secret_path / "secret").read_text())["sops"]
     keys = set()
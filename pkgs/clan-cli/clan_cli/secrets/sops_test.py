@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from clan_lib.errors import ClanError
+
+from clan_cli.secrets import sops
+
+
+def write_secret(path: Path, key_type: str) -> Path:
+    sops_attrs = {key_type: [{"recipient": "key"}]}
+    path.write_text(json.dumps({"data": path.name, "sops": sops_attrs}))
+    return path
+
+
+def fake_sops_run(
+    call: sops.Operation, secret_path: Path, *_args: object, **_kwargs: object
+) -> tuple[int, str, bytes]:
+    assert call == sops.Operation.DECRYPT
+    return 0, "", json.loads(secret_path.read_text())["data"].encode()
+
+
+def test_decrypt_files_raw(tmp_path: Path) -> None:
+    paths = [write_secret(tmp_path / f"secret{i}", "age") for i in range(4)]
+    threads: set[str] = set()
+
+    def sops_run(*args: object, **kwargs: object) -> tuple[int, str, bytes]:
+        threads.add(threading.current_thread().name)
+        return fake_sops_run(*args, **kwargs)  # type: ignore[arg-type]
+
+    with patch.object(sops, "sops_run", side_effect=sops_run) as mock:
+        assert sops.decrypt_files_raw(paths, age_plugins=[], jobs=2) == {
+            path: path.name.encode() for path in paths
+        }
+    assert mock.call_count == len(paths)
+    assert all(name.startswith("sops") for name in threads)
+
+    # gpg might ask for a passphrase, so PGP secrets are decrypted one by one
+    paths.append(write_secret(tmp_path / "pgp", "pgp"))
+    threads.clear()
+    with patch.object(sops, "sops_run", side_effect=sops_run):
+        assert len(sops.decrypt_files_raw(paths, age_plugins=[], jobs=2)) == 5
+    assert threads == {threading.current_thread().name}
+
+
+def test_update_keys_many(tmp_path: Path) -> None:
+    secrets: list[tuple[Path, list[sops.SopsKey]]] = [
+        (tmp_path / f"secret{i}", []) for i in range(6)
+    ]
+    running = 0
+    max_running = 0
+    lock = threading.Lock()
+
+    def update_keys(
+        secret_path: Path, _keys: object, _age_plugins: list[str]
+    ) -> list[Path]:
+        nonlocal running, max_running
+        with lock:
+            running += 1
+            max_running = max(max_running, running)
+        # later secrets finish first
+        time.sleep(0.01 * (6 - int(secret_path.name[-1])))
+        with lock:
+            running -= 1
+        if secret_path.name == "secret4":
+            msg = "sops failed"
+            raise ClanError(msg)
+        # odd secrets are up to date
+        return [] if int(secret_path.name[-1]) % 2 else [secret_path / "secret"]
+
+    with patch.object(sops, "update_keys", side_effect=update_keys):
+        assert sops.update_keys_many(secrets[:4], age_plugins=[], jobs=4) == [
+            tmp_path / "secret0" / "secret",
+            tmp_path / "secret2" / "secret",
+        ]
+        assert max_running > 1
+
+        with pytest.raises(ClanError, match="sops failed"):
+            sops.update_keys_many(secrets, age_plugins=[], jobs=4)
+
+        # plugins might ask to touch a hardware key, one secret at a time
+        max_running = 0
+        sops.update_keys_many(secrets[:4], age_plugins=["age-plugin-yubikey"])
+        assert max_running == 1
+
+        # gpg might ask for a passphrase to decrypt the data key
+        max_running = 0
+        secrets[1][0].mkdir()
+        write_secret(secrets[1][0] / "secret", "pgp")
+        sops.update_keys_many(secrets[:4], age_plugins=[])
+        assert max_running == 1
+
+    assert sops.update_keys_many([], age_plugins=[]) == []
@@ -1,5 +1,7 @@
 import subprocess
 import tempfile
+import threading
+from contextvars import copy_context
 from pathlib import Path
 
 import pytest
@@ -91,3 +93,81 @@ def test_clan_flake_in_subdir(git_repo: Path, monkeypatch: pytest.MonkeyPatch) -
         ).decode("utf-8")
         == "test commit\n\n"
     )
+
+
+def test_commit_session(git_repo: Path) -> None:
+    (git_repo / "init.txt").touch()
+    git.commit_file(git_repo / "init.txt", git_repo, "init")
+
+    with git.commit_session(git_repo, "update files"):
+        for name in ["a.txt", "b.txt"]:
+            (git_repo / name).write_text(name)
+            git.commit_file(git_repo / name, git_repo, f"add {name}")
+        # nested sessions are merged into the outer one
+        with git.commit_session(git_repo, "inner"):
+            (git_repo / "init.txt").write_text("changed")
+            git.commit_file(git_repo / "init.txt", git_repo, "change init.txt")
+        # nothing is committed before the session is closed
+        assert (
+            subprocess.check_output(
+                ["git", "rev-list", "--count", "HEAD"], cwd=git_repo
+            ).strip()
+            == b"1"
+        )
+
+    assert not subprocess.check_output(["git", "status", "--porcelain"], cwd=git_repo)
+    assert (
+        subprocess.check_output(
+            ["git", "log", "-1", "--pretty=%B"],
+            cwd=git_repo,
+        ).decode("utf-8")
+        == "update files\n\n- add a.txt\n- add b.txt\n- change init.txt\n\n"
+    )
+
+
+def git_log(git_repo: Path) -> list[str]:
+    """The subjects of the commits, latest first."""
+    return (
+        subprocess.check_output(["git", "log", "--pretty=%s"], cwd=git_repo)
+        .decode()
+        .splitlines()
+    )
+
+
+def test_commit_session_is_per_context(git_repo: Path) -> None:
+    (git_repo / "init.txt").touch()
+    git.commit_file(git_repo / "init.txt", git_repo, "init")
+
+    def commit(name: str) -> None:
+        (git_repo / name).write_text(name)
+        git.commit_file(git_repo / name, git_repo, f"add {name}")
+
+    with git.commit_session(git_repo, "update files"):
+        # unrelated threads commit on their own
+        thread = threading.Thread(target=commit, args=["other.txt"])
+        thread.start()
+        thread.join()
+        assert git_log(git_repo)[0] == "add other.txt"
+        # threads started with the session's context record into it
+        context = copy_context()
+        thread = threading.Thread(target=context.run, args=[commit, "a.txt"])
+        thread.start()
+        thread.join()
+        assert git_log(git_repo)[0] == "add other.txt"
+
+    assert git_log(git_repo)[0] == "add a.txt"
+    assert not subprocess.check_output(["git", "status", "--porcelain"], cwd=git_repo)
+
+    # the session is closed, late commits of its threads are not lost
+    context.run(commit, "late.txt")
+    assert git_log(git_repo)[0] == "add late.txt"
+
+
+def test_commit_unchanged_file(git_repo: Path) -> None:
+    (git_repo / "a.txt").write_text("a")
+    git.commit_file(git_repo / "a.txt", git_repo, "add a.txt")
+    # other staged changes don't count as changes of a.txt
+    (git_repo / "b.txt").write_text("b")
+    subprocess.check_call(["git", "add", "b.txt"], cwd=git_repo)
+    git.commit_file(git_repo / "a.txt", git_repo, "change a.txt")
+    assert git_log(git_repo)[0] == "add a.txt"
@@ -1,10 +1,14 @@
 import argparse
 import logging
 
+from clan_cli.arg_types import positive_int
 from clan_cli.completions import add_dynamic_completer, complete_machines
 from clan_lib.flake import require_flake
 from clan_lib.machines.list import list_full_machines
-from clan_lib.vars.check import check_vars
+from clan_lib.vars.check import check_vars, check_vars_many
+
+# check_vars is re-exported for backwards compatibility
+__all__ = ["check_vars"]
 
 log = logging.getLogger(__name__)
 
@@ -21,12 +25,13 @@ def check_command(args: argparse.Namespace) -> None:
             ),
         )
 
-    all_ok = True
-    for machine in machines:
-        ok = check_vars(machine.name, flake, generator_name=args.generator)
-        if not ok:
-            all_ok = False
-    if not all_ok:
+    results = check_vars_many(
+        [machine.name for machine in machines],
+        flake,
+        generator_name=args.generator,
+        jobs=args.jobs,
+    )
+    if not all(results.values()):
         raise SystemExit(1)
 
 
@@ -45,4 +50,11 @@ def register_check_parser(parser: argparse.ArgumentParser) -> None:
         "-g",
         help="the generator to check",
     )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        help="number of machines to check in parallel (default: chosen by the number of CPUs)",
+        default=None,
+    )
     parser.set_defaults(func=check_command)
@@ -1,6 +1,7 @@
 import argparse
 from typing import TYPE_CHECKING
 
+from clan_cli.arg_types import positive_int
 from clan_cli.completions import (
     add_dynamic_completer,
     complete_machines,
@@ -36,6 +37,7 @@ def generate_command(args: argparse.Namespace) -> None:
         full_closure=args.regenerate if args.regenerate is not None else False,
         no_sandbox=args.no_sandbox,
         auto_accept_prompts=auto_accept_prompts,
+        jobs=args.jobs,
     )
 
 
@@ -73,6 +75,14 @@ def register_generate_parser(parser: argparse.ArgumentParser) -> None:
         default=False,
     )
 
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=positive_int,
+        help="number of generators to execute in parallel. Generators wait for the generators they depend on",
+        default=1,
+    )
+
     parser.add_argument(
         "--fake-prompts",
         action="store_true",
@@ -1,12 +1,16 @@
 import logging
+import os
 import threading
 import time
 import types
 import uuid
-from collections.abc import Callable
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
 from dataclasses import dataclass, field
+from enum import StrEnum
 from typing import IO, Any, ParamSpec, Self, TypeVar
 
+from clan_lib.async_run.scheduler import TASK, Scheduler
 from clan_lib.errors import ClanError
 
 log = logging.getLogger(__name__)
@@ -28,6 +32,10 @@ log = logging.getLogger(__name__)
 # Using threads works well for us because most of the time is spent waiting for commands
 # or external processes to finish, rather than performing heavy computing tasks.
 #
+# With the asyncio backend (CLAN_ASYNC_BACKEND=asyncio) tasks still run in threads,
+# but the subprocesses started by them are handled by one shared asyncio event loop
+# (see clan_lib.async_run.event_loop), instead of a select loop in every thread.
+#
 # Note: Starting with Python 3.14, the GIL can be disabled to enable true parallelism.
 # However, disabling the GIL introduces a 10-40% performance cost for Python code
 # due to the overhead of additional locking.
@@ -59,6 +67,24 @@ class AsyncResult[R]:
         return self._result
 
 
+class AsyncBackend(StrEnum):
+    """How the tasks of an AsyncRuntime wait for their subprocesses."""
+
+    # every task thread waits for its subprocesses in its own select loop
+    THREADS = "threads"
+    # the subprocesses of all tasks are handled by one shared asyncio event loop
+    ASYNCIO = "asyncio"
+
+
+def default_async_backend() -> AsyncBackend:
+    value = os.environ.get("CLAN_ASYNC_BACKEND", AsyncBackend.THREADS)
+    try:
+        return AsyncBackend(value)
+    except ValueError:
+        msg = f"Invalid CLAN_ASYNC_BACKEND '{value}', expected one of: {', '.join(AsyncBackend)}"
+        raise ClanError(msg) from None
+
+
 @dataclass
 class AsyncContext:
     """Stores thread-local data."""
@@ -70,6 +96,9 @@ class AsyncContext:
         False
     )  # Used to signal cancellation of task
     op_key: str | None = None
+    backend: AsyncBackend = AsyncBackend.THREADS  # used by clan_lib.cmd.run
+    scheduler: Scheduler | None = None  # limits the concurrency of resources
+    priority: int = 0  # priority of the task in the scheduler, lower runs first
 
 
 @dataclass
@@ -106,6 +135,20 @@ def set_should_cancel(should_cancel: Callable[[], bool]) -> None:
     get_async_ctx().should_cancel = should_cancel
 
 
+@contextmanager
+def resource_slot(resource: str) -> Iterator[None]:
+    """Hold a slot of resource in the scheduler of the current task, if any.
+
+    See clan_lib.async_run.scheduler for the available resources.
+    """
+    ctx = get_async_ctx()
+    if ctx.scheduler is None:
+        yield
+        return
+    with ctx.scheduler.slot(resource, ctx.priority):
+        yield
+
+
 def get_async_ctx() -> AsyncContext:
     """Retrieve the current AsyncContext, creating a new one if none exists."""
     if not hasattr(ASYNC_CTX_THREAD_LOCAL, "async_ctx"):
@@ -152,8 +195,11 @@ class AsyncThread[**P, R](threading.Thread):
             # Set async context for the new thread since context is not inherited across thread boundaries otherwise
             set_async_ctx(self.async_opts.async_ctx)
             set_should_cancel(self.stop_event.is_set)
-            # Arguments for ParamSpec "P@AsyncThread" are missing
-            self.result = AsyncResult(_result=self.function(*self.args, **self.kwargs))
+            with resource_slot(TASK):
+                # Arguments for ParamSpec "P@AsyncThread" are missing
+                self.result = AsyncResult(
+                    _result=self.function(*self.args, **self.kwargs)
+                )
         except Exception as ex:  # noqa: BLE001
             self.result = AsyncResult(_result=ex)
         finally:
@@ -217,6 +263,8 @@ class AsyncOptsRef[Q](AsyncOpts):
 class AsyncRuntime:
     tasks: dict[str, AsyncThread[Any, Any]] = field(default_factory=dict)
     condition: threading.Condition = field(default_factory=threading.Condition)
+    backend: AsyncBackend = field(default_factory=default_async_backend)
+    scheduler: Scheduler | None = None
 
     def async_run(
         self,
@@ -238,6 +286,9 @@ class AsyncRuntime:
             msg = f"A task with the name '{opts.tid}' is already running."
             raise ClanError(msg)
 
+        opts.async_ctx.backend = self.backend
+        if opts.async_ctx.scheduler is None:
+            opts.async_ctx.scheduler = self.scheduler
         stop_event = threading.Event()
         # Create and start the new AsyncThread
         thread = AsyncThread(
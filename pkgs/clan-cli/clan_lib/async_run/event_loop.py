@@ -0,0 +1,38 @@
+"""A process-wide asyncio event loop running in a background thread.
+
+Used by the asyncio backend of `AsyncRuntime`: instead of every task thread
+waiting for its subprocesses in its own select loop, the pipes of all
+subprocesses are watched by this single loop, while the task threads block
+on the result.
+"""
+
+import asyncio
+import threading
+from collections.abc import Coroutine
+from typing import Any
+
+_loop: asyncio.AbstractEventLoop | None = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the shared event loop, starting its thread on first use."""
+    global _loop  # noqa: PLW0603
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever,
+                name="clan-event-loop",
+                daemon=True,
+            ).start()
+            _loop = loop
+        return _loop
+
+
+def run_coroutine[R](coroutine: Coroutine[Any, Any, R]) -> R:
+    """Run a coroutine on the shared event loop and wait for its result.
+
+    Must not be called from the event loop thread itself.
+    """
+    return asyncio.run_coroutine_threadsafe(coroutine, get_event_loop()).result()
@@ -0,0 +1,107 @@
+"""Bounded concurrency for the tasks of an AsyncRuntime.
+
+A `Scheduler` limits how many tasks can use a resource at the same time.
+Resources are plain strings of the form ``kind`` or ``kind:key``, the limit is
+configured per kind and applies to every key on its own, e.g. with
+``{"build-host": 2}`` every build host runs at most two builds at once.
+
+Every task of an AsyncRuntime with a scheduler holds a TASK slot while it
+runs. Within a task, further slots are acquired with
+`clan_lib.async_run.resource_slot`, which does nothing if the runtime has no
+scheduler. Waiting tasks get slots in the order of their priority (lower
+first), then in the order they started waiting. Tasks that are cancelled
+while waiting give up their place and raise a ClanError instead.
+"""
+
+import heapq
+import itertools
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from clan_lib.errors import ClanError
+
+# A whole task, e.g. the update of one machine
+TASK = "task"
+# A nix build on the local machine
+LOCAL_BUILD = "local-build"
+# An upload from the local machine (sources, secrets, closures)
+UPLOAD = "upload"
+# A nix build on a remote build host
+BUILD_HOST = "build-host"
+
+# Seconds between checks for cancellation while waiting for a slot
+CANCEL_CHECK_INTERVAL = 0.5
+
+
+def build_host_resource(address: str) -> str:
+    return f"{BUILD_HOST}:{address}"
+
+
+@dataclass
+class _Resource:
+    limit: int
+    in_use: int = 0
+    # (priority, sequence number) of waiting tasks, smallest gets the next slot
+    waiting: list[tuple[int, int]] = field(default_factory=list)
+
+
+class Scheduler:
+    def __init__(self, limits: dict[str, int | None]) -> None:
+        """Limits are keyed by resource kind, None or a missing kind means unlimited."""
+        for kind, limit in limits.items():
+            if limit is not None and limit < 1:
+                msg = f"Limit for '{kind}' must be at least 1, got {limit}"
+                raise ValueError(msg)
+        self.limits = limits
+        self._resources: dict[str, _Resource] = {}
+        self._condition = threading.Condition()
+        self._sequence = itertools.count()
+
+    def _limit(self, resource: str) -> int | None:
+        return self.limits.get(resource.split(":", 1)[0])
+
+    @contextmanager
+    def slot(self, resource: str, priority: int = 0) -> Iterator[None]:
+        """Hold a slot of resource, blocks until one is available.
+
+        Raises ClanError if the current task is cancelled while waiting.
+        """
+        from clan_lib.async_run import is_async_cancelled  # noqa: PLC0415
+
+        limit = self._limit(resource)
+        if limit is None:
+            yield
+            return
+
+        with self._condition:
+            state = self._resources.setdefault(resource, _Resource(limit))
+            ticket = (priority, next(self._sequence))
+            heapq.heappush(state.waiting, ticket)
+            while True:
+                # cancelled tasks don't get a slot, even if one is free
+                if is_async_cancelled():
+                    state.waiting.remove(ticket)
+                    heapq.heapify(state.waiting)
+                    if state.in_use == 0 and not state.waiting:
+                        del self._resources[resource]
+                    # the next waiter might be first now
+                    self._condition.notify_all()
+                    msg = f"Cancelled while waiting for {resource}"
+                    raise ClanError(msg)
+                if state.in_use < state.limit and state.waiting[0] == ticket:
+                    break
+                self._condition.wait(CANCEL_CHECK_INTERVAL)
+            heapq.heappop(state.waiting)
+            state.in_use += 1
+            # the next waiter might fit as well
+            self._condition.notify_all()
+        try:
+            yield
+        finally:
+            with self._condition:
+                state.in_use -= 1
+                if state.in_use == 0 and not state.waiting:
+                    del self._resources[resource]
+                self._condition.notify_all()
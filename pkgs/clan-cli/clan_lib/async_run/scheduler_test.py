@@ -0,0 +1,124 @@
+import threading
+import time
+
+import pytest
+
+from clan_lib.async_run import AsyncContext, AsyncOpts, AsyncRuntime, resource_slot
+from clan_lib.async_run.scheduler import (
+    BUILD_HOST,
+    LOCAL_BUILD,
+    TASK,
+    UPLOAD,
+    Scheduler,
+    build_host_resource,
+)
+from clan_lib.errors import ClanError
+
+UPLOAD_LIMIT = 2
+
+
+def test_resource_limits() -> None:
+    scheduler = Scheduler({UPLOAD: UPLOAD_LIMIT, BUILD_HOST: 1})
+    lock = threading.Lock()
+    in_use: dict[str, int] = {}
+    max_in_use: dict[str, int] = {}
+
+    def task(resource: str) -> None:
+        with scheduler.slot(resource):
+            with lock:
+                in_use[resource] = in_use.get(resource, 0) + 1
+                max_in_use[resource] = max(
+                    max_in_use.get(resource, 0), in_use[resource]
+                )
+            time.sleep(0.02)
+            with lock:
+                in_use[resource] -= 1
+
+    resources = [
+        UPLOAD,
+        build_host_resource("a"),
+        build_host_resource("b"),
+        "unlimited",
+    ]
+    threads = [
+        threading.Thread(target=task, args=(resource,))
+        for resource in resources
+        for _ in range(6)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max_in_use[UPLOAD] == UPLOAD_LIMIT
+    # the limit applies to every build host on its own
+    assert max_in_use[build_host_resource("a")] == 1
+    assert max_in_use[build_host_resource("b")] == 1
+    assert max_in_use["unlimited"] > UPLOAD_LIMIT
+
+
+def test_invalid_limit() -> None:
+    with pytest.raises(ValueError, match="at least 1"):
+        Scheduler({TASK: 0})
+
+
+def test_runtime_priorities() -> None:
+    scheduler = Scheduler({TASK: 1, UPLOAD: 1})
+    started: list[str] = []
+    blocker = threading.Event()
+
+    def task(name: str) -> None:
+        if name == "first":
+            blocker.wait()
+        with resource_slot(UPLOAD):
+            started.append(name)
+
+    with AsyncRuntime(scheduler=scheduler) as runtime:
+        runtime.async_run(AsyncOpts(tid="first"), task, "first")
+        # wait until the first task holds the only task slot
+        time.sleep(0.1)
+        for i, priority in enumerate([1, 1, 0, 1, 0]):
+            runtime.async_run(
+                AsyncOpts(
+                    tid=f"{priority}-{i}", async_ctx=AsyncContext(priority=priority)
+                ),
+                task,
+                f"{priority}-{i}",
+            )
+        time.sleep(0.1)
+        blocker.set()
+        runtime.join_all()
+        runtime.check_all()
+
+    assert started == ["first", "0-2", "0-4", "1-0", "1-1", "1-3"]
+
+
+def test_cancel_queued_tasks() -> None:
+    scheduler = Scheduler({TASK: 1})
+    started: list[str] = []
+    blocker = threading.Event()
+
+    def task(name: str) -> None:
+        started.append(name)
+        if name == "first":
+            blocker.wait()
+
+    with AsyncRuntime(scheduler=scheduler) as runtime:
+        runtime.async_run(AsyncOpts(tid="first"), task, "first")
+        # wait until the first task holds the only task slot
+        time.sleep(0.1)
+        for name in ["second", "third"]:
+            runtime.async_run(AsyncOpts(tid=name), task, name)
+        time.sleep(0.1)
+    # leaving the runtime cancels the queued tasks
+    blocker.set()
+    runtime.join_all()
+
+    assert started == ["first"]
+    for name in ["second", "third"]:
+        error = runtime.tasks[name].result.error  # type: ignore[union-attr]
+        assert isinstance(error, ClanError)
+        assert "Cancelled while waiting for task" in str(error)
+    # the queue is empty again
+    with scheduler.slot(TASK), scheduler.slot(LOCAL_BUILD):
+        pass
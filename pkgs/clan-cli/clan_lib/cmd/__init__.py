@@ -1,8 +1,11 @@
+import asyncio
+import codecs
 import contextlib
+import io
 import logging
 import math
 import os
-import select
+import selectors
 import shlex
 import shutil
 import signal
@@ -11,14 +14,16 @@ import threading
 import time
 import timeit
 import weakref
-from collections.abc import Iterator
+from collections.abc import Callable, Iterable, Iterator
 from contextlib import ExitStack, contextmanager
 from dataclasses import dataclass
 from enum import Enum
+from functools import partial
 from pathlib import Path
-from typing import IO, Any
+from typing import IO, Any, cast
 
-from clan_lib.async_run import get_async_ctx, is_async_cancelled
+from clan_lib.async_run import AsyncBackend, get_async_ctx, is_async_cancelled
+from clan_lib.async_run.event_loop import run_coroutine
 from clan_lib.colors import Color
 from clan_lib.custom_logger import print_trace
 from clan_lib.errors import ClanCmdError, ClanError, CmdOut, indent_command
@@ -53,12 +58,283 @@ class MsgColor:
     stdout: Color | None = None
 
 
+# Reads start at MIN_READ_SIZE, so interactive output is logged promptly, and
+# grow up to MAX_READ_SIZE while a pipe keeps filling the whole read buffer.
+MIN_READ_SIZE = 64 * 1024
+MAX_READ_SIZE = 1024 * 1024
+# Interval in which timeouts and cancellation are checked while waiting for output
+POLL_INTERVAL = 0.1
+
+
+class _OutputPipe:
+    """Accumulates the output of a pipe of the process and logs it line by line."""
+
+    def __init__(
+        self,
+        pipe: IO[bytes],
+        sink: IO[bytes] | None,
+        log_extra: dict[str, Any] | None,
+    ) -> None:
+        self.fd = pipe.fileno()
+        self.sink = sink
+        # None if the output should not be logged
+        self.log_extra = log_extra
+        self.buf = bytearray()
+        self.read_size = MIN_READ_SIZE
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        self._partial_line = ""
+
+    def read(self) -> bool:
+        """Read the available output, returns False once the pipe is closed."""
+        data = os.read(self.fd, self.read_size)
+        if not data:
+            self._log(self._decoder.decode(b"", final=True), final=True)
+            return False
+        if len(data) == self.read_size:
+            self.read_size = min(self.read_size * 2, MAX_READ_SIZE)
+        self.buf += data
+        if self.sink:
+            self.sink.write(data)
+            self.sink.flush()
+        self._log(self._decoder.decode(data))
+        return True
+
+    def _log(self, text: str, final: bool = False) -> None:
+        if self.log_extra is None:
+            return
+        *lines, self._partial_line = (self._partial_line + text).split("\n")
+        if final and self._partial_line:
+            lines.append(self._partial_line)
+            self._partial_line = ""
+        for line in lines:
+            cmdlog.info(line.rstrip(), extra=self.log_extra)
+
+
+def _pidfd_open(process: subprocess.Popen) -> int | None:
+    """Return a file descriptor which becomes readable once the process exits."""
+    if not hasattr(os, "pidfd_open"):  # not available on macOS
+        return None
+    try:
+        return os.pidfd_open(process.pid)
+    except OSError:
+        return None
+
+
+class _IOStatus(Enum):
+    DONE = 0
+    TIMEOUT = 1
+    CANCELLED = 2
+
+
+class _InputFeed:
+    """Input of a process, produced chunk by chunk while the process reads it."""
+
+    def __init__(self, chunks: Iterable[bytes]) -> None:
+        self._chunks = iter(chunks)
+        self._view = memoryview(b"")
+
+    def write(self, fd: int) -> bool:
+        """Write as much input as possible to a non-blocking fd.
+
+        Returns False once all input is written, or the process closed its stdin.
+        """
+        while True:
+            if not self._view:
+                chunk = next(self._chunks, None)
+                if chunk is None:
+                    return False
+                self._view = memoryview(chunk)
+                continue
+            try:
+                written = os.write(fd, self._view)
+            except BlockingIOError:
+                return True
+            except BrokenPipeError:
+                return False
+            self._view = self._view[written:]
+            if self._view:
+                # the pipe is full
+                return True
+
+
+def _close_stdin(process: subprocess.Popen) -> None:
+    if process.stdin is not None:
+        with contextlib.suppress(BrokenPipeError):
+            process.stdin.close()
+
+
+def _handle_io_select(
+    process: subprocess.Popen,
+    pipes: list[_OutputPipe],
+    input_feed: _InputFeed | None,
+    deadline: float,
+) -> _IOStatus:
+    """Wait for the process in the current thread."""
+    pidfd = _pidfd_open(process)
+
+    with ExitStack() as stack:
+        selector = stack.enter_context(selectors.DefaultSelector())
+        if pidfd is not None:
+            stack.callback(os.close, pidfd)
+            selector.register(pidfd, selectors.EVENT_READ)
+        for pipe in pipes:
+            selector.register(pipe.fd, selectors.EVENT_READ, pipe)
+        if input_feed is not None and process.stdin is not None:
+            stdin_fd = process.stdin.fileno()
+            # partial writes, so we never block on stdin while the process waits for us reading its output
+            os.set_blocking(stdin_fd, False)
+            selector.register(stdin_fd, selectors.EVENT_WRITE)
+        io_fds = len(selector.get_map()) - (pidfd is not None)
+
+        # Loop until all pipes are closed
+        while io_fds > 0:
+            now = time.monotonic()
+            if now > deadline:
+                return _IOStatus.TIMEOUT
+
+            # Check if the command has been cancelled
+            if is_async_cancelled():
+                return _IOStatus.CANCELLED
+
+            # Wait for data to be available, the process to exit or the next check
+            events = selector.select(min(POLL_INTERVAL, deadline - now))
+            io_events = [(key, mask) for key, mask in events if key.fd != pidfd]
+            if not io_events:
+                exited = bool(events) or (pidfd is None and process.poll() is not None)
+                if exited:
+                    # Process has exited, but its children may still hold the pipes open
+                    break
+                continue
+
+            for key, _ in io_events:
+                if isinstance(key.data, _OutputPipe):
+                    if not key.data.read():
+                        selector.unregister(key.fd)
+                        io_fds -= 1
+                    continue
+
+                # Process stdin
+                if input_feed is None:
+                    msg = "Process stdin is unexpectedly None"
+                    raise ClanError(msg)
+                if not input_feed.write(key.fd):
+                    selector.unregister(key.fd)
+                    io_fds -= 1
+                    _close_stdin(process)
+    return _IOStatus.DONE
+
+
+class _EventLoopIO:
+    """Handles the I/O of a process on the shared event loop.
+
+    Same semantics as _handle_io_select, but driven by callbacks of the event
+    loop, so the I/O of any number of processes is handled by a single thread.
+    """
+
+    def __init__(
+        self,
+        process: subprocess.Popen,
+        pipes: list[_OutputPipe],
+        input_feed: _InputFeed | None,
+        deadline: float,
+        should_cancel: Callable[[], bool],
+    ) -> None:
+        self.process = process
+        self.pipes = pipes
+        self.input_feed = input_feed
+        self.deadline = deadline
+        self.should_cancel = should_cancel
+        self._open_pipes = set(pipes)
+        self._stdin_fd: int | None = None
+        self._pidfd: int | None = None
+        self._timer: asyncio.TimerHandle | None = None
+        self._done: asyncio.Future[_IOStatus] | None = None
+
+    async def run(self) -> _IOStatus:
+        loop = asyncio.get_running_loop()
+        self._done = loop.create_future()
+        for pipe in self.pipes:
+            os.set_blocking(pipe.fd, False)
+            loop.add_reader(pipe.fd, self._read, pipe)
+        if self.input_feed is not None and self.process.stdin is not None:
+            self._stdin_fd = self.process.stdin.fileno()
+            os.set_blocking(self._stdin_fd, False)
+            loop.add_writer(self._stdin_fd, self._write)
+        self._pidfd = _pidfd_open(self.process)
+        if self._pidfd is not None:
+            loop.add_reader(self._pidfd, self._exited)
+        self._timer = loop.call_later(POLL_INTERVAL, self._check)
+        self._check_finished()
+        return await self._done
+
+    def _read(self, pipe: _OutputPipe) -> None:
+        try:
+            open_pipe = pipe.read()
+        except BlockingIOError:
+            return
+        if not open_pipe:
+            asyncio.get_running_loop().remove_reader(pipe.fd)
+            self._open_pipes.discard(pipe)
+            self._check_finished()
+
+    def _write(self) -> None:
+        if self._stdin_fd is None or self.input_feed is None:
+            return
+        if not self.input_feed.write(self._stdin_fd):
+            asyncio.get_running_loop().remove_writer(self._stdin_fd)
+            self._stdin_fd = None
+            _close_stdin(self.process)
+            self._check_finished()
+
+    def _exited(self) -> None:
+        # Process has exited, but its children may still hold the pipes open,
+        # so only read what is already in the pipes.
+        for pipe in list(self._open_pipes):
+            with contextlib.suppress(BlockingIOError):
+                while pipe.read():
+                    pass
+                asyncio.get_running_loop().remove_reader(pipe.fd)
+                self._open_pipes.discard(pipe)
+        self._finish(_IOStatus.DONE)
+
+    def _check(self) -> None:
+        if self.should_cancel():
+            self._finish(_IOStatus.CANCELLED)
+        elif time.monotonic() > self.deadline:
+            self._finish(_IOStatus.TIMEOUT)
+        elif self._pidfd is None and self.process.poll() is not None:
+            self._exited()
+        else:
+            self._timer = asyncio.get_running_loop().call_later(
+                POLL_INTERVAL, self._check
+            )
+
+    def _check_finished(self) -> None:
+        if not self._open_pipes and self._stdin_fd is None:
+            self._finish(_IOStatus.DONE)
+
+    def _finish(self, status: _IOStatus) -> None:
+        if self._done is None or self._done.done():
+            return
+        loop = asyncio.get_running_loop()
+        for pipe in self._open_pipes:
+            loop.remove_reader(pipe.fd)
+        if self._stdin_fd is not None:
+            loop.remove_writer(self._stdin_fd)
+        if self._pidfd is not None:
+            loop.remove_reader(self._pidfd)
+            os.close(self._pidfd)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._done.set_result(status)
+
+
 def handle_io(
     process: subprocess.Popen,
     log: Log,
     *,
     prefix: str | None,
-    input_bytes: bytes | None,
+    input_data: bytes | Iterable[bytes] | None,
     stdout: IO[bytes] | None,
     stderr: IO[bytes] | None,
     timeout: float = math.inf,
@@ -67,29 +343,9 @@ def handle_io(
     cwd: Path | None = None,
     env: dict[str, str] | None = None,
 ) -> tuple[str, str, bytes]:
-    rlist = [
-        process.stdout,
-        process.stderr,
-    ]  # rlist is a list of file descriptors to be monitored for read events
-    wlist = (
-        [process.stdin] if input_bytes is not None else []
-    )  # wlist is a list of file descriptors to be monitored for write events
-    stdout_buf = b""
-    stderr_buf = b""
-    start = time.time()
-
-    # Function to handle file descriptors
-    def handle_fd(fd: IO[Any] | None, readlist: list[IO[Any] | None]) -> bytes:
-        if fd and fd in readlist:
-            read = os.read(fd.fileno(), 4096)
-            if len(read) != 0:
-                return read
-            rlist.remove(fd)
-        return b""
-
     # Extra information passed to the logger
-    stdout_extra = {}
-    stderr_extra = {}
+    stdout_extra: dict[str, Any] = {}
+    stderr_extra: dict[str, Any] = {}
     if prefix:
         stdout_extra["command_prefix"] = prefix
         stderr_extra["command_prefix"] = prefix
@@ -98,95 +354,64 @@ def handle_io(
     if msg_color and msg_color.stdout:
         stderr_extra["color"] = msg_color.stdout.value
 
-    # Loop until no more data is available
-    while len(rlist) != 0 or len(wlist) != 0:
-        # Check if the command has timed out
-        if time.time() - start > timeout:
-            cmd_out = CmdOut(
-                stdout=stdout_buf.decode("utf-8", "replace"),
-                stderr=stderr_buf.decode("utf-8", "replace"),
-                cwd=cwd or Path.cwd(),
-                env=env,
-                command_list=cmd or [],
-                returncode=-1,  # Indicate abnormal termination
-                msg=None,
-                stdout_raw=stdout_buf,
-            )
-            raise ClanCmdTimeoutError(cmd_out, timeout)
+    if process.stdout is None or process.stderr is None:
+        msg = "Process stdout and stderr have to be pipes"
+        raise ClanError(msg)
+    # skip decoding the output if it would be dropped by the logger anyway
+    log_enabled = cmdlog.isEnabledFor(logging.INFO)
+    stdout_pipe = _OutputPipe(
+        process.stdout,
+        stdout,
+        stdout_extra if log_enabled and log in [Log.STDOUT, Log.BOTH] else None,
+    )
+    stderr_pipe = _OutputPipe(
+        process.stderr,
+        stderr,
+        stderr_extra if log_enabled and log in [Log.STDERR, Log.BOTH] else None,
+    )
 
-        # Check if the command has been cancelled
-        if is_async_cancelled():
-            cmdlog.warning("Command cancelled", extra=stderr_extra)
+    input_feed = None
+    if isinstance(input_data, bytes):
+        input_feed = _InputFeed([input_data])
+    elif input_data is not None:
+        input_feed = _InputFeed(input_data)
+    deadline = time.monotonic() + timeout
+    async_ctx = get_async_ctx()
+    if async_ctx.backend == AsyncBackend.ASYNCIO:
+        status = run_coroutine(
+            _EventLoopIO(
+                process,
+                [stdout_pipe, stderr_pipe],
+                input_feed,
+                deadline,
+                async_ctx.should_cancel,
+            ).run()
+        )
+    else:
+        status = _handle_io_select(
+            process, [stdout_pipe, stderr_pipe], input_feed, deadline
+        )
 
-            # Terminate process
-            break
+    if status == _IOStatus.TIMEOUT:
+        cmd_out = CmdOut(
+            stdout=stdout_pipe.buf.decode("utf-8", "replace"),
+            stderr=stderr_pipe.buf.decode("utf-8", "replace"),
+            cwd=cwd or Path.cwd(),
+            env=env,
+            command_list=cmd or [],
+            returncode=-1,  # Indicate abnormal termination
+            msg=None,
+            stdout_raw=bytes(stdout_pipe.buf),
+        )
+        raise ClanCmdTimeoutError(cmd_out, timeout)
+    if status == _IOStatus.CANCELLED:
+        cmdlog.warning("Command cancelled", extra=stderr_extra)
 
-        # Wait for data to be available
-        readlist, writelist, _ = select.select(rlist, wlist, [], 0.1)
-        if len(readlist) == 0 and len(writelist) == 0:
-            if process.poll() is None:
-                continue
-            # Process has exited
-            break
-
-        #
-        # Process stdout
-        #
-        ret = handle_fd(process.stdout, readlist)
-
-        # If Log.STDOUT is set, log the stdout output
-        if ret and log in [Log.STDOUT, Log.BOTH]:
-            lines = ret.decode("utf-8", "replace").rstrip("\n").rstrip().split("\n")
-            for line in lines:
-                cmdlog.info(line, extra=stdout_extra)
-
-        # If stdout file is set, stream the stdout output
-        if ret and stdout:
-            stdout.write(ret)
-            stdout.flush()
-        stdout_buf += ret
-
-        #
-        # Process stderr
-        #
-        ret = handle_fd(process.stderr, readlist)
-
-        # If Log.STDERR is set, log the stderr output
-        if ret and log in [Log.STDERR, Log.BOTH]:
-            lines = ret.decode("utf-8", "replace").rstrip("\n").rstrip().split("\n")
-            for line in lines:
-                cmdlog.info(line, extra=stderr_extra)
-
-        # If stderr file is set, stream the stderr output
-        if ret and stderr:
-            stderr.write(ret)
-            stderr.flush()
-        stderr_buf += ret
-
-        #
-        # Process stdin
-        #
-        if process.stdin in writelist:
-            if input_bytes:
-                try:
-                    if process.stdin is None:
-                        msg = "Process stdin is unexpectedly None"
-                        raise ClanError(msg)
-                    written = os.write(process.stdin.fileno(), input_bytes)
-                except BrokenPipeError:
-                    wlist.remove(process.stdin)
-                else:
-                    input_bytes = input_bytes[written:]
-                    if len(input_bytes) == 0:
-                        wlist.remove(process.stdin)
-                    process.stdin.flush()
-                    process.stdin.close()
-            else:
-                wlist.remove(process.stdin)
+    stdout_raw = bytes(stdout_pipe.buf)
     return (
-        stdout_buf.decode("utf-8", "replace"),
-        stderr_buf.decode("utf-8", "replace"),
-        stdout_buf,
+        stdout_raw.decode("utf-8", "replace"),
+        stderr_pipe.buf.decode("utf-8", "replace"),
+        stdout_raw,
     )
 
 
@@ -289,7 +514,9 @@ if os.environ.get("CLAN_CLI_PERF"):
 
 @dataclass
 class RunOpts:
-    input: IO[bytes] | bytes | None = None
+    # Files with a file descriptor are passed to the process as stdin directly,
+    # other file-like objects and iterables of chunks are streamed to it.
+    input: IO[bytes] | bytes | Iterable[bytes] | None = None
     stdout: IO[bytes] | None = None
     stderr: IO[bytes] | None = None
     env: dict[str, str] | None = None
@@ -338,6 +565,22 @@ def cmd_with_root(cmd: list[str], graphical: bool = False) -> list[str]:
     return ["sudo", *cmd]
 
 
+def _process_input(
+    data: IO[bytes] | bytes | Iterable[bytes] | None,
+) -> tuple[IO[bytes] | int | None, bytes | Iterable[bytes] | None]:
+    """Returns the stdin for Popen and the input that has to be written to it."""
+    if data is None or isinstance(data, bytes):
+        return (None if data is None else subprocess.PIPE), data
+    if isinstance(data, io.IOBase):
+        try:
+            data.fileno()
+        except OSError:
+            # file-like objects without a file descriptor, e.g. io.BytesIO
+            return subprocess.PIPE, iter(partial(data.read, MIN_READ_SIZE), b"")
+        return cast("IO[bytes]", data), None
+    return subprocess.PIPE, data
+
+
 def run(
     cmd: list[str],
     options: RunOpts | None = None,
@@ -385,7 +628,7 @@ def run(
 
     start = timeit.default_timer()
     with ExitStack() as stack:
-        stdin = subprocess.PIPE if isinstance(options.input, bytes) else options.input
+        stdin, input_data = _process_input(options.input)
         process = stack.enter_context(
             subprocess.Popen(
                 cmd,
@@ -405,15 +648,13 @@ def run(
         else:
             stack.enter_context(terminate_process_group(process))
 
-        input_bytes = options.input if isinstance(options.input, bytes) else None
-
         stdout_buf, stderr_buf, stdout_raw = handle_io(
             process,
             options.log,
             prefix=options.prefix,
             msg_color=options.msg_color,
             timeout=options.timeout,
-            input_bytes=input_bytes,
+            input_data=input_data,
             stdout=options.stdout,
             stderr=options.stderr,
             cmd=cmd,
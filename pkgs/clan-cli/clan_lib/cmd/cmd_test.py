@@ -0,0 +1,92 @@
+import io
+import logging
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+import pytest
+
+from clan_lib.async_run import (
+    AsyncBackend,
+    AsyncContext,
+    AsyncOpts,
+    AsyncRuntime,
+    get_async_ctx,
+    set_async_ctx,
+)
+from clan_lib.cmd import MIN_READ_SIZE, Log, RunOpts, run
+from clan_lib.errors import ClanCmdError
+
+
+@pytest.fixture(autouse=True, params=list(AsyncBackend))
+def backend(request: pytest.FixtureRequest) -> Iterator[AsyncBackend]:
+    previous = get_async_ctx()
+    set_async_ctx(AsyncContext(backend=request.param))
+    yield request.param
+    set_async_ctx(previous)
+
+
+def test_run_large_input_and_output() -> None:
+    data = bytes(range(256)) * (4 * MIN_READ_SIZE)
+    out = run(["cat"], RunOpts(input=data, log=Log.NONE))
+    assert out.stdout_raw == data
+
+
+def test_run_streamed_input(tmp_path: Path) -> None:
+    chunks = [bytes([i]) * MIN_READ_SIZE for i in range(8)]
+    out = run(["cat"], RunOpts(input=iter(chunks), log=Log.NONE))
+    assert out.stdout_raw == b"".join(chunks)
+
+    # file-like objects without a file descriptor
+    out = run(["cat"], RunOpts(input=io.BytesIO(b"".join(chunks)), log=Log.NONE))
+    assert out.stdout_raw == b"".join(chunks)
+
+    # the process exits before reading all of its input
+    out = run(["head", "-c", "1"], RunOpts(input=iter(chunks), log=Log.NONE))
+    assert out.stdout_raw == b"\0"
+
+    # files are passed as stdin directly
+    input_file = tmp_path / "input"
+    input_file.write_bytes(b"file input")
+    with input_file.open("rb") as f:
+        out = run(["cat"], RunOpts(input=f, log=Log.NONE))
+    assert out.stdout == "file input"
+
+
+def test_run_logs_complete_lines(caplog: pytest.LogCaptureFixture) -> None:
+    # multi-byte characters and lines split across writes
+    script = "printf 'a\\303'; sleep 0.1; printf '\\251b\\nc\\n\\nd'"
+    with caplog.at_level(logging.INFO, logger="clan_lib.cmd"):
+        out = run(["sh", "-c", script], RunOpts(log=Log.STDOUT, trace=False))
+    assert out.stdout == "aéb\nc\n\nd"
+    assert [r.getMessage() for r in caplog.records] == ["aéb", "c", "", "d"]
+
+
+def test_run_returns_when_children_keep_pipes_open() -> None:
+    start = time.monotonic()
+    out = run(["sh", "-c", "sleep 10 & echo done"], RunOpts(log=Log.NONE))
+    assert out.stdout == "done\n"
+    assert time.monotonic() - start < 5
+
+
+def test_run_timeout() -> None:
+    with pytest.raises(ClanCmdError, match="timed out"):
+        run(["sh", "-c", "echo partial; sleep 10"], RunOpts(timeout=0.2))
+
+
+def test_runtime_cancels_commands(backend: AsyncBackend) -> None:
+    with AsyncRuntime(backend=backend) as runtime:
+        futures = [
+            runtime.async_run(
+                AsyncOpts(tid=f"task{i}"),
+                run,
+                ["sh", "-c", f"echo task{i}; sleep 10"],
+                RunOpts(log=Log.NONE, check=False),
+            )
+            for i in range(20)
+        ]
+        time.sleep(0.5)
+        start = time.monotonic()
+    results = [future.wait().result for future in futures]
+    assert time.monotonic() - start < 5
+    assert [out.stdout for out in results] == [f"task{i}\n" for i in range(20)]
@@ -0,0 +1,82 @@
+"""Benchmark of streaming large subprocess outputs through `run()`.
+
+Pipes a large output (like `nix build --print-build-logs` or `nix copy`
+produce) through `run()` with and without line logging, and compares it to
+`subprocess.run` with captured output as baseline.
+
+Usage: python -m clan_lib.cmd.io_bench [--size-mb 100] [--backend asyncio]
+"""
+
+import argparse
+import logging
+import subprocess
+import sys
+import time
+from collections.abc import Callable
+from typing import Any
+
+from clan_lib.async_run import AsyncBackend, AsyncContext, set_async_ctx
+from clan_lib.cmd import Log, RunOpts, run
+
+
+def measure(func: Callable[[], Any], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--backend", choices=list(AsyncBackend), default=AsyncBackend.THREADS
+    )
+    args = parser.parse_args()
+    set_async_ctx(AsyncContext(backend=AsyncBackend(args.backend)))
+
+    size = args.size_mb * 1024 * 1024
+    # 100 byte lines, like build logs
+    script = (
+        "import sys\n"
+        f"chunk = b'{'x' * 99}\\n' * 10000\n"
+        f"for _ in range({size} // len(chunk)):\n"
+        "    sys.stdout.buffer.write(chunk)\n"
+    )
+    producer = [sys.executable, "-c", script]
+
+    # lines are logged, but dropped by the handler
+    cmd_logger = logging.getLogger("clan_lib.cmd")
+    cmd_logger.addHandler(logging.NullHandler())
+    cmd_logger.propagate = False
+    cmd_logger.setLevel(logging.INFO)
+
+    results = [
+        (
+            "subprocess.run",
+            measure(
+                lambda: subprocess.run(producer, capture_output=True, check=True),
+                args.repeat,
+            ),
+        ),
+        (
+            "run()",
+            measure(lambda: run(producer, RunOpts(log=Log.NONE)), args.repeat),
+        ),
+        (
+            "run() logging stdout",
+            measure(lambda: run(producer, RunOpts(log=Log.STDOUT)), args.repeat),
+        ),
+    ]
+
+    print(f"streaming {args.size_mb} MiB of output")
+    for name, duration in results:
+        throughput = args.size_mb / duration
+        print(f"{name:<22} {duration * 1000:>10.1f}ms {throughput:>10.1f} MiB/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -25,7 +25,12 @@ from unittest.mock import patch
 import pytest
 from clan_lib.errors import CmdOut
 from clan_lib.flake.flake import Flake
-from clan_lib.nix.shell import Packages, _get_nix_shell_cache_dir
+from clan_lib.nix.shell import (
+    Packages,
+    _get_nix_shell_cache_dir,
+    _nixpkgs_flake,
+    _resolved_packages,
+)
 
 # (store_path_suffix, mainProgram, has_bin_output)
 MOCK_PACKAGES: dict[str, tuple[str, str | None, bool]] = {
@@ -193,7 +198,11 @@ def clear_nix_cache(temporary_home: Path) -> Iterator[None]:
     """
     _ = temporary_home  # Ensure temporary_home runs first
     _get_nix_shell_cache_dir.cache_clear()
+    _nixpkgs_flake.cache_clear()
+    _resolved_packages.clear()
     Packages.static_packages = None
     yield
     _get_nix_shell_cache_dir.cache_clear()
+    _nixpkgs_flake.cache_clear()
+    _resolved_packages.clear()
     Packages.static_packages = None
@@ -0,0 +1,112 @@
+"""Coalescing of concurrent cache misses in `Flake.select`.
+
+Threads of an `AsyncRuntime` (e.g. `clan machines update` across many
+machines) tend to miss the cache at the same moment. Instead of starting one
+nix evaluation per miss, misses are queued and fetched together: the first
+thread that misses becomes the leader of a batch, waits for a short window
+and for the previous batch to finish, and then fetches every queued selector
+with a single `get_from_nix` call. Threads missing a selector that is
+already queued or in flight wait for the same future.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable
+from concurrent.futures import Future
+
+from clan_lib.errors import ClanError
+
+log = logging.getLogger(__name__)
+
+# Seconds the leader of a batch waits for other misses before fetching
+SELECT_BATCH_WINDOW = 0.005
+
+
+def batching_enabled() -> bool:
+    return os.environ.get("CLAN_NO_SELECT_BATCHING") != "1"
+
+
+class SelectBatcher:
+    def __init__(
+        self,
+        fetch: Callable[[list[str]], None],
+        window: float = SELECT_BATCH_WINDOW,
+    ) -> None:
+        self.fetch = fetch
+        self.window = window
+        self._lock = threading.Lock()
+        # only one batch is fetched at a time, misses queue up in the meantime
+        self._fetch_lock = threading.Lock()
+        self._queued: dict[str, Future[None]] = {}
+        self._in_flight: dict[str, Future[None]] = {}
+        self._has_leader = False
+
+    def request(self, selectors: list[str]) -> None:
+        """Fetch selectors, blocks until all of them have been fetched.
+
+        Raises the error of the batch that fetched a selector, if any.
+        """
+        futures: list[Future[None]] = []
+        with self._lock:
+            for selector in dict.fromkeys(selectors):
+                future = self._in_flight.get(selector) or self._queued.get(selector)
+                if future is None:
+                    future = self._queued[selector] = Future()
+                futures.append(future)
+            lead = bool(self._queued) and not self._has_leader
+            if lead:
+                self._has_leader = True
+
+        if lead:
+            self._lead()
+        for future in futures:
+            future.result()
+
+    def _lead(self) -> None:
+        if self.window > 0:
+            time.sleep(self.window)
+        with self._fetch_lock:
+            with self._lock:
+                batch, self._queued = self._queued, {}
+                self._in_flight.update(batch)
+                self._has_leader = False
+            try:
+                self._fetch_batch(batch)
+            finally:
+                with self._lock:
+                    for selector in batch:
+                        self._in_flight.pop(selector, None)
+
+    def _fetch_batch(self, batch: dict[str, Future[None]]) -> None:
+        if len(batch) > 1:
+            log.debug(f"Fetching {len(batch)} coalesced selectors")
+        try:
+            self._fetch_futures(batch)
+        except BaseException as e:
+            # e.g. KeyboardInterrupt or a bug, the callers must not wait forever
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            raise
+
+    def _fetch_futures(self, batch: dict[str, Future[None]]) -> None:
+        try:
+            self.fetch(list(batch))
+        except ClanError as e:
+            if len(batch) == 1:
+                next(iter(batch.values())).set_exception(e)
+                return
+            # one failing selector should not fail the selects of other callers,
+            # so fetch them one by one to attribute the error
+            for selector, future in batch.items():
+                try:
+                    self.fetch([selector])
+                except ClanError as single_error:
+                    future.set_exception(single_error)
+                else:
+                    future.set_result(None)
+        else:
+            for future in batch.values():
+                future.set_result(None)
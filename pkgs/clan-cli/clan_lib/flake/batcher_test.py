@@ -0,0 +1,71 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from clan_lib.errors import ClanError
+from clan_lib.flake.batcher import SelectBatcher
+
+
+class RecordingFetch:
+    def __init__(self, duration: float = 0.05) -> None:
+        self.duration = duration
+        self.batches: list[list[str]] = []
+        self.lock = threading.Lock()
+
+    def __call__(self, selectors: list[str]) -> None:
+        with self.lock:
+            self.batches.append(selectors)
+        time.sleep(self.duration)
+        if "broken" in selectors:
+            msg = "attribute 'broken' missing"
+            raise ClanError(msg)
+
+
+def test_concurrent_misses_are_coalesced() -> None:
+    fetch = RecordingFetch()
+    batcher = SelectBatcher(fetch, window=0.05)
+    selectors = [f"machines.m{i % 10}" for i in range(50)]
+    barrier = threading.Barrier(len(selectors))
+
+    def request(selector: str) -> None:
+        barrier.wait()
+        batcher.request([selector])
+
+    with ThreadPoolExecutor(max_workers=len(selectors)) as pool:
+        list(pool.map(request, selectors))
+
+    fetched = [selector for batch in fetch.batches for selector in batch]
+    assert set(fetched) == set(selectors)
+    # duplicate misses wait for the same fetch, and misses are fetched in batches
+    assert len(fetched) < len(selectors)
+    assert len(fetch.batches) < len(set(selectors))
+
+
+def test_failing_selector_only_fails_its_caller() -> None:
+    fetch = RecordingFetch()
+    batcher = SelectBatcher(fetch, window=0.05)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        good = pool.submit(batcher.request, ["good"])
+        broken = pool.submit(batcher.request, ["broken"])
+        good.result()
+        with pytest.raises(ClanError, match="broken"):
+            broken.result()
+
+
+def test_unexpected_error_fails_all_callers() -> None:
+    def fetch(selectors: list[str]) -> None:
+        if len(selectors) > 1:
+            msg = "attribute 'broken' missing"
+            raise ClanError(msg)
+        # fails while fetching the selectors of the batch one by one
+        msg = "unexpected"
+        raise RuntimeError(msg)
+
+    batcher = SelectBatcher(fetch, window=0.05)
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        requests = [pool.submit(batcher.request, [s]) for s in ["a", "b"]]
+        for request in requests:
+            with pytest.raises(RuntimeError, match="unexpected"):
+                request.result(timeout=5)
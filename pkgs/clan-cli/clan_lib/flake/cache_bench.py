@@ -0,0 +1,127 @@
+"""Benchmark of the on-disk flake select cache.
+
+Compares the SQLite store against the previous format, which wrote the
+complete cache as a single JSON document on every cache miss.
+
+Usage: python -m clan_lib.flake.cache_bench [--machines 150]
+"""
+
+import argparse
+import json
+import tempfile
+import time
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from clan_lib.flake.flake import FlakeCache, FlakeCacheEntry
+
+
+def machine_config(name: str, options: int) -> dict[str, Any]:
+    return {
+        "networking": {"hostName": name, "domain": "clan.lol"},
+        "clan": {
+            "core": {
+                "vars": {
+                    "generators": {
+                        f"generator-{i}": {
+                            "files": {"secret": {"deploy": True, "owner": "root"}},
+                            "share": False,
+                            "script": "x" * 200,
+                        }
+                        for i in range(options)
+                    }
+                }
+            }
+        },
+    }
+
+
+def populate(cache: FlakeCache, machines: int, options: int) -> None:
+    for i in range(machines):
+        name = f"machine-{i}"
+        cache.insert(
+            machine_config(name, options), f'nixosConfigurations."{name}".config'
+        )
+
+
+def save_legacy(cache: FlakeCache, path: Path) -> None:
+    path.write_text(json.dumps({"cache": cache.cache.as_json()}))
+
+
+def load_legacy(path: Path) -> FlakeCache:
+    cache = FlakeCache()
+    cache.cache = FlakeCacheEntry.from_json(json.loads(path.read_text())["cache"])
+    return cache
+
+
+def measure(func: Callable[[], Any], repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--machines", type=int, default=150)
+    parser.add_argument("--generators", type=int, default=50)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = Path(tmp) / "legacy.json"
+        store_path = Path(tmp) / "cache.sqlite"
+
+        cache = FlakeCache()
+        populate(cache, args.machines, args.generators)
+        save_legacy(cache, legacy_path)
+        cache.save_to_file(store_path)
+
+        selector = 'nixosConfigurations."machine-0".config.networking.hostName'
+
+        def cold_legacy() -> None:
+            load_legacy(legacy_path).select(selector)
+
+        def cold_store() -> None:
+            new = FlakeCache()
+            new.load_from_file(store_path)
+            new.select(selector)
+
+        warm_legacy = load_legacy(legacy_path)
+        warm_store = FlakeCache()
+        warm_store.load_from_file(store_path)
+        warm_store.select(selector)
+
+        counter = iter(range(10**9))
+
+        def insert_legacy() -> None:
+            i = next(counter)
+            warm_legacy.insert(str(i), f"extra.e{i}")
+            save_legacy(warm_legacy, legacy_path)
+
+        def insert_store() -> None:
+            i = next(counter)
+            warm_store.insert(str(i), f"extra.e{i}")
+            warm_store.save_to_file(store_path)
+
+        results = [
+            ("cold load + select", measure(cold_legacy), measure(cold_store)),
+            (
+                "warm select",
+                measure(lambda: warm_legacy.select(selector), 100),
+                measure(lambda: warm_store.select(selector), 100),
+            ),
+            ("incremental insert", measure(insert_legacy), measure(insert_store)),
+        ]
+
+        size = legacy_path.stat().st_size / 1024 / 1024
+        print(f"{args.machines} machines, legacy cache file: {size:.1f} MiB")
+        print(f"{'':<20} {'json':>12} {'sqlite':>12}")
+        for name, legacy, store in results:
+            print(f"{name:<20} {legacy * 1000:>10.2f}ms {store * 1000:>10.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
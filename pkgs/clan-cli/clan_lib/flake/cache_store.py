@@ -0,0 +1,136 @@
+"""On-disk storage for the flake select cache.
+
+Every flake (identified by its narHash) gets one SQLite database with:
+
+- ``entries``: the compacted snapshot, indexed by attribute path. Large
+  subtrees are split off into their own rows, so only the parts of the cache
+  that are actually accessed get read and parsed.
+- ``inserts``: an append-only journal of ``(selector, data)`` results that
+  have not been folded into the snapshot yet. A cache miss only appends the
+  new results instead of rewriting the whole cache.
+
+The journal is folded back into the snapshot by ``FlakeCache.compact``, which
+`Flake` triggers in a background thread once the journal grows too large.
+"""
+
+import json
+import sqlite3
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+SCHEMA_VERSION = 1
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    path TEXT PRIMARY KEY,
+    entry TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS inserts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    selector TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+"""
+
+# Marker for a child entry which is stored in its own row
+STORED_MARKER: dict[str, Any] = {"stored": True}
+
+type EntryPath = tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class JournalRow:
+    """A single insert into the cache that was recorded in the journal."""
+
+    id: int
+    selector: str
+    data: Any
+
+
+class FlakeCacheTransaction:
+    """Typed accessors for a single transaction on a flake cache database."""
+
+    def __init__(self, conn: sqlite3.Connection) -> None:
+        self._conn = conn
+
+    def entry(self, path: EntryPath) -> Any | None:
+        """Return the serialized FlakeCacheEntry stored for the attribute path.
+
+        Children which are stored in their own row are replaced by STORED_MARKER.
+        """
+        row = self._conn.execute(
+            "SELECT entry FROM entries WHERE path = ?", (json.dumps(path),)
+        ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put_entry(self, path: EntryPath, entry: Any) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO entries (path, entry) VALUES (?, ?)",
+            (json.dumps(path), json.dumps(entry)),
+        )
+
+    def journal(self, after: int = 0) -> list[JournalRow]:
+        rows = self._conn.execute(
+            "SELECT id, selector, data FROM inserts WHERE id > ? ORDER BY id",
+            (after,),
+        )
+        return [
+            JournalRow(id=row_id, selector=selector, data=json.loads(data))
+            for row_id, selector, data in rows
+        ]
+
+    def journal_size(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM inserts").fetchone()[0]
+
+    def append(self, selector: str, data: Any) -> None:
+        self._conn.execute(
+            "INSERT INTO inserts (selector, data) VALUES (?, ?)",
+            (selector, json.dumps(data)),
+        )
+
+    def truncate_journal(self, up_to: int) -> None:
+        self._conn.execute("DELETE FROM inserts WHERE id <= ?", (up_to,))
+
+
+class FlakeCacheStore:
+    """SQLite database holding the select cache of one flake."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @contextmanager
+    def transaction(self, write: bool = False) -> Iterator[FlakeCacheTransaction]:
+        """Open a transaction on the database.
+
+        Read transactions see a consistent snapshot even while another
+        process appends to the journal or compacts it.
+        """
+        if write:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        elif not self.path.exists():
+            msg = f"Flake cache {self.path} does not exist"
+            raise FileNotFoundError(msg)
+
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            if version == 0:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.executescript(_SCHEMA)
+                conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+            elif version != SCHEMA_VERSION:
+                msg = f"Unsupported flake cache schema version {version} in {self.path}"
+                raise ValueError(msg)
+
+            conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+            try:
+                yield FlakeCacheTransaction(conn)
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
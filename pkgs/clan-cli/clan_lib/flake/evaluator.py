@@ -0,0 +1,214 @@
+"""Long-lived nix evaluator for `Flake.select`.
+
+Every cache miss in `Flake.get_from_nix` builds a fresh derivation, which
+starts a new nix process and evaluates the flake from scratch. When
+``CLAN_NIX_EVALUATOR=1`` is set, selectors are instead answered by a
+``nix repl`` worker which is kept alive per flake narHash, so thunks that
+have been evaluated once (nixpkgs, the clan modules, ...) are reused by
+subsequent selects.
+
+The worker only answers selects whose result does not reference store paths,
+since those have to be realised by building the select derivation. Whenever
+the worker can not answer a request (evaluation error, store path references,
+crashed process) the caller falls back to the derivation.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import subprocess
+import threading
+import uuid
+from collections import deque
+from typing import Any
+
+from clan_lib.cmd import terminate_process
+from clan_lib.nix import nix_command
+
+log = logging.getLogger(__name__)
+
+# Number of evaluators kept alive at the same time,
+# each one holds the evaluation state of one flake revision in memory.
+MAX_EVALUATORS = 2
+
+_NIX_STRING_ESCAPE = re.compile(r"\\(.)", re.DOTALL)
+_NIX_STRING_ESCAPES = {"n": "\n", "t": "\t", "r": "\r"}
+
+
+def evaluator_enabled() -> bool:
+    return os.environ.get("CLAN_NIX_EVALUATOR") == "1"
+
+
+def decode_nix_string(printed: str) -> str:
+    """Decode a string literal as printed by the nix repl."""
+    if len(printed) <= 1 or not printed.startswith('"') or not printed.endswith('"'):
+        msg = f"Not a nix string: {printed[:100]}"
+        raise ValueError(msg)
+    return _NIX_STRING_ESCAPE.sub(
+        lambda m: _NIX_STRING_ESCAPES.get(m[1], m[1]),
+        printed[1:-1],
+    )
+
+
+class NixEvaluator:
+    """A `nix repl` process with a flake and the select library in scope.
+
+    Requests are serialized, a single evaluator answers one batch of selectors at a time.
+    """
+
+    def __init__(self, command: list[str], scope: str) -> None:
+        self.command = command
+        self.scope = scope
+        self._lock = threading.Lock()
+        self._process: subprocess.Popen[str] | None = None
+        self._stderr: deque[str] = deque(maxlen=50)
+        self._stderr_thread: threading.Thread | None = None
+        self._marker = f"__clan_evaluator_{uuid.uuid4().hex}__"
+
+    @property
+    def alive(self) -> bool:
+        return self._process is not None and self._process.poll() is None
+
+    def _start(self) -> None:
+        log.debug(f"Starting nix evaluator: {' '.join(self.command)}")
+        self._process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            env={**os.environ, "NO_COLOR": "1", "TERM": "dumb"},
+        )
+        self._stderr_thread = threading.Thread(
+            target=self._drain_stderr,
+            args=(self._process,),
+            name="NixEvaluatorStderr",
+            daemon=True,
+        )
+        self._stderr_thread.start()
+        self._evaluate(f":a {self.scope}")
+
+    def _drain_stderr(self, process: subprocess.Popen[str]) -> None:
+        if process.stderr is None:
+            return
+        for line in process.stderr:
+            self._stderr.append(line.rstrip("\n"))
+
+    def _evaluate(self, line: str) -> list[str]:
+        """Send a line to the repl and return the lines printed in response."""
+        process = self._process
+        if process is None or process.stdin is None or process.stdout is None:
+            msg = "nix evaluator is not running"
+            raise OSError(msg)
+        process.stdin.write(f"{line}\n")
+        process.stdin.write(f'"{self._marker}"\n')
+        process.stdin.flush()
+
+        output: list[str] = []
+        while True:
+            printed = process.stdout.readline()
+            if printed == "":
+                msg = "nix evaluator exited unexpectedly"
+                raise OSError(msg)
+            printed = printed.strip()
+            if printed == f'"{self._marker}"':
+                return output
+            if printed:
+                output.append(printed)
+
+    def select(self, str_selectors: list[str]) -> list[Any] | None:
+        """Apply the selectors (already converted to json) to the flake.
+
+        Returns None if the selectors have to be evaluated by building the select derivation instead.
+        """
+        applied = " ".join(
+            f"(selectLib.applySelectors (builtins.fromJSON ''{attr}'') flake)"
+            for attr in str_selectors
+        )
+        expr = (
+            f"let result = builtins.toJSON [ {applied} ]; "
+            "in if builtins.hasContext result then null else result"
+        )
+        with self._lock:
+            self._stderr.clear()
+            try:
+                if not self.alive:
+                    self._start()
+                output = self._evaluate(expr)
+            except OSError as e:
+                log.debug(f"nix evaluator failed: {e}")
+                self._stop()
+                return None
+
+        results = [line for line in output if line.startswith('"') or line == "null"]
+        if not results or results[-1] == "null":
+            if not results:
+                log.debug(
+                    "nix evaluator could not evaluate selectors: %s", self._stderr
+                )
+            return None
+        try:
+            return json.loads(decode_nix_string(results[-1]))
+        except ValueError as e:
+            log.debug(f"nix evaluator returned invalid output: {e}")
+            return None
+
+    def close(self) -> None:
+        with self._lock:
+            self._stop()
+
+    def _stop(self) -> None:
+        process, self._process = self._process, None
+        if process is None:
+            return
+        with terminate_process(process):
+            if process.stdin is not None:
+                process.stdin.close()
+        if process.stdout is not None:
+            process.stdout.close()
+        if self._stderr_thread is not None:
+            self._stderr_thread.join()
+        if process.stderr is not None:
+            process.stderr.close()
+
+
+_evaluators: dict[tuple[str, ...], NixEvaluator] = {}
+_evaluators_lock = threading.Lock()
+
+
+def get_evaluator(
+    flake_ref: str, select_ref: str, nix_options: list[str]
+) -> NixEvaluator:
+    """Return the evaluator for a flake revision, starting a new one if needed."""
+    key = (flake_ref, select_ref, *nix_options)
+    with _evaluators_lock:
+        evaluator = _evaluators.pop(key, None)
+        if evaluator is None:
+            evaluator = NixEvaluator(
+                nix_command(["repl", *nix_options]),
+                scope=(
+                    f'{{ flake = builtins.getFlake "{flake_ref}"; '
+                    f'selectLib = (builtins.getFlake "{select_ref}").lib; }}'
+                ),
+            )
+        # keep the most recently used evaluators at the end
+        _evaluators[key] = evaluator
+        evicted = []
+        while len(_evaluators) > MAX_EVALUATORS:
+            evicted.append(_evaluators.pop(next(iter(_evaluators))))
+    for old in evicted:
+        old.close()
+    return evaluator
+
+
+def shutdown_evaluators() -> None:
+    with _evaluators_lock:
+        evaluators = list(_evaluators.values())
+        _evaluators.clear()
+    for evaluator in evaluators:
+        evaluator.close()
+
+
+atexit.register(shutdown_evaluators)
@@ -0,0 +1,54 @@
+import sys
+import textwrap
+from pathlib import Path
+
+from clan_lib.flake.evaluator import NixEvaluator, decode_nix_string
+
+
+def test_decode_nix_string() -> None:
+    assert decode_nix_string(r'"[{\"a\":\"b\\nc\"}]"') == r'[{"a":"b\nc"}]'
+    assert decode_nix_string(r'"\${x}"') == "${x}"
+
+
+def fake_repl(tmp_path: Path) -> list[str]:
+    """A stand-in for `nix repl` which answers every expression with a fixed string."""
+    script = tmp_path / "repl.py"
+    script.write_text(
+        textwrap.dedent(
+            r"""
+            import sys
+
+            for line in sys.stdin:
+                line = line.strip()
+                if line.startswith(":a"):
+                    print("Added 2 variables.")
+                elif line.startswith('"__clan_evaluator_'):
+                    print(line)
+                elif "crash" in line:
+                    sys.exit(1)
+                elif "fail" in line:
+                    print("error: attribute 'fail' missing", file=sys.stderr)
+                else:
+                    print(r'"[{\"x\":\"y\"},1]"')
+                print()
+                sys.stdout.flush()
+            """
+        )
+    )
+    return [sys.executable, str(script)]
+
+
+def test_evaluator_protocol(tmp_path: Path) -> None:
+    evaluator = NixEvaluator(fake_repl(tmp_path), scope="{ }")
+    try:
+        assert evaluator.select(['[{"type":"str","value":"x"}]']) == [{"x": "y"}, 1]
+        assert evaluator.alive
+        # evaluation errors make the caller fall back to the select derivation
+        assert evaluator.select(['[{"type":"str","value":"fail"}]']) is None
+        assert evaluator.alive
+        assert evaluator.select(['[{"type":"str","value":"crash"}]']) is None
+        assert not evaluator.alive
+        # a crashed evaluator is restarted on the next request
+        assert evaluator.select(['[{"type":"str","value":"x"}]']) == [{"x": "y"}, 1]
+    finally:
+        evaluator.close()
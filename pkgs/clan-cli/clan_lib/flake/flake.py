@@ -4,18 +4,37 @@ import logging
 import os
 import re
 import shlex
+import sqlite3
+import threading
+import time
 import traceback
+from collections.abc import Iterable, Sequence
+from contextlib import AbstractContextManager
 from dataclasses import asdict, dataclass, field
 from enum import StrEnum
-from functools import cache, cached_property
+from functools import cache, cached_property, lru_cache
 from hashlib import sha1
 from pathlib import Path
-from tempfile import NamedTemporaryFile
 from typing import TYPE_CHECKING, Any
 
 from clan_lib.cmd import Log, RunOpts, run
 from clan_lib.dirs import clan_tmp_dir, select_source
 from clan_lib.errors import ClanCmdError, ClanError
+from clan_lib.flake.batcher import SelectBatcher, batching_enabled
+from clan_lib.flake.cache_store import (
+    STORED_MARKER,
+    EntryPath,
+    FlakeCacheStore,
+    FlakeCacheTransaction,
+)
+from clan_lib.flake.evaluator import evaluator_enabled, get_evaluator
+from clan_lib.flake.invalidation import (
+    TRACKED_ATTRIBUTES,
+    WILDCARD,
+    AttrPath,
+    invalidated_by,
+)
+from clan_lib.flake.views import CacheMapping, CacheSequence
 from clan_lib.nix import (
     current_system,
     nix_build,
@@ -76,6 +95,55 @@ def get_physical_store_path(store_path: str) -> Path:
     return Path(store_path)
 
 
+# Seconds for which a store path that was seen to exist is assumed to still exist
+STORE_PATH_TTL_SECONDS = 10
+
+
+class StorePathLiveness:
+    """Per-process cache of the store paths that were seen to exist.
+
+    Checking whether a cached value is still valid stats every store path it
+    references, and selecting whole subtrees references thousands. Paths that
+    existed are trusted for `ttl` seconds, a garbage collection within that
+    window goes unnoticed until they expire. Missing paths are not cached, as
+    they are usually built right after they were found missing.
+    """
+
+    def __init__(self, ttl: float = STORE_PATH_TTL_SECONDS) -> None:
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # physical path -> time it was seen to exist
+        self._alive: dict[Path, float] = {}
+
+    def all_exist(self, store_paths: Iterable[str]) -> bool:
+        """Check that all store_paths exist at their physical location."""
+        paths = {get_physical_store_path(store_path) for store_path in store_paths}
+        now = time.monotonic()
+        with self._lock:
+            misses = [
+                path
+                for path in paths
+                if now - self._alive.get(path, float("-inf")) > self.ttl
+            ]
+        if not misses:
+            return True
+        # check all paths not seen recently in one go, not one per cache entry
+        alive = [path for path in misses if path.exists()]
+        with self._lock:
+            self._alive.update(dict.fromkeys(alive, now))
+        return len(alive) == len(misses)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._alive.clear()
+
+
+@cache
+def store_path_liveness() -> StorePathLiveness:
+    """The store path liveness cache of the process."""
+    return StorePathLiveness()
+
+
 @cache
 def get_store_path_regex(store_dir: str) -> re.Pattern[str]:
     """Get compiled regex for a specific store directory.
@@ -118,7 +186,7 @@ class SetSelectorType(StrEnum):
     MAYBE = "maybe"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class SetSelector:
     """Represents a selector used in a set.
     type: SetSelectorType = SetSelectorType.STR
@@ -143,7 +211,7 @@ class SelectorType(StrEnum):
     MAYBE = "maybe"
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class Selector:
     """A class to represent a selector, which selects nix elements one level down.
     consists of a SelectorType and a value.
@@ -151,16 +219,16 @@ class Selector:
     if the type is all, no value is needed, since it selects all elements.
     if the type is str, the value is a string, which is the key in a dict.
     if the type is maybe the value is a string, which is the key in a dict.
-    if the type is set, the value is a list of SetSelector objects.
+    if the type is set, the value is a tuple of SetSelector objects.
     """
 
     type: SelectorType = SelectorType.STR
-    value: str | list[SetSelector] | None = None
+    value: str | tuple[SetSelector, ...] | None = None
 
     def as_dict(self) -> dict[str, Any]:
         if self.type == SelectorType.SET:
-            if not isinstance(self.value, list):
-                msg = f"Expected list for SET selector, got {type(self.value)}"
+            if not isinstance(self.value, tuple):
+                msg = f"Expected tuple for SET selector, got {type(self.value)}"
                 raise ClanError(msg)
             return {
                 "type": self.type.value,
@@ -227,23 +295,96 @@ class ClanSelectError(ClanError):
         return f"ClanSelectError({self})"
 
 
-def selectors_as_dict(selectors: list[Selector]) -> list[dict[str, Any]]:
+SELECT_ALL = Selector(type=SelectorType.ALL)
+# Number of parsed selectors to keep, see parse_selector
+SELECTOR_CACHE_SIZE = 16384
+
+
+def selectors_as_dict(selectors: Sequence[Selector]) -> list[dict[str, Any]]:
     return [selector.as_dict() for selector in selectors]
 
 
-def selectors_as_json(selectors: list[Selector]) -> str:
+def selectors_as_json(selectors: Sequence[Selector]) -> str:
     return json.dumps(selectors_as_dict(selectors))
 
 
-def parse_selector(selector: str) -> list[Selector]:
-    """Takes a string and returns a list of selectors.
+@lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def selector_json(selector: str) -> str:
+    """The JSON representation of selector, as passed to the select derivation."""
+    return selectors_as_json(parse_selector(selector))
+
+
+@lru_cache(maxsize=SELECTOR_CACHE_SIZE)
+def parse_selector(selector: str) -> tuple[Selector, ...]:
+    """Takes a string and returns a tuple of selectors.
 
     a selector can be:
     - a string, which is a key in a dict
     - an integer, which is an index in a list
     - a set of strings or integers, which are keys in a dict or indices in a list.
     - the string "*", which selects all elements in a list or dict
+
+    The same selectors are parsed over and over again by select, is_cached
+    and insert of the cache, so the result is memoized. Selectors are
+    immutable and can be shared.
     """
+    selectors = _parse_simple_selector(selector)
+    if selectors is None:
+        selectors = _parse_selector(selector)
+    return selectors
+
+
+def _parse_simple_selector(selector: str) -> tuple[Selector, ...] | None:
+    """Fast path for selectors without quotes and escapes.
+
+    Returns None for other selectors, and for invalid ones, so that the full
+    parser raises the error.
+    """
+    if '"' in selector or "\\" in selector:
+        return None
+    selectors: list[Selector] = []
+    pos = 0
+    while pos < len(selector):
+        if selector[pos] == "{":
+            end = selector.find("}", pos)
+            if end == -1:
+                return None
+            items = selector[pos + 1 : end].split(",")
+            if items[-1] == "":
+                # like "{a,}", a trailing comma does not start another key
+                items.pop()
+            set_selectors = tuple(
+                SetSelector(type=SetSelectorType.MAYBE, value=item[1:])
+                if item.startswith("?")
+                else SetSelector(type=SetSelectorType.STR, value=item)
+                for item in items
+            )
+            if any(item.value == "outPath" for item in set_selectors):
+                return None
+            selectors.append(Selector(type=SelectorType.SET, value=set_selectors))
+        elif selector[pos] == "*":
+            end = pos
+            selectors.append(SELECT_ALL)
+        else:
+            end = selector.find(".", pos)
+            if end == -1:
+                end = len(selector)
+            part = selector[pos:end]
+            if part.startswith("?"):
+                selectors.append(Selector(type=SelectorType.MAYBE, value=part[1:]))
+            else:
+                selectors.append(Selector(type=SelectorType.STR, value=part))
+            pos = end + 1
+            continue
+        # sets and "*" have to be followed by a dot or the end
+        if end + 1 < len(selector) and selector[end + 1] != ".":
+            return None
+        pos = end + 2
+    return tuple(selectors)
+
+
+def _parse_selector(selector: str) -> tuple[Selector, ...]:
+    """Character by character parser for all forms of selectors."""
     stack: list[str] = []
     selectors: list[Selector] = []
     acc_str: str = ""
@@ -321,7 +462,9 @@ def parse_selector(selector: str) -> list[Selector]:
                             "breaking further selection. Use individual selectors instead."
                         )
                         raise ValueError(msg)
-                selectors.append(Selector(type=SelectorType.SET, value=acc_selectors))
+                selectors.append(
+                    Selector(type=SelectorType.SET, value=tuple(acc_selectors))
+                )
 
                 submode = ""
                 acc_selectors = []
@@ -373,7 +516,7 @@ def parse_selector(selector: str) -> list[Selector]:
             msg = f"expected empty stack, but got {stack}"
             raise ValueError(msg)
 
-    return selectors
+    return tuple(selectors)
 
 
 @dataclass
@@ -390,15 +533,28 @@ class FlakeCacheEntry:
     is_list: bool = False
     exists: bool = True
     fetched_all: bool = False
+    # (value, store paths referenced by value), see store_references
+    _store_refs: tuple[str, tuple[str, ...]] | None = field(
+        default=None, init=False, repr=False, compare=False
+    )
+
+    def store_references(self) -> tuple[str, ...]:
+        """The store paths referenced by a string value, extracted once per value."""
+        if not isinstance(self.value, str):
+            return ()
+        if self._store_refs is None or self._store_refs[0] is not self.value:
+            refs = tuple(find_store_references(self.value))
+            self._store_refs = (self.value, refs)
+        return self._store_refs[1]
 
     def insert(
         self,
         value: str | float | dict[str, Any] | list[Any] | None,
-        selectors: list[Selector],
+        selectors: Sequence[Selector],
     ) -> None:
         selector: Selector
         # if we have no more selectors, it means we select all keys from now one and further down
-        selector = Selector(type=SelectorType.ALL) if selectors == [] else selectors[0]
+        selector = selectors[0] if selectors else SELECT_ALL
 
         # first we find out if we have all subkeys already
 
@@ -460,8 +616,8 @@ class FlakeCacheEntry:
             fetched_indices: list[str] = []
             # if we are in a set, we take all the selectors
             if selector.type == SelectorType.SET:
-                if not isinstance(selector.value, list):
-                    msg = f"Expected list for SET selector value, got {type(selector.value)}"
+                if not isinstance(selector.value, tuple):
+                    msg = f"Expected tuple for SET selector value, got {type(selector.value)}"
                     raise ClanError(msg)
                 fetched_indices.extend(
                     subselector.value for subselector in selector.value
@@ -494,7 +650,7 @@ class FlakeCacheEntry:
         # if they are, we store them as a dict with the outPath key
         # this is to mirror nix behavior, where the outPath of an attrset is used if no further key is specified
         elif isinstance(value, str) and is_pure_store_path(value):
-            if selectors != []:
+            if selectors:
                 msg = "Expected empty selectors for pure store path"
                 raise ClanError(msg)
             self.value = {"outPath": FlakeCacheEntry(value)}
@@ -502,7 +658,7 @@ class FlakeCacheEntry:
         # if we have a normal scalar, we check if it conflicts with a maybe already store value
         # since an empty attrset is the default value, we cannot check that, so we just set it to the value
         elif isinstance(value, float | int | str) or value is None:
-            if selectors != []:
+            if selectors:
                 msg = "Expected empty selectors for scalar value"
                 raise ClanError(msg)
             if self.value == {}:
@@ -524,21 +680,28 @@ class FlakeCacheEntry:
                 msg = f"Cannot insert {value} into cache, already have {self.value}"
                 raise TypeError(msg)
 
-    def is_cached(self, selectors: list[Selector]) -> bool:
+    def is_cached(self, selectors: Sequence[Selector]) -> bool:
+        # for store paths we have to check if they still exist, otherwise they have to be rebuild and are thus not cached
+        # the references of all selected values are collected and checked together
+        store_refs: list[str] = []
+        if not self.check_cached(selectors, store_refs):
+            return False
+        return store_path_liveness().all_exist(store_refs)
+
+    def check_cached(
+        self, selectors: Sequence[Selector], store_refs: list[str]
+    ) -> bool:
+        """Like is_cached, but collect the store references of the selected values into store_refs instead of checking them."""
         selector: Selector
 
-        # for store paths we have to check if they still exist, otherwise they have to be rebuild and are thus not cached
         if isinstance(self.value, str):
-            store_refs = find_store_references(self.value)
-            if store_refs:
-                # Check if all store references exist at their physical location
-                return all(get_physical_store_path(ref).exists() for ref in store_refs)
+            store_refs.extend(self.store_references())
 
         # if self.value is not dict but we request more selectors, we assume we are cached and an error will be thrown in the select function
         if isinstance(self.value, str | float | int | None):
             return True
 
-        selector = Selector(type=SelectorType.ALL) if selectors == [] else selectors[0]
+        selector = selectors[0] if selectors else SELECT_ALL
 
         # we just fetch all subkeys, so we need to check of we inserted all keys at this level before
         if selector.type == SelectorType.ALL:
@@ -547,12 +710,13 @@ class FlakeCacheEntry:
                 raise ClanError(msg)
             if self.fetched_all:
                 return all(
-                    self.value[sel].is_cached(selectors[1:]) for sel in self.value
+                    self.value[sel].check_cached(selectors[1:], store_refs)
+                    for sel in self.value
                 )
             return False
         if (
             selector.type == SelectorType.SET
-            and isinstance(selector.value, list)
+            and isinstance(selector.value, tuple)
             and isinstance(self.value, dict)
         ):
             for requested_selector in selector.value:
@@ -563,7 +727,7 @@ class FlakeCacheEntry:
                 # if a key does not exist from a previous fetch, we can assume it is cached
                 if self.value[val].exists is False:
                     return True
-                if not self.value[val].is_cached(selectors[1:]):
+                if not self.value[val].check_cached(selectors[1:], store_refs):
                     return False
 
             return True
@@ -582,20 +746,30 @@ class FlakeCacheEntry:
                 return self.fetched_all
             if self.value[val].exists is False:
                 return True
-            return self.value[val].is_cached(selectors[1:])
+            return self.value[val].check_cached(selectors[1:], store_refs)
 
         return False
 
-    def select(self, selectors: list[Selector]) -> Any:
+    def select(
+        self,
+        selectors: Sequence[Selector],
+        view_lock: AbstractContextManager[Any] | None = None,
+    ) -> Any:
+        """Select the value selectors point to from the cache.
+
+        If view_lock is given, attribute sets and lists are returned as
+        read-only views which select their values under view_lock on first
+        access, see `clan_lib.flake.views`.
+        """
         selector: Selector
-        selector = Selector(type=SelectorType.ALL) if selectors == [] else selectors[0]
+        selector = selectors[0] if selectors else SELECT_ALL
 
         # mirror nix behavior where we return outPath if no further selector is specified
-        if selectors == [] and isinstance(self.value, dict) and "outPath" in self.value:
+        if not selectors and isinstance(self.value, dict) and "outPath" in self.value:
             return self.value["outPath"].value
 
         # if we are at the end of the selector chain, we return the value
-        if selectors == [] and isinstance(self.value, str | float | int | None):
+        if not selectors and isinstance(self.value, str | float | int | None):
             return self.value
 
         # if we fetch a specific key, we return the recurse into that value in the dict
@@ -607,7 +781,7 @@ class FlakeCacheEntry:
             # we should raise KeyError for STR selectors
             if selector.value in self.value and not self.value[selector.value].exists:
                 raise KeyError(selector.value)
-            return self.value[selector.value].select(selectors[1:])
+            return self.value[selector.value].select(selectors[1:], view_lock)
 
         # if we are a MAYBE selector, we check if the key exists in the dict
         if selector.type == SelectorType.MAYBE:
@@ -617,6 +791,12 @@ class FlakeCacheEntry:
             if isinstance(self.value, dict):
                 if selector.value in self.value:
                     if self.value[selector.value].exists:
+                        if view_lock is not None:
+                            return CacheMapping(
+                                {selector.value: self.value[selector.value]},
+                                selectors[1:],
+                                view_lock,
+                            )
                         return {
                             selector.value: self.value[selector.value].select(
                                 selectors[1:],
@@ -630,9 +810,9 @@ class FlakeCacheEntry:
 
         # Handle SET selector on non-dict values
         if selector.type == SelectorType.SET and not isinstance(self.value, dict):
-            if not isinstance(selector.value, list):
+            if not isinstance(selector.value, tuple):
                 msg = (
-                    f"Expected list for SET selector value, got {type(selector.value)}"
+                    f"Expected tuple for SET selector value, got {type(selector.value)}"
                 )
                 raise ClanError(msg)
             # Empty set or all sub-selectors are MAYBE
@@ -659,8 +839,8 @@ class FlakeCacheEntry:
 
             # if we want to select a set of keys, we take the keys from the selector
             if selector.type == SelectorType.SET:
-                if not isinstance(selector.value, list):
-                    msg = f"Expected list for SET selector value in select, got {type(selector.value)}"
+                if not isinstance(selector.value, tuple):
+                    msg = f"Expected tuple for SET selector value in select, got {type(selector.value)}"
                     raise ClanError(msg)
                 for subselector in selector.value:
                     # make sure the keys actually exist if we have a maybe selector
@@ -673,6 +853,9 @@ class FlakeCacheEntry:
                     else:
                         keys_to_select.append(subselector.value)
 
+            if view_lock is not None:
+                return self._view(keys_to_select, selectors[1:], view_lock)
+
             # if we are a list, return a list
             if self.is_list:
                 result_list: list[Any] = [
@@ -697,8 +880,8 @@ class FlakeCacheEntry:
         if selector.type == SelectorType.ALL:
             str_selector = "*"
         elif selector.type == SelectorType.SET:
-            if not isinstance(selector.value, list):
-                msg = f"Expected list for SET selector value in error handling, got {type(selector.value)}"
+            if not isinstance(selector.value, tuple):
+                msg = f"Expected tuple for SET selector value in error handling, got {type(selector.value)}"
                 raise ClanError(msg)
             subselectors = [subselector.value for subselector in selector.value]
             str_selector = "{" + ",".join(subselectors) + "}"
@@ -710,6 +893,30 @@ class FlakeCacheEntry:
 
         raise KeyError(str_selector)
 
+    def _view(
+        self,
+        keys: list[str],
+        selectors: Sequence[Selector],
+        view_lock: AbstractContextManager[Any],
+    ) -> CacheMapping | CacheSequence:
+        if not isinstance(self.value, dict):
+            msg = f"Expected dict for cache value in view, got {type(self.value)}"
+            raise ClanError(msg)
+        if self.is_list:
+            return CacheSequence(
+                [self.value[index] for index in keys], selectors, view_lock
+            )
+        entries: dict[str, FlakeCacheEntry] = {}
+        for key in keys:
+            entry = self.value[key]
+            # same as in select, null values selected with maybe are left out
+            if not entry.exists or (
+                entry.value is None and entry.select(selectors) == {}
+            ):
+                continue
+            entries[key] = entry
+        return CacheMapping(entries, selectors, view_lock)
+
     def __getitem__(self, name: str) -> "FlakeCacheEntry":
         if isinstance(self.value, dict):
             return self.value[name]
@@ -756,39 +963,385 @@ class FlakeCacheEntry:
         return f"FlakeCache {self.value}"
 
 
+# Number of journal entries after which the on-disk cache gets compacted
+CACHE_COMPACT_THRESHOLD = 64
+# Subtrees larger than this (serialized, in bytes) are stored in their own row
+CACHE_SPLIT_SIZE = 16 * 1024
+
+# errors which are caused by a broken or incompatible on-disk cache
+_CACHE_STORE_ERRORS = (
+    OSError,
+    ValueError,
+    KeyError,
+    TypeError,
+    ClanError,
+    sqlite3.Error,
+)
+
+
+def _matches_prefix(pattern: AttrPath, path: EntryPath) -> bool:
+    """Check if pattern matches path or one of its parents."""
+    return len(pattern) <= len(path) and all(
+        key in (WILDCARD, path_key)
+        for key, path_key in zip(pattern, path, strict=False)
+    )
+
+
+_compacting: set[Path] = set()
+_compacting_lock = threading.Lock()
+
+
 @dataclass
 class FlakeCache:
-    """an in-memory cache for flake outputs, uses a recursive FLakeCacheEntry structure"""
+    """an in-memory cache for flake outputs, uses a recursive FLakeCacheEntry structure
+
+    The cache can be backed by a FlakeCacheStore on disk, which is read lazily:
+    subtrees stored in their own row are only loaded once a selector accesses them.
+    """
 
     def __init__(self) -> None:
         self.cache: FlakeCacheEntry = FlakeCacheEntry()
+        self._store: FlakeCacheStore | None = None
+        # paths of entries that are stored on disk, but not loaded yet
+        self._stubs: set[EntryPath] = set()
+        # number of stubs at or below a path
+        self._stub_prefixes: dict[EntryPath, int] = {}
+        # paths of entries that have been loaded from their own row
+        self._loaded_rows: set[EntryPath] = set()
+        # id of the last journal entry of the store that has been applied
+        self._journal_pos = 0
+        # set if the journal of the store should be checked for new entries
+        self._refresh = False
+        # inserts that have not been written to the store yet
+        self._pending: list[tuple[str, Any]] = []
+
+    def _add_stub(self, path: EntryPath) -> None:
+        self._stubs.add(path)
+        for i in range(len(path) + 1):
+            self._stub_prefixes[path[:i]] = self._stub_prefixes.get(path[:i], 0) + 1
+
+    def _remove_stub(self, path: EntryPath) -> None:
+        self._stubs.discard(path)
+        for i in range(len(path) + 1):
+            self._stub_prefixes[path[:i]] -= 1
+            if self._stub_prefixes[path[:i]] == 0:
+                del self._stub_prefixes[path[:i]]
+
+    def _decode_row(self, data: dict[str, Any], path: EntryPath) -> FlakeCacheEntry:
+        if data == STORED_MARKER:
+            self._add_stub(path)
+            return FlakeCacheEntry()
+        raw_value = data.get("value")
+        value: Any = raw_value
+        if isinstance(raw_value, dict):
+            value = {k: self._decode_row(v, (*path, k)) for k, v in raw_value.items()}
+        return FlakeCacheEntry(
+            value=value,
+            is_list=data.get("is_list", False),
+            exists=data.get("exists", True),
+            fetched_all=data.get("fetched_all", False),
+        )
+
+    def _load_stub(
+        self, tx: FlakeCacheTransaction, entry: FlakeCacheEntry, path: EntryPath
+    ) -> None:
+        self._remove_stub(path)
+        data = tx.entry(path)
+        if data is None:
+            return
+        loaded = self._decode_row(data, path)
+        entry.value = loaded.value
+        entry.is_list = loaded.is_list
+        entry.exists = loaded.exists
+        entry.fetched_all = loaded.fetched_all
+        self._loaded_rows.add(path)
+
+    def _selected_children(
+        self, entry: FlakeCacheEntry, path: EntryPath, selectors: Sequence[Selector]
+    ) -> list[tuple[FlakeCacheEntry, EntryPath]]:
+        """Return the children of entry that selectors can access and contain stubs."""
+        if path not in self._stub_prefixes or not isinstance(entry.value, dict):
+            return []
+        selector = selectors[0] if selectors else SELECT_ALL
+        keys: list[str]
+        if selector.type == SelectorType.ALL:
+            keys = list(entry.value)
+        elif selector.type == SelectorType.SET and isinstance(selector.value, tuple):
+            keys = [subselector.value for subselector in selector.value]
+        elif isinstance(selector.value, str):
+            keys = [selector.value]
+        else:
+            keys = []
+        return [
+            (entry.value[key], (*path, key))
+            for key in keys
+            if key in entry.value and (*path, key) in self._stub_prefixes
+        ]
+
+    def _needs_resolve(
+        self, entry: FlakeCacheEntry, path: EntryPath, selectors: Sequence[Selector]
+    ) -> bool:
+        if path in self._stubs:
+            return True
+        return any(
+            self._needs_resolve(child, child_path, selectors[1:])
+            for child, child_path in self._selected_children(entry, path, selectors)
+        )
+
+    def _resolve_path(
+        self,
+        tx: FlakeCacheTransaction,
+        entry: FlakeCacheEntry,
+        path: EntryPath,
+        selectors: Sequence[Selector],
+    ) -> None:
+        """Load all stubs below entry that selectors can access."""
+        if path in self._stubs:
+            self._load_stub(tx, entry, path)
+        for child, child_path in self._selected_children(entry, path, selectors):
+            self._resolve_path(tx, child, child_path, selectors[1:])
+
+    def _resolve(self, selectors: Sequence[Selector]) -> None:
+        """Make sure everything selectors can access is loaded from the store."""
+        if self._store is None:
+            return
+        if not self._refresh and not (
+            self._stubs and self._needs_resolve(self.cache, (), selectors)
+        ):
+            return
+        try:
+            with self._store.transaction() as tx:
+                if self._refresh:
+                    self._apply_journal(tx)
+                self._resolve_path(tx, self.cache, (), selectors)
+        except _CACHE_STORE_ERRORS as e:
+            log.warning(f"Failed load eval cache: {e}. Continue without cache")
+            self._store = None
 
-    def insert(self, data: dict[str, Any], selector_str: str) -> None:
-        selectors = parse_selector(selector_str) if selector_str else []
+    def _apply_journal(self, tx: FlakeCacheTransaction) -> int:
+        """Apply the journal entries of the store that have not been applied yet.
+
+        Returns the id of the last journal entry.
+        """
+        for row in tx.journal(self._journal_pos):
+            selectors = parse_selector(row.selector) if row.selector else ()
+            self._resolve_path(tx, self.cache, (), selectors)
+            self.cache.insert(row.data, selectors)
+            self._journal_pos = row.id
+        self._refresh = False
+        return self._journal_pos
+
+    def _encode_rows(
+        self,
+        tx: FlakeCacheTransaction,
+        entry: FlakeCacheEntry,
+        path: EntryPath,
+        rows: set[EntryPath],
+    ) -> tuple[dict[str, Any], int]:
+        """Serialize entry, store large subtrees and entries in rows in their own row.
+
+        Returns the serialized entry and its approximate size.
+        """
+        data: dict[str, Any] = {
+            "is_list": entry.is_list,
+            "exists": entry.exists,
+            "fetched_all": entry.fetched_all,
+        }
+        if not isinstance(entry.value, dict):
+            data["value"] = entry.value
+            return data, len(json.dumps(entry.value)) + 64
+
+        value = data["value"] = {}
+        size = 64
+        for key, child in entry.value.items():
+            child_path = (*path, key)
+            if child_path in self._stubs:
+                value[key] = STORED_MARKER
+                continue
+            child_data, child_size = self._encode_rows(tx, child, child_path, rows)
+            if child_path in rows or (
+                isinstance(child.value, dict) and child_size > CACHE_SPLIT_SIZE
+            ):
+                tx.put_entry(child_path, child_data)
+                value[key] = STORED_MARKER
+            else:
+                value[key] = child_data
+                size += child_size + len(key)
+        return data, size
+
+    def insert(self, data: Any, selector_str: str) -> None:
+        selectors = parse_selector(selector_str) if selector_str else ()
+        self._resolve(selectors)
 
         self.cache.insert(data, selectors)
+        self._pending.append((selector_str, data))
 
-    def select(self, selector_str: str) -> Any:
+    def select(
+        self,
+        selector_str: str,
+        view_lock: AbstractContextManager[Any] | None = None,
+    ) -> Any:
         selectors = parse_selector(selector_str)
-        return self.cache.select(selectors)
+        self._resolve(selectors)
+        return self.cache.select(selectors, view_lock)
 
     def is_cached(self, selector_str: str) -> bool:
         selectors = parse_selector(selector_str)
+        self._resolve(selectors)
         return self.cache.is_cached(selectors)
 
     def save_to_file(self, path: Path) -> None:
-        path.parent.mkdir(parents=True, exist_ok=True)
-        with NamedTemporaryFile(mode="w", dir=path.parent, delete=False) as temp_file:
-            data = {"cache": self.cache.as_json()}
-            json.dump(data, temp_file)
-            temp_file.close()
-            Path(temp_file.name).rename(path)
+        """Write the cache to path.
+
+        If path is the store this cache was loaded from, only the new inserts are
+        appended to its journal. Otherwise the complete cache is written as snapshot.
+        """
+        store = FlakeCacheStore(path)
+        if self._store is not None and self._store.path == path:
+            with store.transaction(write=True) as tx:
+                for selector_str, data in self._pending:
+                    tx.append(selector_str, data)
+                journal_size = tx.journal_size()
+            self._pending = []
+            if journal_size > CACHE_COMPACT_THRESHOLD:
+                self.compact_in_background(path)
+            return
+
+        self._resolve([])
+        with store.transaction(write=True) as tx:
+            root, _ = self._encode_rows(tx, self.cache, (), set())
+            tx.put_entry((), root)
+        self._store = store
+        self._pending = []
+        self._loaded_rows = set()
+        # the new store can already contain journal entries of other processes
+        self._journal_pos = 0
+        self._refresh = True
 
     def load_from_file(self, path: Path) -> None:
-        with path.open("r") as f:
-            log.debug(f"Loading flake cache from file {path}")
-            data = json.load(f)
-            self.cache = FlakeCacheEntry.from_json(data["cache"])
+        """Use path as on-disk store for this cache.
+
+        Nothing is read until a selector accesses the cache. If path is already
+        the store of this cache, entries added by other processes will be loaded.
+        """
+        self._refresh = True
+        if self._store is not None and self._store.path == path:
+            return
+        log.debug(f"Loading flake cache from file {path}")
+        self.cache = FlakeCacheEntry()
+        self._store = FlakeCacheStore(path)
+        self._stubs = set()
+        self._stub_prefixes = {}
+        self._loaded_rows = set()
+        self._journal_pos = 0
+        self._pending = []
+        self._add_stub(())
+
+    def _carry_over_entry(
+        self,
+        entry: FlakeCacheEntry,
+        path: EntryPath,
+        keep: list[AttrPath],
+        drop: list[AttrPath],
+    ) -> FlakeCacheEntry | None:
+        if path in self._stubs or any(_matches_prefix(p, path) for p in drop):
+            return None
+        kept = any(_matches_prefix(p, path) for p in keep)
+        if not isinstance(entry.value, dict):
+            if not kept:
+                return None
+            return FlakeCacheEntry(
+                value=entry.value,
+                is_list=entry.is_list,
+                exists=entry.exists,
+                fetched_all=entry.fetched_all,
+            )
+
+        children: dict[str, FlakeCacheEntry] = {}
+        for key, child in entry.value.items():
+            carried = self._carry_over_entry(child, (*path, key), keep, drop)
+            if carried is not None:
+                children[key] = carried
+        if not kept and not children:
+            return None
+        # keys can only be complete if no key on this level could have been dropped or added
+        complete = (
+            kept
+            and len(children) == len(entry.value)
+            and not any(
+                len(p) > len(path) and _matches_prefix(p[: len(path)], path)
+                for p in drop
+            )
+        )
+        return FlakeCacheEntry(
+            value=children,
+            is_list=entry.is_list,
+            exists=entry.exists,
+            fetched_all=entry.fetched_all and complete,
+        )
+
+    def carry_over(self, keep: list[AttrPath], drop: list[AttrPath]) -> "FlakeCache":
+        """Return a new cache containing the entries below keep which are not below drop.
+
+        Used to reuse the entries of a previous flake revision that can not have changed.
+        """
+        for attr_path in keep:
+            self._resolve(
+                [
+                    SELECT_ALL
+                    if key == WILDCARD
+                    else Selector(type=SelectorType.STR, value=key)
+                    for key in attr_path
+                ]
+            )
+        cache = FlakeCache()
+        carried = self._carry_over_entry(self.cache, (), keep, drop)
+        if carried is not None:
+            cache.cache = carried
+        return cache
+
+    @staticmethod
+    def compact(path: Path) -> None:
+        """Fold the journal of the store at path into its snapshot.
+
+        Only the rows touched by journal entries are rewritten.
+        """
+        cache = FlakeCache()
+        cache.load_from_file(path)
+        store = FlakeCacheStore(path)
+        with store.transaction(write=True) as tx:
+            journal_pos = cache._apply_journal(tx)
+            if journal_pos == 0:
+                return
+            if () in cache._stubs:
+                cache._load_stub(tx, cache.cache, ())
+            rows = cache._loaded_rows
+            root, _ = cache._encode_rows(tx, cache.cache, (), rows)
+            tx.put_entry((), root)
+            tx.truncate_journal(journal_pos)
+        log.debug(f"Compacted flake cache {path}")
+
+    @staticmethod
+    def compact_in_background(path: Path) -> None:
+        with _compacting_lock:
+            if path in _compacting:
+                return
+            _compacting.add(path)
+
+        def run_compaction() -> None:
+            try:
+                FlakeCache.compact(path)
+            except _CACHE_STORE_ERRORS as e:
+                log.debug(f"Failed to compact flake cache {path}: {e}")
+            finally:
+                with _compacting_lock:
+                    _compacting.discard(path)
+
+        threading.Thread(
+            target=run_compaction,
+            name="flake-cache-compaction",
+            daemon=True,
+        ).start()
 
 
 @dataclass
@@ -807,6 +1360,11 @@ class Flake:
     _path: Path | None = field(init=False, default=None)
     _is_local: bool | None = field(init=False, default=None)
     _cache_miss_stack_traces: list[str] = field(init=False, default_factory=list)
+    # guards _cache, which is shared by all threads selecting from this flake
+    _lock: threading.RLock = field(
+        init=False, default_factory=threading.RLock, repr=False
+    )
+    _batcher: SelectBatcher | None = field(init=False, default=None, repr=False)
 
     @classmethod
     def from_json(
@@ -891,7 +1449,7 @@ class Flake:
             return
         try:
             self._cache.load_from_file(path)
-        except (OSError, json.JSONDecodeError, KeyError, ValueError) as e:
+        except (OSError, ValueError) as e:
             log.warning(f"Failed load eval cache: {e}. Continue without cache")
 
     @cached_property
@@ -949,45 +1507,69 @@ class Flake:
         self.hash = flake_metadata["hash"]
         self.flake_metadata = flake_metadata
 
-    def invalidate_cache(self, reset_tracking: bool = False) -> None:
+    def invalidate_cache(
+        self,
+        reset_tracking: bool = False,
+        changed_paths: Iterable[Path] | None = None,
+    ) -> None:
         """Invalidate the cache and reload it.
 
         This method is used to refresh the cache by reloading it from the flake.
 
         Args:
             reset_tracking: If True, also reset cache miss tracking.
+            changed_paths: Files or directories of the flake which have been changed.
+                If the values depending on them are known, all other cached values
+                are carried over to the new revision of the flake.
 
         """
-        self.prefetch()
-
-        self._cache = FlakeCache()
-        if reset_tracking:
-            self._cache_miss_stack_traces.clear()
-        if self.hash is None:
-            msg = "Hash cannot be None"
-            raise ClanError(msg)
-        hashed_hash = sha1(self.hash.encode()).hexdigest()  # noqa: S324 - SHA1 used only for cache directory naming, not security
-        cache_root = os.environ.get("CLAN_TEST_FLAKE_CACHE") or clan_tmp_dir()
-        self.flake_cache_path = Path(cache_root) / "flakes-v2" / hashed_hash
-        self.load_cache()
-
-        if "original" not in self.flake_metadata:
-            self.flake_metadata = nix_metadata(self.identifier)
-
-        if self.flake_metadata["original"].get("url", "").startswith("file:"):
-            self._is_local = True
-            path = self.flake_metadata["original"]["url"].removeprefix("file://")
-            path = path.removeprefix("file:")
-            self._path = Path(path)
-        elif self.flake_metadata["original"].get("path"):
-            self._is_local = True
-            self._path = Path(self.flake_metadata["original"]["path"])
-        else:
-            self._is_local = False
-            if self.store_path is None:
-                msg = "Store path cannot be None"
+        with self._lock:
+            previous_cache = self._cache
+            invalidated: list[AttrPath] | None = None
+            if changed_paths is not None and self._is_local and self._path is not None:
+                invalidated = invalidated_by(self._path, changed_paths)
+
+            self.prefetch()
+
+            self._cache = FlakeCache()
+            if reset_tracking:
+                self._cache_miss_stack_traces.clear()
+            if self.hash is None:
+                msg = "Hash cannot be None"
                 raise ClanError(msg)
-            self._path = Path(self.store_path)
+            hashed_hash = sha1(self.hash.encode()).hexdigest()  # noqa: S324 - SHA1 used only for cache directory naming, not security
+            cache_root = os.environ.get("CLAN_TEST_FLAKE_CACHE") or clan_tmp_dir()
+            self.flake_cache_path = (
+                Path(cache_root) / "flakes-v3" / f"{hashed_hash}.sqlite"
+            )
+            if (
+                previous_cache is not None
+                and invalidated is not None
+                and not self.flake_cache_path.exists()
+            ):
+                log.debug(f"Carrying over select cache, invalidated: {invalidated}")
+                self._cache = previous_cache.carry_over(TRACKED_ATTRIBUTES, invalidated)
+                self.save_cache()
+            else:
+                self.load_cache()
+
+            if "original" not in self.flake_metadata:
+                self.flake_metadata = nix_metadata(self.identifier)
+
+            if self.flake_metadata["original"].get("url", "").startswith("file:"):
+                self._is_local = True
+                path = self.flake_metadata["original"]["url"].removeprefix("file://")
+                path = path.removeprefix("file:")
+                self._path = Path(path)
+            elif self.flake_metadata["original"].get("path"):
+                self._is_local = True
+                self._path = Path(self.flake_metadata["original"]["path"])
+            else:
+                self._is_local = False
+                if self.store_path is None:
+                    msg = "Store path cannot be None"
+                    raise ClanError(msg)
+                self._path = Path(self.store_path)
 
     def get_from_nix(
         self,
@@ -1018,11 +1600,7 @@ class Flake:
 
         nix_options = self.nix_options[:] if self.nix_options is not None else []
 
-        str_selectors = [
-            selectors_as_json(parse_selector(selector)) for selector in selectors
-        ]
-
-        config = nix_config()
+        str_selectors = [selector_json(selector) for selector in selectors]
 
         select_hash = "@select_hash@"
         if not select_hash.startswith("sha256-"):
@@ -1033,6 +1611,53 @@ class Flake:
                 raise ClanError(msg)
             select_hash = select_flake.hash
 
+        outputs: list[Any] | None = None
+        if evaluator_enabled():
+            outputs = get_evaluator(
+                f"path:{self.store_path}?narHash={self.hash}",
+                f"path:{select_source()}?narHash={select_hash}",
+                nix_options,
+            ).select(str_selectors)
+            if outputs is None:
+                log.debug("nix evaluator could not answer, building select derivation")
+        if outputs is None:
+            outputs = self._select_with_derivation(
+                selectors, str_selectors, select_hash, nix_options
+            )
+        if len(outputs) != len(selectors):
+            msg = f"flake_prepare_cache: Expected {len(outputs)} outputs, got {len(selectors)}"
+            raise ClanError(msg)
+        with self._lock:
+            self.load_cache()
+            for i, selector in enumerate(selectors):
+                self._cache.insert(outputs[i], selector)
+            self.save_cache()
+
+    def save_cache(self) -> None:
+        if (
+            self._cache is None
+            or self.flake_cache_path is None
+            or os.environ.get("CLAN_NO_SELECT_DISK_CACHE") == "1"
+        ):
+            return
+        try:
+            self._cache.save_to_file(self.flake_cache_path)
+        except (OSError, sqlite3.Error) as e:
+            log.warning(f"Failed to save eval cache: {e}")
+
+    def _select_with_derivation(
+        self,
+        selectors: list[str],
+        str_selectors: list[str],
+        select_hash: str,
+        nix_options: list[str],
+    ) -> list[Any]:
+        """Evaluate the selectors by building a derivation containing their results.
+
+        Building the derivation also realises all store paths referenced by the results.
+        """
+        config = nix_config()
+
         # fmt: off
         nix_code = f"""
             let
@@ -1097,19 +1722,9 @@ class Flake:
                 cmd_error=e,
             ) from e
 
-
-
         if tmp_store := nix_test_store():
             build_output = tmp_store.joinpath(*build_output.parts[1:])
-        outputs = json.loads(build_output.read_bytes())
-        if len(outputs) != len(selectors):
-            msg = f"flake_prepare_cache: Expected {len(outputs)} outputs, got {len(selectors)}"
-            raise ClanError(msg)
-        self.load_cache()
-        for i, selector in enumerate(selectors):
-            self._cache.insert(outputs[i], selector)
-        if self.flake_cache_path and os.environ.get("CLAN_NO_SELECT_DISK_CACHE") != "1":
-            self._cache.save_to_file(self.flake_cache_path)
+        return json.loads(build_output.read_bytes())
 
     def precache(self, selectors: list[str]) -> None:
         """Ensures that the specified selectors are cached locally.
@@ -1130,15 +1745,18 @@ class Flake:
         if self.flake_cache_path is None:
             msg = "Flake cache path cannot be None"
             raise ClanError(msg)
-        not_fetched_selectors = [
-            selector for selector in selectors if not self._cache.is_cached(selector)
-        ]
+        with self._lock:
+            not_fetched_selectors = [
+                selector
+                for selector in selectors
+                if not self._cache.is_cached(selector)
+            ]
 
         def selector_str(selector: str) -> str:
             return (
-                f"\n  - (cached) {selector}"
-                if self._cache and self._cache.is_cached(selector)
-                else f"\n  - (not cached) {selector}"
+                f"\n  - (not cached) {selector}"
+                if selector in not_fetched_selectors
+                else f"\n  - (cached) {selector}"
             )
 
         log.debug(f"Precaching selectors:{''.join(map(selector_str, selectors))}")
@@ -1148,7 +1766,21 @@ class Flake:
             self._record_cache_miss(
                 f"Cache miss for selectors: {not_fetched_selectors}"
             )
-            self.get_from_nix(not_fetched_selectors)
+            self._fetch(not_fetched_selectors)
+
+    def _fetch(self, selectors: list[str]) -> None:
+        """Fetch selectors from nix, coalescing them with concurrent misses."""
+        if not batching_enabled():
+            self.get_from_nix(selectors)
+            return
+        with self._lock:
+            if self._batcher is None:
+                # resolve get_from_nix on every call, so it can be wrapped
+                self._batcher = SelectBatcher(
+                    lambda batch: self.get_from_nix(batch)  # noqa: PLW0108
+                )
+            batcher = self._batcher
+        batcher.request(selectors)
 
     def select(
         self,
@@ -1161,6 +1793,18 @@ class Flake:
             selector (str): The attribute selector string to fetch the value for.
 
         """
+        return self._select(selector)
+
+    def select_view(self, selector: str) -> Any:
+        """Like select, but returns attribute sets and lists as read-only views.
+
+        The values of the views are selected from the cache on first access,
+        instead of copying everything the selector matches upfront. Use
+        `clan_lib.flake.views.materialize` to get plain dicts and lists.
+        """
+        return self._select(selector, lazy=True)
+
+    def _select(self, selector: str, lazy: bool = False) -> Any:
         if self._cache is None:
             self.invalidate_cache()
         if self._cache is None:
@@ -1170,16 +1814,19 @@ class Flake:
             msg = "Flake cache path cannot be None"
             raise ClanError(msg)
 
-        if not self._cache.is_cached(selector):
+        with self._lock:
+            cached = self._cache.is_cached(selector)
+        if not cached:
             log.debug(f"Cache miss for {selector}")
             # Record cache miss with stack trace
             self._record_cache_miss(f"Cache miss for selector: {selector}")
-            self.get_from_nix([selector])
+            self._fetch([selector])
         else:
             log.debug(f"(cached) $ clan select {shlex.quote(selector)}")
 
         try:
-            return self._cache.select(selector)
+            with self._lock:
+                return self._cache.select(selector, self._lock if lazy else None)
         except KeyError as e:
             # Convert KeyError to ClanSelectError for consistency
             raise ClanSelectError(
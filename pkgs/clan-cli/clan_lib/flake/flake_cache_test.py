@@ -1,5 +1,6 @@
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from sys import platform
 from unittest.mock import patch
@@ -7,17 +8,22 @@ from unittest.mock import patch
 import pytest
 from clan_cli.tests.fixtures_flakes import ClanFlake, create_test_machine_config
 
+from clan_lib.flake.cache_store import FlakeCacheStore
 from clan_lib.flake.flake import (
+    CACHE_SPLIT_SIZE,
     ClanSelectError,
     Flake,
     FlakeCache,
     FlakeCacheEntry,
     Selector,
+    StorePathLiveness,
     find_store_references,
     get_physical_store_path,
     is_pure_store_path,
     parse_selector,
+    store_path_liveness,
 )
+from clan_lib.flake.invalidation import TRACKED_ATTRIBUTES, invalidated_by
 
 
 @pytest.mark.broken_on_darwin
@@ -217,6 +223,8 @@ def test_cache_is_cached_with_clan_test_store(
     # Now delete the path to simulate garbage collection
     fake_store_path.unlink()
     assert not fake_store_path.exists(), "Path should be deleted"
+    # existing paths are trusted for a few seconds
+    store_path_liveness().clear()
 
     # After the fix: is_cached correctly returns False when the path doesn't exist
     # even for test store paths
@@ -319,9 +327,64 @@ def test_cache_gc(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
     assert my_flake._cache is not None
     assert my_flake._cache.is_cached("testfile")
     subprocess.run(["nix-collect-garbage"], check=True)
+    store_path_liveness().clear()
     assert not my_flake._cache.is_cached("testfile")
 
 
+def test_store_path_liveness(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    nix_store = tmp_path / "nix" / "store"
+    nix_store.mkdir(parents=True)
+    monkeypatch.setenv("CLAN_TEST_STORE", str(tmp_path))
+    monkeypatch.delenv("NIX_STORE_DIR", raising=False)
+    for name in ["a", "b"]:
+        (nix_store / f"0123456789abcdefghijklmnopqrstuv-{name}").touch()
+    a = "/nix/store/0123456789abcdefghijklmnopqrstuv-a"
+    b = "/nix/store/0123456789abcdefghijklmnopqrstuv-b"
+    missing = "/nix/store/0123456789abcdefghijklmnopqrstuv-missing"
+
+    liveness = StorePathLiveness(ttl=60)
+    assert liveness.all_exist([a, b])
+    assert not liveness.all_exist([a, missing])
+
+    # existing paths are not stat'ed again within the ttl
+    (nix_store / "0123456789abcdefghijklmnopqrstuv-a").unlink()
+    with patch.object(Path, "exists", side_effect=AssertionError):
+        assert liveness.all_exist([a, b])
+
+    # missing paths are checked again
+    (nix_store / "0123456789abcdefghijklmnopqrstuv-missing").touch()
+    assert liveness.all_exist([missing])
+
+    liveness.clear()
+    assert not liveness.all_exist([a])
+    assert StorePathLiveness(ttl=0).all_exist([b])
+
+
+def test_is_cached_checks_store_references_in_bulk(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("CLAN_TEST_STORE", str(tmp_path))
+    monkeypatch.delenv("NIX_STORE_DIR", raising=False)
+    cache = FlakeCacheEntry()
+    cache.insert(
+        {
+            f"m{i}": f"/nix/store/0123456789abcdefghijklmnopqrstuv-m{i}/file"
+            for i in range(10)
+        },
+        [],
+    )
+
+    with patch.object(StorePathLiveness, "all_exist", return_value=True) as all_exist:
+        assert cache.is_cached(parse_selector("*"))
+    all_exist.assert_called_once()
+    assert len(all_exist.call_args.args[0]) == 10
+
+    # the references are extracted once per value
+    with patch("clan_lib.flake.flake.find_store_references") as find:
+        assert not cache.is_cached(parse_selector("*"))
+    find.assert_not_called()
+
+
 def test_store_path_with_line_numbers_not_wrapped() -> None:
     """Test that store paths with line numbers are not wrapped in outPath dict.
 
@@ -493,6 +556,7 @@ def test_cache_path_with_line_numbers(
 
     # Now delete the base file
     fake_store_path.unlink()
+    store_path_liveness().clear()
 
     # After deletion, paths with line numbers should not be cached
     assert not cache.is_cached(parse_selector("testPath1")), (
@@ -628,3 +692,160 @@ def test_get_nonexistent_after_maybe(flake: ClanFlake) -> None:
     my_flake.select("?nonExist")
     with pytest.raises(ClanSelectError):
         my_flake.select("nonExist")
+
+
+def test_cache_store_appends_and_loads_lazily(tmp_path: Path) -> None:
+    cache_file = tmp_path / "cache.sqlite"
+    cache = FlakeCache()
+    cache.insert({"x": 1}, "a.*")
+    cache.save_to_file(cache_file)
+
+    # the cache is now backed by the file, so further inserts are appended
+    cache.insert("z", "b.y")
+    cache.insert({"c": 2}, "?c.d")
+    cache.save_to_file(cache_file)
+    with FlakeCacheStore(cache_file).transaction() as tx:
+        assert tx.entry(()) is not None
+        assert [row.selector for row in tx.journal()] == ["b.y", "?c.d"]
+
+    cache2 = FlakeCache()
+    cache2.load_from_file(cache_file)
+    assert cache2.cache.value == {}
+    assert cache2.select("a.x") == 1
+    assert cache2.select("b.y") == "z"
+    assert cache2.select("c.d") == 2
+
+
+def test_cache_store_splits_large_subtrees(tmp_path: Path) -> None:
+    cache_file = tmp_path / "cache.sqlite"
+    cache = FlakeCache()
+    for i in range(10):
+        cache.insert({"script": "x" * CACHE_SPLIT_SIZE}, f"machines.m{i}.{{script}}")
+    cache.save_to_file(cache_file)
+    with FlakeCacheStore(cache_file).transaction() as tx:
+        assert tx.entry(("machines",)) is None
+        assert tx.entry(("machines", "m1")) is not None
+
+    cache2 = FlakeCache()
+    cache2.load_from_file(cache_file)
+    assert cache2.is_cached("machines.m1.script")
+    # only the row of the selected machine has been loaded
+    assert cache2._loaded_rows == {(), ("machines", "m1")}
+    assert cache2.select("machines.*.script") == {
+        f"m{i}": "x" * CACHE_SPLIT_SIZE for i in range(10)
+    }
+    assert cache2._stubs == set()
+
+
+def test_cache_store_sees_concurrent_inserts(tmp_path: Path) -> None:
+    cache_file = tmp_path / "cache.sqlite"
+    cache1 = FlakeCache()
+    cache1.insert(1, "a.x")
+    cache1.save_to_file(cache_file)
+
+    cache2 = FlakeCache()
+    cache2.load_from_file(cache_file)
+    assert cache2.is_cached("a.x")
+    assert not cache2.is_cached("a.y")
+
+    cache1.load_from_file(cache_file)
+    cache1.insert("y", "b")
+    cache1.save_to_file(cache_file)
+
+    # reloading the same file only applies the new journal entries
+    cache2.load_from_file(cache_file)
+    assert cache2.is_cached("b")
+    assert cache2.select("b") == "y"
+
+
+def test_cache_store_compaction(tmp_path: Path) -> None:
+    cache_file = tmp_path / "cache.sqlite"
+    cache = FlakeCache()
+    cache.save_to_file(cache_file)
+    for i in range(10):
+        cache.insert({"value": i}, f"machines.m{i}.{{value}}")
+        cache.insert(str(i), f"names.{i}")
+        cache.save_to_file(cache_file)
+
+    FlakeCache.compact(cache_file)
+    with FlakeCacheStore(cache_file).transaction() as tx:
+        assert tx.journal() == []
+
+    cache2 = FlakeCache()
+    cache2.load_from_file(cache_file)
+    assert cache2.select("machines.*.value") == {f"m{i}": i for i in range(10)}
+    assert cache2.select("names.5") == "5"
+    assert not cache2.is_cached("machines.m10.value")
+
+
+def test_cache_carry_over(tmp_path: Path) -> None:
+    cache_file = tmp_path / "cache.sqlite"
+    cache = FlakeCache()
+    cache.insert({"jon": "jon", "sara": "sara"}, "nixosConfigurations.*.hostName")
+    cache.insert({"x86_64-linux": {"jon": 1, "sara": 2}}, "clanInternals.machines")
+    cache.insert({"nixpkgs": {"_type": "flake"}, "self": {}}, "inputs.*.?_type")
+    cache.insert({"machines": {"jon": {}}}, "clanInternals.inventoryClass.inventory")
+    cache.insert("stale", "packages.default")
+    cache.save_to_file(cache_file)
+
+    # lazily loaded entries are carried over as well
+    loaded = FlakeCache()
+    loaded.load_from_file(cache_file)
+    (tmp_path / "machines/jon").mkdir(parents=True)
+    invalidated = invalidated_by(tmp_path, [tmp_path / "machines/jon/facter.json"])
+    assert invalidated is not None
+    carried = loaded.carry_over(TRACKED_ATTRIBUTES, invalidated)
+
+    assert carried.select("nixosConfigurations.sara.hostName") == "sara"
+    assert carried.select("clanInternals.machines.x86_64-linux.sara") == 2
+    assert carried.select("inputs.nixpkgs._type") == "flake"
+    assert not carried.is_cached("nixosConfigurations.jon.hostName")
+    assert not carried.is_cached("clanInternals.machines.x86_64-linux.jon")
+    assert not carried.is_cached("inputs.self")
+    assert not carried.is_cached("clanInternals.inventoryClass.inventory")
+    assert not carried.is_cached("packages.default")
+    # machines could have been added, so listing them has to be evaluated again
+    assert not carried.is_cached("nixosConfigurations.*.hostName")
+    assert not carried.is_cached("inputs.*.?_type")
+
+
+@pytest.mark.broken_on_darwin
+@pytest.mark.with_core
+def test_concurrent_select_batching(
+    flake: ClanFlake, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Concurrent cache misses from many threads are fetched in fewer evaluations."""
+    machines = [f"machine{i}" for i in range(5)]
+    for machine in machines:
+        flake.machines[machine] = create_test_machine_config()
+    flake.refresh()
+    monkeypatch.setenv("CLAN_NO_SELECT_DISK_CACHE", "1")
+
+    def select_concurrently(batching: bool) -> int:
+        if batching:
+            monkeypatch.delenv("CLAN_NO_SELECT_BATCHING", raising=False)
+        else:
+            monkeypatch.setenv("CLAN_NO_SELECT_BATCHING", "1")
+        my_flake = Flake(str(flake.path))
+        my_flake.invalidate_cache()
+        with (
+            patch.object(
+                my_flake, "get_from_nix", wraps=my_flake.get_from_nix
+            ) as tracked_build,
+            ThreadPoolExecutor(max_workers=len(machines)) as pool,
+        ):
+            hostnames = list(
+                pool.map(
+                    lambda machine: my_flake.select(
+                        f"nixosConfigurations.{machine}.config.networking.hostName"
+                    ),
+                    machines,
+                )
+            )
+        assert hostnames == machines
+        return tracked_build.call_count
+
+    unbatched_calls = select_concurrently(batching=False)
+    batched_calls = select_concurrently(batching=True)
+    assert unbatched_calls == len(machines)
+    assert batched_calls < unbatched_calls
@@ -1,3 +1,4 @@
+import itertools
 import logging
 from pathlib import Path
 
@@ -10,6 +11,8 @@ from clan_lib.flake.flake import (
     Flake,
     FlakeCache,
     FlakeCacheEntry,
+    _parse_selector,
+    _parse_simple_selector,
     parse_selector,
     selectors_as_dict,
 )
@@ -119,6 +122,33 @@ def test_parse_selector() -> None:
     ]
 
 
+def test_parse_simple_selector() -> None:
+    # the fast path agrees with the full parser on every selector it accepts
+    for length in range(6):
+        for chars in itertools.product("a.*?{},", repeat=length):
+            selector = "".join(chars)
+            try:
+                expected = _parse_selector(selector)
+            except ValueError:
+                expected = None
+            assert _parse_simple_selector(selector) == expected, selector
+    # quotes, escapes and outPath in sets are left to the full parser
+    assert _parse_simple_selector('"x".y') is None
+    assert _parse_simple_selector("x\\.y") is None
+    assert _parse_simple_selector("x.{y,outPath}") is None
+    with pytest.raises(ValueError, match="outPath"):
+        parse_selector("x.{y,outPath}")
+
+
+def test_parse_selector_memoized() -> None:
+    selectors = parse_selector("x.{y,?z}.*")
+    assert parse_selector("x.{y,?z}.*") is selectors
+    # selectors are immutable and hashable
+    assert len(set(selectors)) == len(selectors)
+    with pytest.raises(AttributeError):
+        selectors[0].value = "y"  # type: ignore[misc]
+
+
 def test_select() -> None:
     test_cache = FlakeCacheEntry()
 
@@ -0,0 +1,119 @@
+"""Incremental invalidation of the flake select cache.
+
+Every write to the clan directory changes the narHash of the flake, so
+`Flake.invalidate_cache` has to start a new select cache. Most writes however
+only touch files that clan evaluates in well known places: changing the files
+of a machine can not change the configuration of another machine, and neither
+these nor generated vars change the other flake inputs. Adding or removing a
+machine changes the machines of its tags (e.g. `all`), so it invalidates every
+machine.
+
+`invalidated_attributes` maps a changed file to the attribute paths whose
+values may depend on it. When invalidating the cache for a set of changed
+files, the entries below `TRACKED_ATTRIBUTES` that are not invalidated by any
+of them are carried over to the cache of the new revision. Everything else is
+evaluated again, as is everything if the dependencies of a changed file are
+not known.
+"""
+
+from collections.abc import Iterable
+from pathlib import Path
+
+type AttrPath = tuple[str, ...]
+
+# Matches every key on its level
+WILDCARD = "*"
+# Replaced with the name of the machine a file belongs to
+MACHINE = "{machine}"
+
+MACHINE_ATTRIBUTES: list[AttrPath] = [
+    ("nixosConfigurations", MACHINE),
+    ("darwinConfigurations", MACHINE),
+    ("clanInternals", "machines", WILDCARD, MACHINE),
+]
+
+INVENTORY_ATTRIBUTES: list[AttrPath] = [
+    ("clanInternals", "inventoryClass"),
+]
+
+# Attributes for which the files they depend on are known,
+# only entries below these can be carried over to a new revision.
+TRACKED_ATTRIBUTES: list[AttrPath] = [
+    *(
+        tuple(WILDCARD if key == MACHINE else key for key in path)
+        for path in MACHINE_ATTRIBUTES
+    ),
+    *INVENTORY_ATTRIBUTES,
+    ("inputs", WILDCARD),
+]
+
+# The flake itself depends on every file
+ALWAYS_INVALIDATED: list[AttrPath] = [
+    ("inputs", "self"),
+]
+
+
+def _machine_attributes(machine: str) -> list[AttrPath]:
+    return [
+        tuple(machine if key == MACHINE else key for key in path)
+        for path in MACHINE_ATTRIBUTES
+    ]
+
+
+def invalidated_attributes(relative_path: Path) -> list[AttrPath] | None:
+    """Return the attribute paths that can depend on a file in the clan directory.
+
+    Returns None if the dependencies of the file are not known.
+    """
+    parts = relative_path.parts
+    if not parts:
+        return None
+
+    match parts:
+        # machines/<name> itself changes when the machine is added or removed,
+        # which changes the members of its tags and thereby every machine
+        case ("machines", _):
+            return [*_machine_attributes(WILDCARD), *INVENTORY_ATTRIBUTES]
+        # files in machines/<name>/ are imported by the machine itself and discovered by the inventory
+        case ("machines", machine, *_):
+            return [*_machine_attributes(machine), *INVENTORY_ATTRIBUTES]
+
+    # vars and secrets of a machine are read by other machines as well (e.g. public keys of peers),
+    # and the inventory may read them through the exports of services
+    if parts[0] in ("vars", "sops"):
+        return [*_machine_attributes(WILDCARD), *INVENTORY_ATTRIBUTES]
+
+    # tags and instances decide which services every machine runs
+    if parts[-1] == "inventory.json":
+        return [*_machine_attributes(WILDCARD), *INVENTORY_ATTRIBUTES]
+
+    return None
+
+
+def invalidated_by(
+    flake_dir: Path, changed_paths: Iterable[Path]
+) -> list[AttrPath] | None:
+    """Return the attribute paths invalidated by changes to any of changed_paths.
+
+    Callers adding or removing a machine pass its directory. Changed files of
+    a machine whose directory does not exist anymore count as its removal.
+
+    Returns None if the whole cache has to be invalidated.
+    """
+    invalidated = list(ALWAYS_INVALIDATED)
+    for changed in changed_paths:
+        try:
+            relative = changed.resolve().relative_to(flake_dir.resolve())
+        except ValueError:
+            return None
+        machine_dir = Path(*relative.parts[:2])
+        if (
+            machine_dir.parts[:1] == ("machines",)
+            and not (flake_dir / machine_dir).is_dir()
+        ):
+            relative = machine_dir
+        attributes = invalidated_attributes(relative)
+        if attributes is None:
+            return None
+        invalidated.extend(attributes)
+    return invalidated
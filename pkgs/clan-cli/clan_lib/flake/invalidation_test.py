@@ -0,0 +1,58 @@
+from pathlib import Path
+
+from clan_lib.flake.invalidation import (
+    ALWAYS_INVALIDATED,
+    INVENTORY_ATTRIBUTES,
+    invalidated_attributes,
+    invalidated_by,
+)
+
+
+def test_invalidated_attributes() -> None:
+    assert invalidated_attributes(Path("machines/jon/facter.json")) == [
+        ("nixosConfigurations", "jon"),
+        ("darwinConfigurations", "jon"),
+        ("clanInternals", "machines", "*", "jon"),
+        *INVENTORY_ATTRIBUTES,
+    ]
+    all_machines = [
+        ("nixosConfigurations", "*"),
+        ("darwinConfigurations", "*"),
+        ("clanInternals", "machines", "*", "*"),
+        *INVENTORY_ATTRIBUTES,
+    ]
+    # adding or removing a machine changes the machines of tags like `all`
+    assert invalidated_attributes(Path("machines/jon")) == all_machines
+    assert invalidated_attributes(Path("vars/per-machine/jon/foo/bar/value")) == (
+        all_machines
+    )
+    assert invalidated_attributes(Path("inventory.json")) == all_machines
+    # anything else can be imported from anywhere
+    assert invalidated_attributes(Path("flake.nix")) is None
+    assert invalidated_attributes(Path("modules/foo.nix")) is None
+    assert invalidated_attributes(Path("machines")) is None
+
+
+def test_invalidated_by(tmp_path: Path) -> None:
+    machine_dir = tmp_path / "machines" / "jon"
+    machine_dir.mkdir(parents=True)
+    facter_attributes = invalidated_attributes(Path("machines/jon/facter.json"))
+    machine_attributes = invalidated_attributes(Path("machines/jon"))
+    assert facter_attributes is not None
+    assert machine_attributes is not None
+    assert invalidated_by(tmp_path, [machine_dir / "facter.json"]) == [
+        *ALWAYS_INVALIDATED,
+        *facter_attributes,
+    ]
+    assert invalidated_by(tmp_path, [machine_dir]) == [
+        *ALWAYS_INVALIDATED,
+        *machine_attributes,
+    ]
+    # the files of a deleted machine invalidate every machine as well
+    assert invalidated_by(tmp_path, [tmp_path / "machines/sara/facter.json"]) == [
+        *ALWAYS_INVALIDATED,
+        *machine_attributes,
+    ]
+    assert invalidated_by(tmp_path, []) == ALWAYS_INVALIDATED
+    assert invalidated_by(tmp_path, [tmp_path / "vars", tmp_path / "flake.nix"]) is None
+    assert invalidated_by(tmp_path, [tmp_path.parent / "inventory.json"]) is None
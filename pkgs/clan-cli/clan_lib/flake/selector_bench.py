@@ -0,0 +1,67 @@
+"""Benchmark of parsing the selectors of many machines.
+
+Parses the selectors `get_machine_selectors` returns for a number of
+machines the way `Flake.precache` does: once for `is_cached`, once for the
+JSON passed to the select derivation and once for `insert`. Compares the
+character by character parser with the memoized `parse_selector`.
+
+Usage: python -m clan_lib.flake.selector_bench [--machines 500] [--rounds 3]
+"""
+
+import argparse
+import time
+
+from clan_lib.flake.flake import (
+    _parse_selector,
+    parse_selector,
+    selector_json,
+    selectors_as_json,
+)
+from clan_lib.vars.generator import get_machine_selectors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--machines", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    machine_names = [f"machine-{i}" for i in range(args.machines)]
+    # precache is called with the selectors of single machines as well
+    selectors = get_machine_selectors(machine_names) + [
+        selector for name in machine_names for selector in get_machine_selectors([name])
+    ]
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for selector in selectors:
+            _parse_selector(selector)
+            selectors_as_json(_parse_selector(selector))
+            _parse_selector(selector)
+    uncached_duration = time.perf_counter() - start
+
+    parse_selector.cache_clear()
+    selector_json.cache_clear()
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for selector in selectors:
+            parse_selector(selector)
+            selector_json(selector)
+            parse_selector(selector)
+    cached_duration = time.perf_counter() - start
+
+    for selector in selectors:
+        if parse_selector(selector) != _parse_selector(selector):
+            msg = f"parse_selector returned a different result for {selector}"
+            raise AssertionError(msg)
+
+    print(f"{len(selectors)} selectors, {args.rounds} rounds")
+    for name, duration in [
+        ("_parse_selector", uncached_duration),
+        ("parse_selector", cached_duration),
+    ]:
+        print(f"{name:<16} {duration * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
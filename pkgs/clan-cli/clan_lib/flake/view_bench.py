@@ -0,0 +1,122 @@
+"""Benchmark of selecting a large inventory from the flake cache.
+
+Builds a synthetic inventory of a number of machines with one instance per
+machine, and selects it the way `InventoryStore.read` does (selection plus
+`sanitize`) and the way the tag completions do (selection, then reading the
+tags of every machine). Compares copying selections with `select` to lazy
+views with `select_view`, in time and peak memory.
+
+Usage: python -m clan_lib.flake.view_bench [--machines 500] [--rounds 10]
+"""
+
+import argparse
+import threading
+import time
+import tracemalloc
+from collections.abc import Callable
+from typing import Any
+
+from clan_lib.flake.flake import FlakeCacheEntry, parse_selector
+from clan_lib.persist.inventory_store import InventoryStore, sanitize
+
+INVENTORY = "clanInternals.inventoryClass.inventorySerialization"
+
+
+def synthetic_inventory(machines: int) -> dict[str, Any]:
+    def deferred(value: Any) -> dict[str, Any]:
+        # the shape of uniqueDeferredSerializableModule, see unwrap_known_unknown
+        return {"imports": [{"_file": "inventory.json", "imports": [value]}]}
+
+    return {
+        "meta": {"name": "bench", "description": None, "icon": None},
+        "machines": {
+            f"machine-{i}": {
+                "name": f"machine-{i}",
+                "description": f"Machine number {i}",
+                "icon": None,
+                "machineClass": "nixos",
+                "tags": ["all", f"rack-{i % 10}", "backup" if i % 2 else "web"],
+                "deploy": {"targetHost": f"root@10.0.{i // 256}.{i % 256}"},
+                "installedAt": 1700000000 + i,
+            }
+            for i in range(machines)
+        },
+        "instances": {
+            f"instance-{i}": {
+                "module": {"name": "borgbackup", "input": "clan-core"},
+                "roles": {
+                    "client": {
+                        "machines": {
+                            f"machine-{i}": {"settings": deferred({"paths": ["/"]})}
+                        },
+                        "tags": {},
+                        "settings": deferred({}),
+                    },
+                    "server": {
+                        "machines": {},
+                        "tags": {f"rack-{i % 10}": {"settings": deferred({})}},
+                        "settings": deferred({"directory": "/var/lib/borg"}),
+                    },
+                },
+            }
+            for i in range(machines)
+        },
+    }
+
+
+def measure(fn: Callable[[], Any], rounds: int) -> tuple[float, int]:
+    """The average duration of fn and the peak memory it allocates."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    duration = (time.perf_counter() - start) / rounds
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--machines", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    keys = InventoryStore.default_keys()
+    selectors = parse_selector(f"{INVENTORY}.{{{','.join(sorted(keys))}}}")
+    transforms = [
+        "instances.*.roles.*.settings",
+        "instances.*.roles.*.machines.*.settings",
+        "instances.*.roles.*.tags.*.settings",
+    ]
+    cache = FlakeCacheEntry()
+    cache.insert(synthetic_inventory(args.machines), parse_selector(INVENTORY))
+    lock = threading.RLock()
+
+    def select() -> Any:
+        return cache.select(selectors)
+
+    def select_view() -> Any:
+        return cache.select(selectors, view_lock=lock)
+
+    def machine_tags(inventory: Any) -> list[str]:
+        return [tag for m in inventory["machines"].values() for tag in m["tags"]]
+
+    if sanitize(select_view(), transforms, []) != sanitize(select(), transforms, []):
+        msg = "select_view returned a different inventory than select"
+        raise AssertionError(msg)
+
+    print(f"{args.machines} machines, {args.rounds} rounds")
+    for name, fn in [
+        ("read (select)", lambda: sanitize(select(), transforms, [])),
+        ("read (select_view)", lambda: sanitize(select_view(), transforms, [])),
+        ("tags (select)", lambda: machine_tags(select())),
+        ("tags (select_view)", lambda: machine_tags(select_view())),
+    ]:
+        duration, peak = measure(fn, args.rounds)
+        print(f"{name:<20} {duration * 1000:>10.1f}ms {peak / 1024:>10.0f}KiB peak")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""Read-only views of selections from the flake cache.
+
+`FlakeCacheEntry.select` builds fresh dicts and lists for everything a
+selector matches, and callers usually copy the result again while
+sanitizing or filtering it. For large selections (the inventory of hundreds
+of machines, the vars metadata of a fleet) this dominates the runtime of the
+API.
+
+The views select the values of their attribute set or list on first access,
+backed by the entries of the cache, and remember them. Values are selected
+under the lock of the flake, so views can be read while other threads insert
+into the cache. Errors of nested selections (e.g. a missing attribute) are
+raised on access, not by `Flake.select_view`.
+
+Use `materialize` before handing a selection to code that expects plain dicts
+and lists, such as JSON serialization.
+"""
+
+from collections.abc import Iterator, Mapping, Sequence
+from contextlib import AbstractContextManager
+from typing import TYPE_CHECKING, Any, overload
+
+if TYPE_CHECKING:
+    from clan_lib.flake.flake import FlakeCacheEntry, Selector
+
+_UNSET: Any = object()
+
+
+class CacheMapping(Mapping[str, Any]):
+    """Read-only view of a selected attribute set."""
+
+    __slots__ = ("_entries", "_lock", "_selectors", "_values")
+
+    def __init__(
+        self,
+        entries: "Mapping[str, FlakeCacheEntry]",
+        selectors: "Sequence[Selector]",
+        lock: AbstractContextManager[Any],
+    ) -> None:
+        self._entries = entries
+        self._selectors = selectors
+        self._lock = lock
+        self._values: dict[str, Any] = {}
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._values.get(key, _UNSET)
+        if value is _UNSET:
+            entry = self._entries[key]
+            with self._lock:
+                value = entry.select(self._selectors, view_lock=self._lock)
+            self._values[key] = value
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def materialize(self) -> dict[str, Any]:
+        with self._lock:
+            return {
+                key: _materialize(self._values.get(key, _UNSET), entry, self._selectors)
+                for key, entry in self._entries.items()
+            }
+
+    def __repr__(self) -> str:
+        return repr(materialize(self))
+
+
+class CacheSequence(Sequence[Any]):
+    """Read-only view of a selected list, backed by an array of its entries."""
+
+    __slots__ = ("_entries", "_lock", "_selectors", "_values")
+
+    def __init__(
+        self,
+        entries: "Sequence[FlakeCacheEntry]",
+        selectors: "Sequence[Selector]",
+        lock: AbstractContextManager[Any],
+    ) -> None:
+        self._entries = tuple(entries)
+        self._selectors = selectors
+        self._lock = lock
+        self._values: list[Any] = [_UNSET] * len(self._entries)
+
+    def _select(self, index: int) -> Any:
+        value = self._values[index]
+        if value is _UNSET:
+            with self._lock:
+                value = self._entries[index].select(
+                    self._selectors, view_lock=self._lock
+                )
+            self._values[index] = value
+        return value
+
+    @overload
+    def __getitem__(self, index: int) -> Any: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> list[Any]: ...
+
+    def __getitem__(self, index: int | slice) -> Any:
+        if isinstance(index, slice):
+            return [self._select(i) for i in range(len(self._entries))[index]]
+        return self._select(range(len(self._entries))[index])
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Sequence) or isinstance(other, str | bytes):
+            return NotImplemented
+        return len(self) == len(other) and all(
+            a == b for a, b in zip(self, other, strict=True)
+        )
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def materialize(self) -> list[Any]:
+        with self._lock:
+            return [
+                _materialize(value, entry, self._selectors)
+                for value, entry in zip(self._values, self._entries, strict=True)
+            ]
+
+    def __repr__(self) -> str:
+        return repr(materialize(self))
+
+
+def _materialize(
+    value: Any, entry: "FlakeCacheEntry", selectors: "Sequence[Selector]"
+) -> Any:
+    if value is _UNSET:
+        # nothing was accessed below entry, copying it is cheaper than views
+        return entry.select(selectors)
+    return materialize(value)
+
+
+def materialize(value: Any) -> Any:
+    """Convert the views in a selection to plain dicts and lists.
+
+    Values that are not views are returned as they are.
+    """
+    if isinstance(value, CacheMapping | CacheSequence):
+        return value.materialize()
+    return value
@@ -0,0 +1,106 @@
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from clan_lib.flake.flake import FlakeCacheEntry, parse_selector
+from clan_lib.flake.views import CacheMapping, CacheSequence, materialize
+
+DATA = {
+    "machines": {
+        "jon": {"tags": ["all", "backup"], "deploy": {"targetHost": "jon.lan"}},
+        "sara": {"tags": [], "deploy": {"targetHost": None}},
+    },
+    "list": [1, "two", {"three": 3}, [4]],
+    "empty": None,
+}
+
+
+@pytest.fixture
+def cache() -> FlakeCacheEntry:
+    cache = FlakeCacheEntry()
+    cache.insert(DATA, [])
+    return cache
+
+
+@pytest.mark.parametrize(
+    "selector",
+    [
+        "machines",
+        "machines.jon",
+        "machines.*.tags",
+        "machines.{jon,?nobody}.deploy",
+        "machines.*.deploy.?targetHost",
+        "machines.jon.tags.1",
+        "list",
+        "list.{0,2}",
+        "?machines",
+        "?nobody",
+        "empty",
+        "{empty,list}",
+        "*.?jon",
+    ],
+)
+def test_view_matches_select(cache: FlakeCacheEntry, selector: str) -> None:
+    selectors = parse_selector(selector)
+    view = cache.select(selectors, view_lock=threading.RLock())
+    expected = cache.select(selectors)
+    assert materialize(view) == expected
+    assert view == expected
+    assert repr(view) == repr(expected)
+
+
+def test_view_selects_lazily(cache: FlakeCacheEntry) -> None:
+    view = cache.select(parse_selector("machines"), view_lock=threading.RLock())
+    assert isinstance(view, CacheMapping)
+
+    with patch.object(FlakeCacheEntry, "select", side_effect=AssertionError):
+        assert sorted(view) == ["jon", "sara"]
+        assert "jon" in view
+        assert "nobody" not in view
+        assert len(view) == 2
+
+    jon = view["jon"]
+    assert isinstance(jon, CacheMapping)
+    # values are selected once
+    assert view["jon"] is jon
+    assert jon["deploy"]["targetHost"] == "jon.lan"
+    with pytest.raises(KeyError):
+        view["nobody"]
+    # accessed and untouched values are materialized alike
+    assert materialize(view) == cache.select(parse_selector("machines"))
+
+
+def test_sequence_view(cache: FlakeCacheEntry) -> None:
+    view = cache.select(parse_selector("list"), view_lock=threading.RLock())
+    assert isinstance(view, CacheSequence)
+    assert len(view) == 4
+    assert view[1] == "two"
+    assert view[-1] == [4]
+    assert view[1:3] == ["two", {"three": 3}]
+    assert "two" in view
+    assert view == [1, "two", {"three": 3}, [4]]
+    assert view != [1, "two"]
+    assert view != "list"
+    with pytest.raises(IndexError):
+        view[4]
+    with pytest.raises(TypeError):
+        hash(view)
+
+
+def test_view_selects_under_lock(cache: FlakeCacheEntry) -> None:
+    lock = threading.RLock()
+    view = cache.select(parse_selector("machines"), view_lock=lock)
+
+    def select(*_args: object, **_kwargs: object) -> None:
+        # RLock has no public way to check the owner
+        assert lock._is_owned()  # type: ignore[attr-defined]
+
+    with patch.object(FlakeCacheEntry, "select", side_effect=select, autospec=True):
+        view["jon"]
+
+
+def test_materialize_plain_values() -> None:
+    value = {"a": [1]}
+    assert materialize(value) is value
+    assert materialize("a") == "a"
@@ -1,5 +1,10 @@
 import logging
 import os
+import threading
+from collections.abc import Iterator
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
 from pathlib import Path
 
 from clan_lib.cmd import Log, RunOpts, run
@@ -10,6 +15,63 @@ from clan_lib.nix import nix_shell
 log = logging.getLogger(__name__)
 
 
+@dataclass
+class _CommitSession:
+    commit_message: str
+    closed: bool = False
+    # dict as an ordered set
+    file_paths: dict[Path, None] = field(default_factory=dict)
+    commit_messages: dict[str, None] = field(default_factory=dict)
+
+
+# Open commit sessions by repository. A session only collects the commits of
+# the context that opened it, and of threads started with a copy of that
+# context (see `clan_lib.vars.graph.execute_parallel`), not those of
+# unrelated threads working on the same repository.
+_sessions: ContextVar[dict[Path, _CommitSession] | None] = ContextVar(
+    "_sessions", default=None
+)
+# Guards the sessions shared by threads with copies of the same context
+_sessions_lock = threading.Lock()
+
+
+@contextmanager
+def commit_session(flake_dir: Path, commit_message: str) -> Iterator[None]:
+    """Collect all commits to flake_dir into a single commit.
+
+    While the session is open, `commit_files` only records the files and
+    commit messages. When the session is closed, all recorded files are
+    committed at once with commit_message as subject and the recorded
+    messages in the body. Nested sessions for the same repository are merged
+    into the outermost one.
+
+    Files are committed even if the session is closed by an exception,
+    like they would have been without the session.
+    """
+    key = flake_dir.resolve()
+    sessions = _sessions.get() or {}
+    if key in sessions:
+        yield
+        return
+    session = _CommitSession(commit_message)
+    token = _sessions.set({**sessions, key: session})
+    try:
+        yield
+    finally:
+        _sessions.reset(token)
+        with _sessions_lock:
+            # threads that outlive the session commit on their own
+            session.closed = True
+        if session.file_paths:
+            messages = list(session.commit_messages)
+            if len(messages) == 1:
+                message = messages[0]
+            else:
+                body = "\n".join(f"- {message}" for message in messages)
+                message = f"{session.commit_message}\n\n{body}"
+            commit_files(list(session.file_paths), flake_dir, message)
+
+
 def commit_file(
     file_path: Path,
     flake_dir: Path,
@@ -44,6 +106,13 @@ def commit_files(
         for file_path in file_paths:
             # ensure that mentioned file path is relative to repo
             commit_message += f"Add {file_path.relative_to(flake_dir)}"
+    session = (_sessions.get() or {}).get(flake_dir.resolve())
+    if session is not None:
+        with _sessions_lock:
+            if not session.closed:
+                session.file_paths.update(dict.fromkeys(file_paths))
+                session.commit_messages[commit_message] = None
+                return
     # check if the repo is a git repo and commit
     if (flake_dir / ".git").exists():
         _commit_file_to_git(flake_dir, file_paths, commit_message)
@@ -75,45 +144,63 @@ def _commit_file_to_git(
 
     with locked_open(real_git_dir / "clan.lock", "w+"):
         no_commit = bool(os.environ.get("CLAN_NO_COMMIT"))
+        # With CLAN_NO_COMMIT we only register new files with
+        # `git add --intent-to-add`: the path joins git's tracked set so
+        # Nix flakes can see it, but its content is neither staged nor
+        # committed. Otherwise we stage the content normally to commit it.
+        # All files are added with a single git invocation, the paths are
+        # passed through stdin to not run into argument length limits.
+        add_cmd = ["git", "-C", str(flake_dir), "add"]
+        if no_commit:
+            add_cmd.append("--intent-to-add")
+        add_cmd += ["--pathspec-from-file=-", "--pathspec-file-nul"]
         for file_path in file_paths:
-            # With CLAN_NO_COMMIT we only register new files with
-            # `git add --intent-to-add`: the path joins git's tracked set so
-            # Nix flakes can see it, but its content is neither staged nor
-            # committed. Otherwise we stage the content normally to commit it.
-            add_cmd = ["git", "-C", str(flake_dir), "add"]
-            if no_commit:
-                add_cmd.append("--intent-to-add")
-            add_cmd += ["--", str(file_path)]
-            cmd = nix_shell(["git"], add_cmd)
-
-            run(
-                cmd,
-                RunOpts(
-                    log=Log.BOTH,
-                    error_msg=f"Failed to add {file_path} file to git index",
-                ),
-            )
-
-            relative_path = file_path.relative_to(flake_dir)
-            log.debug(f"Adding {relative_path} to git")
+            log.debug(f"Adding {file_path.relative_to(flake_dir)} to git")
+        run(
+            nix_shell(["git"], add_cmd),
+            RunOpts(
+                input=b"\0".join(bytes(file_path) for file_path in file_paths),
+                log=Log.BOTH,
+                error_msg=f"Failed to add {file_paths} to git index",
+            ),
+        )
 
         # With CLAN_NO_COMMIT the files were registered with intent-to-add
         # above so flakes can see them; skip staging content and committing.
         if no_commit:
             return
 
-        # check if there is a diff
+        # check if there is a diff. git diff can't read pathspecs from stdin,
+        # so the staged files are listed and matched with ours here.
         cmd = nix_shell(
             ["git"],
-            ["git", "-C", str(flake_dir), "diff", "--cached", "--exit-code", "--"]
-            + [str(file_path) for file_path in file_paths],
+            [
+                "git",
+                "-C",
+                str(flake_dir),
+                "diff",
+                "--cached",
+                "--name-only",
+                "--no-renames",
+                "-z",
+            ],
+        )
+        result = run(
+            cmd,
+            RunOpts(
+                cwd=flake_dir, error_msg=f"Failed to diff the git index of {flake_dir}"
+            ),
         )
-        result = run(cmd, RunOpts(check=False, cwd=flake_dir))
+        committed = {file_path.relative_to(flake_dir) for file_path in file_paths}
+        staged = [Path(name) for name in result.stdout.split("\0") if name]
         # if there is no diff, return
-        if result.returncode == 0:
+        if not any(
+            path in committed or not committed.isdisjoint(path.parents)
+            for path in staged
+        ):
             return
 
-        # commit only that file
+        # commit only these files
         cmd = nix_shell(
             ["git"],
             [
@@ -124,13 +211,15 @@ def _commit_file_to_git(
                 "-m",
                 commit_message,
                 "--no-verify",  # dont run pre-commit hooks
-            ]
-            + [str(file_path) for file_path in file_paths],
+                "--pathspec-from-file=-",
+                "--pathspec-file-nul",
+            ],
         )
 
         run(
             cmd,
             RunOpts(
+                input=b"\0".join(bytes(file_path) for file_path in file_paths),
                 error_msg=f"Failed to commit {file_paths} to git repository {flake_dir}",
             ),
         )
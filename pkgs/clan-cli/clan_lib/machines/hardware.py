@@ -26,6 +26,7 @@ from clan_lib.machines.nixos_anywhere import (
     wrap_nix_shell,
 )
 from clan_lib.nix import nix_config, nix_eval
+from clan_lib.ssh import connection_pool
 from clan_lib.ssh.remote import Remote
 
 log = logging.getLogger(__name__)
@@ -157,12 +158,16 @@ def run_machine_hardware_info_init(
     cmd = add_target(cmd, target_host)
     cmd = wrap_nix_shell(cmd, target_host)
 
-    run(
-        cmd,
-        RunOpts(
-            log=Log.BOTH, prefix=machine.name, needs_user_terminal=True, env=environ
-        ),
-    )
+    try:
+        run(
+            cmd,
+            RunOpts(
+                log=Log.BOTH, prefix=machine.name, needs_user_terminal=True, env=environ
+            ),
+        )
+    finally:
+        # kexec leaves pooled ssh masters connected to the old system
+        connection_pool.drop(target_host)
     print(f"Successfully generated: {hw_file}")
 
     # try to evaluate the machine
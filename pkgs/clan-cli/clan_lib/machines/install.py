@@ -34,6 +34,7 @@ from clan_lib.nix_selectors import (
 )
 from clan_lib.persist.inventory_store import InventoryStore
 from clan_lib.persist.path_utils import set_value_by_path
+from clan_lib.ssh import connection_pool
 from clan_lib.ssh.remote import Remote
 from clan_lib.vars.generate import get_flake_generators, run_generators
 from clan_lib.vars.generator import get_machine_generators
@@ -216,13 +217,17 @@ def run_machine_install(opts: InstallOptions, target_host: Remote) -> None:
                 ),
             )
 
-        if opts.phases:
-            phases = [phase.strip() for phase in opts.phases.split(",")]
+        phases = (
+            [phase.strip() for phase in opts.phases.split(",")]
+            if opts.phases
+            else ["kexec", "disko", "install", "reboot"]
+        )
+        try:
             for phase in phases:
                 run_phase(phase)
-        else:
-            for phase in ["kexec", "disko", "install", "reboot"]:
-                run_phase(phase)
+        finally:
+            # kexec and reboot leave pooled ssh masters connected to the old system
+            connection_pool.drop(target_host)
 
     if opts.update_hardware_config is not HardwareConfig.NONE:
         hw_file = opts.update_hardware_config.config_path(machine)
@@ -4,6 +4,7 @@ import os
 import re
 import shlex
 import uuid
+from collections.abc import Sequence
 from contextlib import ExitStack
 from typing import TYPE_CHECKING, Literal, cast
 
@@ -11,7 +12,8 @@ from clan_cli.hyperlink import hyperlink_same_text_and_url
 from clan_cli.vars.upload import upload_secret_vars
 
 from clan_lib.api import API
-from clan_lib.async_run import is_async_cancelled
+from clan_lib.async_run import is_async_cancelled, resource_slot
+from clan_lib.async_run.scheduler import LOCAL_BUILD, UPLOAD, build_host_resource
 from clan_lib.cmd import Log, MsgColor, RunOpts, run
 from clan_lib.colors import AnsiColor
 from clan_lib.docs import guides_url
@@ -27,6 +29,13 @@ if TYPE_CHECKING:
 log = logging.getLogger(__name__)
 
 
+def _build_resource(build_host: "Host") -> str:
+    """Scheduler resource of a build on build_host."""
+    if isinstance(build_host, Remote):
+        return build_host_resource(build_host.address)
+    return LOCAL_BUILD
+
+
 def _nix_options_from_machine(machine: Machine) -> list[str]:
     """Build the common nix CLI options from a Machine's flake config."""
     return [
@@ -332,6 +341,61 @@ def _nixos_build(
     return config_path
 
 
+def build_machines(machines: Sequence[Machine]) -> dict[str, str]:
+    """Build the NixOS system configurations of machines with one local nix build.
+
+    All machines are evaluated in the same nix invocation, which shares the
+    evaluation of the flake and its inputs, and derivations shared between
+    machines are only built once.
+
+    Returns the store path of the system configuration of every machine.
+    """
+    if not machines:
+        return {}
+    flake = machines[0].flake
+    if any(machine.flake.identifier != flake.identifier for machine in machines):
+        msg = "All machines of a fleet build have to be part of the same flake"
+        raise ClanError(msg)
+
+    flake_store_path = nix_metadata(flake.identifier)["path"]
+    attrs = [
+        f'{flake_store_path}#nixosConfigurations."{machine.name}".config.system.build.toplevel'
+        for machine in machines
+    ]
+    log.info(f"Building {len(machines)} machines in one nix build")
+    with resource_slot(LOCAL_BUILD):
+        ret = run(
+            nix_build([*attrs, *_nix_options_from_machine(machines[0])]),
+            RunOpts(
+                check=False,
+                log=Log.BOTH,
+                msg_color=MsgColor(stderr=AnsiColor.DEFAULT),
+                needs_user_terminal=True,
+                prefix="fleet-build",
+            ),
+        )
+    if ret.returncode != 0:
+        msg = f"nix build failed for machines {', '.join(m.name for m in machines)} (exit code {ret.returncode})."
+        raise ClanError(msg)
+
+    # nix build --print-out-paths prints one path per installable, in order
+    config_paths = [
+        line.strip()
+        for line in ret.stdout.splitlines()
+        if line.strip().startswith("/nix/store/")
+    ]
+    if len(config_paths) != len(machines):
+        msg = (
+            f"Expected {len(machines)} store paths in nix build output.\n"
+            f"stdout: {ret.stdout!r}"
+        )
+        raise ClanError(msg)
+    return {
+        machine.name: config_path
+        for machine, config_path in zip(machines, config_paths, strict=True)
+    }
+
+
 def _copy_closure(
     config_path: str,
     build_host: "Host",
@@ -559,6 +623,7 @@ def run_machine_update(
     build_host: Remote | LocalHost | None = None,
     upload_inputs: bool = False,
     specialisation: str | None = None,
+    prebuilt_config_path: str | None = None,
 ) -> None:
     """Update an existing machine.
 
@@ -572,6 +637,8 @@ def run_machine_update(
         build_host: Optional Remote object representing the build host.
         upload_inputs: Whether to upload flake inputs from the local.
         specialisation: Activates given specialisation
+        prebuilt_config_path: Store path of the NixOS system configuration,
+            if it has already been built on the build host (see build_machines).
 
     Raises:
         ClanError: If the machine is not found in the inventory or if there are issues with
@@ -595,13 +662,15 @@ def run_machine_update(
         target_host_root = stack.enter_context(_target_host.become_root())
 
         # Upload secrets to the target host using root
-        upload_secret_vars(machine, target_host_root)
+        with resource_slot(UPLOAD):
+            upload_secret_vars(machine, target_host_root)
 
         # Upload the flake's source to the build host.  When building
         # locally the sources are already present, so we only need the
         # flake store path for the --flake argument.
-        if isinstance(_build_host, Remote):
-            flake_store_path = upload_sources(machine, _build_host, upload_inputs)
+        if isinstance(_build_host, Remote) and prebuilt_config_path is None:
+            with resource_slot(UPLOAD):
+                flake_store_path = upload_sources(machine, _build_host, upload_inputs)
         else:
             flake_url = machine.flake.identifier
             flake_store_path = nix_metadata(flake_url)["path"]
@@ -614,6 +683,7 @@ def run_machine_update(
                 target_host=_target_host,
                 target_host_root=target_host_root,
                 specialisation=specialisation,
+                prebuilt_config_path=prebuilt_config_path,
             )
         elif machine._class_ == "darwin":
             _update_darwin(
@@ -635,6 +705,7 @@ def _update_nixos(
     target_host: "Host",
     target_host_root: "Host",
     specialisation: str | None,
+    prebuilt_config_path: str | None = None,
 ) -> None:
     """Build → copy → profile → activate pipeline for NixOS machines."""
     nix_options = _nix_options_from_machine(machine)
@@ -646,33 +717,40 @@ def _update_nixos(
         build_host = target_host_root
 
     # 1. Build — no NIX_SSHOPTS needed, nix build doesn't SSH anywhere.
-    config_path = _nixos_build(
-        machine=machine,
-        flake_store_path=flake_store_path,
-        build_host=build_host,
-        nix_options=nix_options,
-    )
+    if prebuilt_config_path is not None:
+        config_path = prebuilt_config_path
+    else:
+        with resource_slot(_build_resource(build_host)):
+            config_path = _nixos_build(
+                machine=machine,
+                flake_store_path=flake_store_path,
+                build_host=build_host,
+                nix_options=nix_options,
+            )
 
     if is_async_cancelled():
         return
 
     # 2. Copy closure to target (only when build host ≠ target host).
     #    NIX_SSHOPTS carries the SSH options that ``nix copy`` needs to
-    #    reach the target (e.g. ProxyCommand for iroh/tor).
+    #    reach the target (e.g. ProxyCommand for iroh/tor).  When copying
+    #    from the local store it also rides the pooled ControlMaster; the
+    #    control socket does not exist on a remote build host.
     if build_host is not target_host_root:
         copy_env: dict[str, str] | None = (
-            target_host.nix_ssh_env(control_master=False)
+            target_host.nix_ssh_env(control_master=not isinstance(build_host, Remote))
             if isinstance(target_host, Remote)
             else None
         )
         try:
-            _copy_closure(
-                config_path=config_path,
-                build_host=build_host,
-                target_host=target_host_root,
-                machine_name=machine.name,
-                extra_env=copy_env,
-            )
+            with resource_slot(UPLOAD):
+                _copy_closure(
+                    config_path=config_path,
+                    build_host=build_host,
+                    target_host=target_host_root,
+                    machine_name=machine.name,
+                    extra_env=copy_env,
+                )
         except ClanError as e:
             _check_ssh_auth_error(
                 e,
@@ -731,13 +809,15 @@ def _update_darwin(
 
     switch_cmd = _build_darwin_rebuild_cmd(machine.name, flake_store_path, nix_options)
 
-    build_host.run(
-        switch_cmd,
-        RunOpts(
-            log=Log.BOTH,
-            msg_color=MsgColor(stderr=AnsiColor.DEFAULT),
-            needs_user_terminal=True,
-            prefix=machine.name,
-        ),
-        extra_env=extra_env,
-    )
+    # darwin-rebuild builds and activates in one step
+    with resource_slot(_build_resource(build_host)):
+        build_host.run(
+            switch_cmd,
+            RunOpts(
+                log=Log.BOTH,
+                msg_color=MsgColor(stderr=AnsiColor.DEFAULT),
+                needs_user_terminal=True,
+                prefix=machine.name,
+            ),
+            extra_env=extra_env,
+        )
@@ -1,18 +1,28 @@
+import atexit
 import logging
 import textwrap
+import threading
 from abc import ABC, abstractmethod
-from collections.abc import Iterator
-from contextlib import contextmanager
+from collections.abc import Collection, Iterable, Iterator
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import AbstractContextManager, ExitStack, contextmanager
 from dataclasses import dataclass, field
-from functools import cached_property
+from functools import cached_property, partial
 from typing import TYPE_CHECKING, Any
 
 from clan_cli.vars.get import get_machine_var
 
+from clan_lib.api import API
 from clan_lib.errors import ClanError
 from clan_lib.exports.scope import parse_export
 from clan_lib.flake import Flake
 from clan_lib.import_utils import ClassSource, import_with_source
+from clan_lib.network.reachability import (
+    DEFAULT_PROBE_JOBS,
+    first_by_priority,
+    reachability_cache,
+    spawn,
+)
 from clan_lib.nix import current_system
 from clan_lib.nix_selectors import clan_exports, machine_networking_target_host
 from clan_lib.ssh.remote import Remote
@@ -22,6 +32,10 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+# Seconds to wait at exit for networks that are still being brought up by
+# connection attempts that lost their race, see _close_lost_connections
+LOST_CONNECTION_TIMEOUT = 30
+
 
 class NoRemoteError(ClanError):
     """Raised when no connection method is available for a machine."""
@@ -248,54 +262,15 @@ class BestRemoteContext:
                     ),
                 )
 
-            for network_name, network in sorted_networks:
-                if self.machine.name not in network.peers:
-                    continue
-
-                log.debug(f"trying to connect via {network_name}")
-                if network.is_running():
-                    try:
-                        ping_time = network.ping(self.machine.name)
-                        if ping_time is not None:
-                            log.info(
-                                f"Machine {self.machine.name} reachable via {network_name} network",
-                            )
-                            remote = network.get_working_remote(self.machine.name)
-                            if remote is not None:
-                                self._remote = remote
-                                return remote
-                    except ClanError as e:
-                        log.debug(
-                            f"Failed to reach {self.machine.name} via {network_name}: {e}"
-                        )
-                else:
-                    try:
-                        log.debug(f"Establishing connection for network {network_name}")
-                        # Enter the network context and keep it alive
-                        self._network_ctx = network.module.connection(network)
-                        connected_network = self._network_ctx.__enter__()
-                        ping_time = connected_network.ping(self.machine.name)
-                        if ping_time is not None:
-                            log.info(
-                                f"Machine {self.machine.name} reachable via {network_name} network after connection",
-                            )
-                            remote = connected_network.get_working_remote(
-                                self.machine.name
-                            )
-                            if remote is not None:
-                                self._remote = remote
-                                return remote
-                        # Ping failed, clean up this connection attempt
-                        self._network_ctx.__exit__(None, None, None)
-                        self._network_ctx = None
-                    except ClanError as e:
-                        # Clean up failed connection attempt
-                        if self._network_ctx is not None:
-                            self._network_ctx.__exit__(None, None, None)
-                            self._network_ctx = None
-                        log.debug(
-                            f"Failed to establish connection to {self.machine.name} via {network_name}: {e}",
-                        )
+            candidates = [
+                (network_name, network)
+                for network_name, network in sorted_networks
+                if self.machine.name in network.peers
+            ]
+            remote = self._connect(candidates)
+            if remote is not None:
+                self._remote = remote
+                return remote
         except (ImportError, AttributeError, KeyError) as e:
             log.debug(
                 f"Failed to use networking modules to determine machines remote: {e}"
@@ -319,6 +294,53 @@ class BestRemoteContext:
         msg = f"Could not find any way to connect to machine '{self.machine.name}'. No targetHost configured and machine not reachable via any network."
         raise NoRemoteError(msg)
 
+    def _connect(self, candidates: list[tuple[str, Network]]) -> Remote | None:
+        """Race the networks of the machine, ordered by priority.
+
+        Networks that are running are probed first. Networks that are not
+        running are only brought up if they have a higher priority than the
+        best running network that reaches the machine.
+        """
+        running = {name: network.is_running() for name, network in candidates}
+        running_networks = [c for c in candidates if running[c[0]]]
+        probes = [
+            spawn(partial(probe_peer, network, self.machine.name))
+            for _, network in running_networks
+        ]
+        best = first_by_priority(probes)
+        best_priority = None
+        if best is not None:
+            best_priority = running_networks[best][1].priority
+
+        stopped_networks = [
+            c
+            for c in candidates
+            if not running[c[0]]
+            and (best_priority is None or c[1].priority > best_priority)
+        ]
+        connections = [
+            spawn(partial(_connect_peer, network, self.machine.name))
+            for _, network in stopped_networks
+        ]
+        connected = first_by_priority(connections)
+        for i, future in enumerate(connections):
+            if i != connected:
+                _close_when_done(future)
+
+        if connected is not None and (connection := connections[connected].result()):
+            network_name = stopped_networks[connected][0]
+            self._network_ctx, remote = connection
+            log.info(
+                f"Machine {self.machine.name} reachable via {network_name} network after connection",
+            )
+            return remote
+        if best is not None:
+            log.info(
+                f"Machine {self.machine.name} reachable via {running_networks[best][0]} network",
+            )
+            return probes[best].result()
+        return None
+
     def __exit__(
         self,
         exc_type: type[BaseException] | None,
@@ -334,20 +356,276 @@ def get_best_remote(machine: "Machine") -> BestRemoteContext:
     return BestRemoteContext(machine)
 
 
-def get_network_overview(networks: dict[str, Network]) -> dict:
+def _by_latency(network: Network, remotes: list[Remote]) -> list[Remote]:
+    """Order remotes that were reachable before first, fastest first."""
+    cache = reachability_cache()
+
+    def latency(remote: Remote) -> tuple[bool, float]:
+        average = cache.average_latency(network, remote)
+        return (average is None, average or 0.0)
+
+    return sorted(remotes, key=latency)
+
+
+def probe_peer(network: Network, peer: str) -> Remote | None:
+    """Probe all remotes of peer at once, return the first that is reachable."""
+    try:
+        remotes = _by_latency(network, network.remote(peer))
+    except ClanError as e:
+        log.debug(
+            f"Failed to get the remotes of {peer} in {network.instance_name}: {e}"
+        )
+        return None
+
+    def probe(remote: Remote) -> Remote | None:
+        reachable = reachability_cache().probe(network, remote).reachable
+        return remote if reachable else None
+
+    probes = [spawn(partial(probe, remote)) for remote in remotes]
+    best = first_by_priority(probes)
+    return None if best is None else probes[best].result()
+
+
+def _connect_peer(
+    network: Network, peer: str
+) -> tuple[AbstractContextManager[Network], Remote] | None:
+    """Bring up network and probe peer, the connection is kept if reachable."""
+    ctx = network.module.connection(network)
+    try:
+        connected_network = ctx.__enter__()
+    except ClanError as e:
+        log.debug(f"Failed to establish connection for {network.instance_name}: {e}")
+        return None
+    try:
+        remote = probe_peer(connected_network, peer)
+    except BaseException:
+        ctx.__exit__(None, None, None)
+        raise
+    if remote is None:
+        ctx.__exit__(None, None, None)
+        return None
+    return ctx, remote
+
+
+type _Connection = Future[tuple[AbstractContextManager[Network], Remote] | None]
+
+# Connection attempts that lost their race and are not closed yet
+_lost_connections: set[_Connection] = set()
+_lost_connections_changed = threading.Condition()
+
+
+def _close_connection(future: _Connection) -> None:
+    try:
+        if future.exception() is None and (result := future.result()) is not None:
+            result[0].__exit__(None, None, None)
+    finally:
+        with _lost_connections_changed:
+            _lost_connections.discard(future)
+            _lost_connections_changed.notify_all()
+
+
+def _close_when_done(future: _Connection) -> None:
+    """Close the network of a connection attempt that lost its race."""
+    with _lost_connections_changed:
+        _lost_connections.add(future)
+    future.add_done_callback(_close_connection)
+
+
+@atexit.register
+def _close_lost_connections() -> None:
+    """Wait for lost connection attempts to close the networks they bring up.
+
+    They run in daemon threads, which are killed at exit, possibly after
+    bringing up a network and before closing it again.
+    """
+    with _lost_connections_changed:
+        if _lost_connections:
+            log.debug(f"Waiting for {len(_lost_connections)} network connections")
+        if not _lost_connections_changed.wait_for(
+            lambda: not _lost_connections, timeout=LOST_CONNECTION_TIMEOUT
+        ):
+            log.warning("Networks brought up to probe machines might still be running")
+
+
+def _peer_remotes(network: Network, peer: str) -> list[Remote]:
+    try:
+        return _by_latency(network, network.remote(peer))
+    except ClanError as e:
+        log.debug(
+            f"Failed to get the remotes of {peer} in {network.instance_name}: {e}"
+        )
+        return []
+
+
+def probe_networks(
+    networks: dict[str, Network],
+    peers: Collection[str] | None = None,
+    jobs: int = DEFAULT_PROBE_JOBS,
+    refresh: bool = False,
+) -> dict[str, dict[str, float | None]]:
+    """Ping all peers of networks at once, at most `jobs` pings in parallel.
+
+    Returns the latency of every peer by network, of the first of its remotes
+    that is reachable, or None if none is. Unless refresh is set, cached
+    results are not pinged again.
+    """
+    items = [
+        (network_name, network, peer)
+        for network_name, network in networks.items()
+        for peer in network.peers
+        if peers is None or peer in peers
+    ]
+    cache = reachability_cache()
+    with ThreadPoolExecutor(
+        max_workers=jobs, thread_name_prefix="network-probe"
+    ) as pool:
+        peer_remotes = list(
+            pool.map(lambda item: _peer_remotes(item[1], item[2]), items)
+        )
+        pairs = [
+            (i, network, remote)
+            for i, ((_, network, _), remotes) in enumerate(
+                zip(items, peer_remotes, strict=True)
+            )
+            for remote in remotes
+        ]
+        probes = pool.map(lambda pair: cache.probe(pair[1], pair[2], refresh), pairs)
+        latencies: dict[int, list[float | None]] = {}
+        for (i, _, _), reachability in zip(pairs, probes, strict=True):
+            latencies.setdefault(i, []).append(reachability.latency)
+
+    result: dict[str, dict[str, float | None]] = {name: {} for name in networks}
+    for i, (network_name, _, peer) in enumerate(items):
+        result[network_name][peer] = next(
+            (latency for latency in latencies.get(i, []) if latency is not None),
+            None,
+        )
+    return result
+
+
+def probe_machines(
+    flake: Flake,
+    machine_names: Iterable[str],
+    jobs: int = DEFAULT_PROBE_JOBS,
+) -> None:
+    """Probe the remotes of many machines on all running networks at once.
+
+    The results end up in the reachability cache, the BestRemoteContext of
+    every machine afterwards is answered without probing again.
+    """
+    names = set(machine_names)
+    if not names:
+        return
+    try:
+        networks = {
+            network_name: network
+            for network_name, network in networks_from_flake(flake).items()
+            if names & network.peers.keys() and network.is_running()
+        }
+    except (ImportError, AttributeError, KeyError) as e:
+        log.debug(f"Failed to use networking modules to probe machines: {e}")
+        return
+    probe_networks(networks, names, jobs)
+
+
+def get_network_overview(
+    networks: dict[str, Network],
+    jobs: int = DEFAULT_PROBE_JOBS,
+) -> dict:
     result: dict[str, dict[str, Any]] = {}
-    for network_name, network in networks.items():
-        result[network_name] = {}
-        result[network_name]["status"] = None
-        result[network_name]["peers"] = {}
-        module = network.module
-        log.debug(f"Using network module: {module}")
-        if module.is_running():
-            result[network_name]["status"] = True
-        else:
-            with module.connection(network) as conn:
-                for peer_name in conn.peers:
-                    result[network_name]["peers"][peer_name] = conn.ping(
-                        peer_name,
-                    )
+    with ExitStack() as stack:
+        connected: dict[str, Network] = {}
+        for network_name, network in networks.items():
+            result[network_name] = {}
+            result[network_name]["status"] = None
+            result[network_name]["peers"] = {}
+            module = network.module
+            log.debug(f"Using network module: {module}")
+            if module.is_running():
+                result[network_name]["status"] = True
+                connected[network_name] = network
+            else:
+                connected[network_name] = stack.enter_context(
+                    module.connection(network)
+                )
+        for network_name, peers in probe_networks(connected, jobs=jobs).items():
+            result[network_name]["peers"] = peers
+    return result
+
+
+@dataclass(frozen=True)
+class PeerReachability:
+    """Reachability of a machine in a network, from the recorded probes."""
+
+    network: str
+    # None if the machine was never probed in the network
+    reachable: bool | None
+    latency: float | None
+    average_latency: float | None
+    checked_at: float | None
+
+
+def _peer_reachability(
+    network_name: str, network: Network, peer: str
+) -> PeerReachability:
+    cache = reachability_cache()
+    histories = [
+        history
+        for remote in _peer_remotes(network, peer)
+        if (history := cache.history(network, remote))
+    ]
+    if not histories:
+        return PeerReachability(
+            network=network_name,
+            reachable=None,
+            latency=None,
+            average_latency=None,
+            checked_at=None,
+        )
+    # the remote that was reachable most recently, else the latest failure
+    history = max(histories, key=lambda h: (h[-1].reachable, h[-1].checked_at))
+    latencies = [result.latency for result in history if result.latency is not None]
+    return PeerReachability(
+        network=network_name,
+        reachable=history[-1].reachable,
+        latency=history[-1].latency,
+        average_latency=sum(latencies) / len(latencies) if latencies else None,
+        checked_at=history[-1].checked_at,
+    )
+
+
+@API.register
+def get_machines_reachability(
+    flake: Flake,
+    probe: bool = False,
+) -> dict[str, list[PeerReachability]]:
+    """Get the reachability of all machines in their networks, by machine name.
+
+    The networks of every machine are ordered by priority. Results are taken
+    from the recorded probes, unless probe is set: then all running networks
+    are probed first, concurrently.
+    """
+    networks = networks_from_flake(flake)
+    if probe:
+        probe_networks(
+            {
+                network_name: network
+                for network_name, network in networks.items()
+                if network.is_running()
+            }
+        )
+    items = [
+        (network_name, network, peer)
+        for network_name, network in sorted(
+            networks.items(), key=lambda x: -x[1].priority
+        )
+        for peer in network.peers
+    ]
+    with ThreadPoolExecutor(
+        max_workers=DEFAULT_PROBE_JOBS, thread_name_prefix="network-probe"
+    ) as pool:
+        reachabilities = pool.map(lambda item: _peer_reachability(*item), items)
+        result: dict[str, list[PeerReachability]] = {}
+        for (_, _, peer), reachability in zip(items, reachabilities, strict=True):
+            result.setdefault(peer, []).append(reachability)
     return result
@@ -1,10 +1,14 @@
+import threading
 from typing import Any
 from unittest.mock import MagicMock, patch
 
 from clan_lib.flake import Flake
 from clan_lib.machines.machines import Machine
+from clan_lib.network import network as network_module
 from clan_lib.network.network import Network, Peer, networks_from_flake
+from clan_lib.network.reachability import spawn
 from clan_lib.nix_selectors import clan_exports
+from clan_lib.ssh.remote import Remote
 
 
 class TestPeerPortUser:
@@ -204,3 +208,23 @@ def test_networks_from_flake(mock_get_machine_var: MagicMock) -> None:
     assert machine3_peer.port == 22
     assert machine3_peer._user is None
     assert machine3_peer.ssh_user == "root"
+
+
+def test_lost_connections_are_closed_at_exit() -> None:
+    closed = threading.Event()
+    release = threading.Event()
+
+    class Connection:
+        def __exit__(self, *args: object) -> None:
+            closed.set()
+
+    def connect() -> Any:
+        # still bringing up the network when the process exits
+        release.wait()
+        return Connection(), MagicMock(spec=Remote)
+
+    network_module._close_when_done(spawn(connect))
+    threading.Timer(0.1, release.set).start()
+    network_module._close_lost_connections()
+    assert closed.is_set()
+    assert not network_module._lost_connections
@@ -0,0 +1,297 @@
+"""Concurrent probing of the remotes a machine is reachable through.
+
+`BestRemoteContext` used to walk the networks of a machine in priority order
+and to ping one remote after the other, so the timeouts of networks that
+don't reach the machine (tor, zerotier, ...) added up, for every machine
+again. Instead, all candidates are probed at once and the candidate of the
+highest priority wins, once every candidate before it failed. After the first
+success, the candidates before it get at most `PROBE_DEADLINE_SECONDS` more.
+
+The results of pings are kept for `REACHABILITY_TTL_SECONDS`, so that a fleet
+update can probe all machines upfront in bulk, and the contexts of the single
+machines are answered from the cache. The last `HISTORY_LENGTH` results of
+every remote are stored in the clan tmp dir, so later invocations start with
+the remotes that were reachable and fast before. Failures recorded by other
+processes are not trusted, the machine might have come up since.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections.abc import Callable, Sequence
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from dataclasses import dataclass
+from functools import cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from clan_lib.dirs import clan_tmp_dir
+from clan_lib.errors import ClanError
+
+if TYPE_CHECKING:
+    from clan_lib.network.network import Network
+    from clan_lib.ssh.remote import Remote
+
+log = logging.getLogger(__name__)
+
+PROBE_DEADLINE_SECONDS = 10
+# Pings to run in parallel when probing many peers
+DEFAULT_PROBE_JOBS = 32
+REACHABILITY_TTL_SECONDS = 60
+HISTORY_LENGTH = 10
+HISTORY_MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+STORE_VERSION = 1
+# Minimum time between two writes of the store, see ReachabilityCache.save
+SAVE_INTERVAL_SECONDS = 5
+
+# network module, user, address, port, socks port
+type ReachabilityKey = tuple[str, str, str, int | None, int | None]
+
+
+def reachability_key(network: "Network", remote: "Remote") -> ReachabilityKey:
+    return (
+        network.module_name,
+        remote.user,
+        remote.address,
+        remote.port,
+        remote.socks_port,
+    )
+
+
+@dataclass(frozen=True)
+class Reachability:
+    # round trip time in milliseconds, None if the remote was not reachable
+    latency: float | None
+    checked_at: float
+
+    @property
+    def reachable(self) -> bool:
+        return self.latency is not None
+
+
+type History = dict[ReachabilityKey, list[Reachability]]
+
+
+def _merge(*histories: list[Reachability]) -> list[Reachability]:
+    min_checked_at = time.time() - HISTORY_MAX_AGE_SECONDS
+    samples = {
+        sample.checked_at: sample
+        for history in histories
+        for sample in history
+        if sample.checked_at >= min_checked_at
+    }
+    return [samples[t] for t in sorted(samples)][-HISTORY_LENGTH:]
+
+
+def _load_history(store_file: Path) -> History:
+    try:
+        data = json.loads(store_file.read_text())
+        if data.get("version") != STORE_VERSION:
+            return {}
+        return {
+            tuple(json.loads(key)): [
+                Reachability(latency=latency, checked_at=checked_at)
+                for checked_at, latency in samples
+            ]
+            for key, samples in data["entries"].items()
+        }
+    except FileNotFoundError:
+        return {}
+    except (json.JSONDecodeError, KeyError, AttributeError, TypeError) as e:
+        log.debug(f"Ignoring invalid reachability store {store_file}: {e}")
+        return {}
+
+
+class ReachabilityCache:
+    """Results of pinging remotes, valid for `ttl` seconds.
+
+    Concurrent probes of the same remote share one ping. If store_file is
+    given, the history of the results is kept there across invocations.
+    """
+
+    def __init__(
+        self,
+        ttl: float = REACHABILITY_TTL_SECONDS,
+        store_file: Path | None = None,
+    ) -> None:
+        self.ttl = ttl
+        self.store_file = store_file
+        self._lock = threading.Lock()
+        self._history: History = {}
+        # remotes probed by this process
+        self._probed: set[ReachabilityKey] = set()
+        self._pending: dict[ReachabilityKey, Future[Reachability]] = {}
+        self._dirty = False
+        self._last_save = float("-inf")
+        if store_file is not None:
+            self._history = _load_history(store_file)
+
+    def _fresh(self, key: ReachabilityKey) -> Reachability | None:
+        history = self._history.get(key)
+        if not history:
+            return None
+        result = history[-1]
+        if time.time() - result.checked_at > self.ttl:
+            return None
+        if not result.reachable and key not in self._probed:
+            return None
+        return result
+
+    def lookup(self, network: "Network", remote: "Remote") -> Reachability | None:
+        """The cached reachability of remote, None if unknown or expired."""
+        with self._lock:
+            return self._fresh(reachability_key(network, remote))
+
+    def history(self, network: "Network", remote: "Remote") -> list[Reachability]:
+        """The recorded results of remote, oldest first."""
+        with self._lock:
+            return list(self._history.get(reachability_key(network, remote), []))
+
+    def average_latency(self, network: "Network", remote: "Remote") -> float | None:
+        """The average latency of the recorded results in which remote was reachable."""
+        latencies = [
+            result.latency
+            for result in self.history(network, remote)
+            if result.latency is not None
+        ]
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def probe(
+        self, network: "Network", remote: "Remote", refresh: bool = False
+    ) -> Reachability:
+        """The reachability of remote, pinging it if not cached or refresh is set."""
+        key = reachability_key(network, remote)
+        with self._lock:
+            result = None if refresh else self._fresh(key)
+            if result is not None:
+                return result
+            future = self._pending.get(key)
+            if future is None:
+                future = Future()
+                self._pending[key] = future
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return future.result()
+
+        try:
+            try:
+                latency = network.module.ping(remote)
+            except ClanError as e:
+                log.debug(f"Failed to reach {remote} via {network.module_name}: {e}")
+                latency = None
+            result = Reachability(latency=latency, checked_at=time.time())
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._history[key] = _merge(self._history.get(key, []), [result])
+            self._probed.add(key)
+            self._dirty = True
+            del self._pending[key]
+        future.set_result(result)
+        self.save()
+        return result
+
+    def save(self, force: bool = False) -> None:
+        """Merge the recorded results into the store file.
+
+        Unless forced, the store is written at most every
+        SAVE_INTERVAL_SECONDS, the remaining results are written on exit.
+        """
+        if self.store_file is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.monotonic()
+            if not force and now - self._last_save < SAVE_INTERVAL_SECONDS:
+                return
+            history = dict(self._history)
+            self._dirty = False
+            self._last_save = now
+        # other processes might have recorded results in the meantime
+        stored = _load_history(self.store_file)
+        entries = {
+            json.dumps(key): [
+                [result.checked_at, result.latency]
+                for result in _merge(stored.get(key, []), history.get(key, []))
+            ]
+            for key in stored.keys() | history.keys()
+        }
+        data = json.dumps({"version": STORE_VERSION, "entries": entries})
+        self.store_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.store_file.with_suffix(f".{os.getpid()}.tmp")
+        tmp_file.write_text(data)
+        tmp_file.replace(self.store_file)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._history.clear()
+            self._probed.clear()
+
+
+@cache
+def reachability_cache() -> ReachabilityCache:
+    """The reachability cache of the process, backed by the clan tmp dir."""
+    cache = ReachabilityCache(store_file=clan_tmp_dir() / "network-reachability.json")
+    atexit.register(cache.save, force=True)
+    return cache
+
+
+def spawn[T](fn: Callable[[], T]) -> Future[T]:
+    """Run fn in a daemon thread.
+
+    Probes are not waited for once a race is decided, so they must not keep
+    the process alive until their timeouts expire.
+    """
+    future: Future[T] = Future()
+
+    def run() -> None:
+        try:
+            future.set_result(fn())
+        except BaseException as e:  # noqa: BLE001
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="network-probe", daemon=True).start()
+    return future
+
+
+def _succeeded(future: Future) -> bool:
+    if not future.done():
+        return False
+    if future.exception() is not None:
+        log.debug(f"Probe failed: {future.exception()!r}")
+        return False
+    return future.result() is not None
+
+
+def first_by_priority(
+    futures: Sequence[Future],
+    deadline: float = PROBE_DEADLINE_SECONDS,
+) -> int | None:
+    """The index of the first of futures that results in something else than None.
+
+    futures are in order of priority. A later future only wins once all
+    futures before it failed, or `deadline` seconds after it succeeded.
+    Returns None if all futures failed.
+    """
+    deadline_at: float | None = None
+    while True:
+        best = next((i for i, f in enumerate(futures) if _succeeded(f)), None)
+        waiting = [f for f in futures[:best] if not f.done()]
+        if not waiting:
+            return best
+        if best is not None and deadline_at is None:
+            deadline_at = time.monotonic() + deadline
+        timeout = None if deadline_at is None else deadline_at - time.monotonic()
+        if timeout is not None and timeout <= 0:
+            log.debug(f"{len(waiting)} probes of higher priority timed out")
+            return best
+        wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
@@ -0,0 +1,119 @@
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
+
+from clan_lib.network.reachability import (
+    ReachabilityCache,
+    first_by_priority,
+    spawn,
+)
+from clan_lib.ssh.remote import Remote
+
+if TYPE_CHECKING:
+    from clan_lib.network.network import Network
+
+
+def resolved(value: str | None) -> Future[str | None]:
+    future: Future[str | None] = Future()
+    future.set_result(value)
+    return future
+
+
+def delayed(value: str | None, seconds: float) -> Future[str | None]:
+    def run() -> str | None:
+        time.sleep(seconds)
+        return value
+
+    return spawn(run)
+
+
+def test_first_by_priority() -> None:
+    assert first_by_priority([resolved(None), resolved("b"), resolved("c")]) == 1
+    assert first_by_priority([resolved(None), resolved(None)]) is None
+    assert first_by_priority([]) is None
+    # a higher priority wins, even if it succeeds later
+    assert first_by_priority([delayed("a", 0.1), resolved("b")]) == 0
+    assert first_by_priority([delayed(None, 0.1), resolved("b")]) == 1
+
+
+def test_first_by_priority_deadline() -> None:
+    start = time.monotonic()
+    assert first_by_priority([delayed("a", 5), resolved("b")], deadline=0.1) == 1
+    assert time.monotonic() - start < 1
+    # without any success, all probes are waited for
+    assert first_by_priority([delayed("a", 0.2), delayed(None, 0.1)], deadline=0) == 0
+
+
+@dataclass
+class FakeModule:
+    latency: float | None
+    pings: list[str] = field(default_factory=list)
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def ping(self, remote: Remote) -> float | None:
+        with self.lock:
+            self.pings.append(remote.address)
+        time.sleep(0.05)
+        return self.latency
+
+
+@dataclass
+class FakeNetwork:
+    module: FakeModule
+    module_name: str = "clan_lib.network.direct"
+
+
+def test_reachability_cache() -> None:
+    module = FakeModule(latency=12.5)
+    network = cast("Network", FakeNetwork(module))
+    remote = Remote(address="example.com")
+    cache = ReachabilityCache(ttl=60)
+
+    assert cache.lookup(network, remote) is None
+    # concurrent probes of the same remote share one ping
+    probes = [spawn(lambda: cache.probe(network, remote)) for _ in range(8)]
+    assert {probe.result().latency for probe in probes} == {12.5}
+    assert module.pings == ["example.com"]
+    result = cache.lookup(network, remote)
+    assert result is not None
+    assert result.reachable
+
+    # expired results are probed again
+    cache.ttl = -1
+    assert cache.lookup(network, remote) is None
+    module.latency = None
+    assert not cache.probe(network, remote).reachable
+    assert module.pings == ["example.com", "example.com"]
+
+
+def test_reachability_store(tmp_path: Path) -> None:
+    store_file = tmp_path / "reachability.json"
+    reachable = cast("Network", FakeNetwork(FakeModule(latency=5.0)))
+    unreachable = cast(
+        "Network", FakeNetwork(FakeModule(latency=None), module_name="tor")
+    )
+    remote = Remote(address="example.com")
+
+    cache = ReachabilityCache(store_file=store_file)
+    cache.probe(reachable, remote)
+    cache.probe(reachable, remote, refresh=True)
+    cache.probe(unreachable, remote)
+    assert cache.lookup(unreachable, remote) is not None
+    cache.save(force=True)
+
+    # results of other processes are merged, not overwritten
+    other = ReachabilityCache(store_file=store_file)
+    other.probe(reachable, remote, refresh=True)
+    cache.save(force=True)
+    other.save(force=True)
+
+    cache = ReachabilityCache(store_file=store_file)
+    assert [r.latency for r in cache.history(reachable, remote)] == [5.0] * 3
+    assert cache.average_latency(reachable, remote) == 5.0
+    assert cache.lookup(reachable, remote) is not None
+    # failures of other processes are probed again
+    assert cache.history(unreachable, remote)
+    assert cache.lookup(unreachable, remote) is None
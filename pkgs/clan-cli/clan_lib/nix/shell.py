@@ -2,19 +2,30 @@ import json
 import logging
 import os
 import shutil
+import threading
+import time
 from dataclasses import dataclass
 from functools import cache
 from hashlib import sha256
 from pathlib import Path
+from typing import TYPE_CHECKING, Any
 
 from clan_lib.cmd import run
 from clan_lib.dirs import clan_tmp_dir, runtime_deps_flake
 from clan_lib.errors import ClanError
 from clan_lib.nix import current_system, nix_build, nix_command
-from clan_lib.nix.cache_cleanup import maybe_cleanup_cache
+from clan_lib.nix.cache_cleanup import CLEANUP_CHECK_INTERVAL, maybe_cleanup_cache
+
+if TYPE_CHECKING:
+    from clan_lib.flake.flake import Flake
 
 log = logging.getLogger(__name__)
 
+# Name of the file in the cache directory, that records the executable name
+# and GC root links of every resolved package. With it, packages resolved by
+# an earlier process don't need an evaluation of nixpkgs.
+INDEX_FILE = "index.json"
+
 
 @dataclass
 class ResolvedPackage:
@@ -75,11 +86,81 @@ def _get_nix_shell_cache_dir(nixpkgs_path: Path) -> Path:
     hashed = sha256(str(nixpkgs_path).encode()).hexdigest()[:16]
     cache_dir = Path(clan_tmp_dir()) / "nix_shell_cache" / hashed
     cache_dir.mkdir(parents=True, exist_ok=True)
+    _mark_used(cache_dir)
+    return cache_dir
+
+
+# When this process last marked a cache directory as used
+_cache_dirs_used: dict[Path, float] = {}
+
+
+def _mark_used(cache_dir: Path) -> None:
+    """Touch the directory to update mtime (marks it as "recently used").
 
-    # Touch the directory to update mtime (marks it as "recently used")
+    The cleanup removes directories by their mtime, see `maybe_cleanup_cache`.
+    Touched at most once per CLEANUP_CHECK_INTERVAL per process.
+    """
+    now = time.monotonic()
+    last_used = _cache_dirs_used.get(cache_dir)
+    if last_used is not None and now - last_used < CLEANUP_CHECK_INTERVAL:
+        return
+    _cache_dirs_used[cache_dir] = now
     cache_dir.touch(exist_ok=True)
 
-    return cache_dir
+
+@cache
+def _nixpkgs_flake(nixpkgs_path: Path) -> "Flake":
+    """Return the nixpkgs flake, shared by all resolutions of the process."""
+    # Import here to avoid circular import with clan_lib.nix
+    from clan_lib.flake.flake import Flake  # noqa: PLC0415
+
+    return Flake(str(nixpkgs_path))
+
+
+def _package_selectors(package: str) -> list[str]:
+    pkg_prefix = f"inputs.nixpkgs.legacyPackages.{current_system()}.{package}"
+    return [
+        f"{pkg_prefix}.outPath",
+        f"{pkg_prefix}.?meta.?mainProgram",
+        f"{pkg_prefix}.?meta.?outputsToInstall",
+    ]
+
+
+_index_lock = threading.Lock()
+
+
+def _read_index(cache_dir: Path) -> dict[str, Any]:
+    try:
+        index = json.loads((cache_dir / INDEX_FILE).read_text())
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return index if isinstance(index, dict) else {}
+
+
+def _update_index(cache_dir: Path, package: str, entry: dict[str, Any]) -> None:
+    with _index_lock:
+        index = _read_index(cache_dir)
+        index[package] = entry
+        tmp_file = cache_dir / f"{INDEX_FILE}.{os.getpid()}.tmp"
+        tmp_file.write_text(json.dumps(index))
+        tmp_file.replace(cache_dir / INDEX_FILE)
+
+
+def _resolve_from_index(cache_dir: Path, package: str) -> ResolvedPackage | None:
+    """Resolve a package from the index, if all its GC root links are valid."""
+    entry = _read_index(cache_dir).get(package)
+    if not isinstance(entry, dict):
+        return None
+    try:
+        links = [cache_dir / link for link in entry["links"]]
+        exe_name = entry["exe_name"]
+    except (KeyError, TypeError):
+        return None
+    if not links or not all(
+        link.is_symlink() and link.resolve().exists() for link in links
+    ):
+        return None
+    return ResolvedPackage(store_path=links[0].resolve(), exe_name=exe_name)
 
 
 def _create_gcroot(package: str, nixpkgs_path: Path, gcroot_path: Path) -> None:
@@ -115,24 +196,19 @@ def _resolve_package(nixpkgs_path: Path, package: str) -> ResolvedPackage | None
         ResolvedPackage with store path and executable name, or None if resolution fails
 
     """
-    # Use Flake.select to get package info
-    # Import here to avoid circular import with clan_lib.nix
-    from clan_lib.flake.flake import Flake  # noqa: PLC0415
+    cache_dir = _get_nix_shell_cache_dir(nixpkgs_path)
+    resolved = _resolve_from_index(cache_dir, package)
+    if resolved is not None:
+        _mark_used(cache_dir)
+        return resolved
 
-    nixpkgs = Flake(str(nixpkgs_path))
-    system = current_system()
-    pkg_prefix = f"inputs.nixpkgs.legacyPackages.{system}.{package}"
+    # Use Flake.select to get package info
+    nixpkgs = _nixpkgs_flake(nixpkgs_path)
+    pkg_prefix = f"inputs.nixpkgs.legacyPackages.{current_system()}.{package}"
 
     # Precache both selectors in one nix evaluation
-    nixpkgs.precache(
-        [
-            f"{pkg_prefix}.outPath",
-            f"{pkg_prefix}.?meta.?mainProgram",
-            f"{pkg_prefix}.?meta.?outputsToInstall",
-        ]
-    )
+    nixpkgs.precache(_package_selectors(package))
 
-    cache_dir = _get_nix_shell_cache_dir(nixpkgs_path)
     cache_links = [cache_dir / package]
     outputs_to_install_result = nixpkgs.select(f"{pkg_prefix}.?meta.?outputsToInstall")
     # The selector returns {"meta": {"outputsToInstall": [...]}} so extract the list
@@ -165,10 +241,15 @@ def _resolve_package(nixpkgs_path: Path, package: str) -> ResolvedPackage | None
     else:
         exe_name = package
 
+    index_entry = {
+        "exe_name": exe_name,
+        "links": [link.name for link in cache_links],
+    }
     if all_links_valid:
         # Use the first link's store path (primary output)
         store_path = cache_links[0].resolve()
-        cache_dir.touch(exist_ok=True)
+        _mark_used(cache_dir)
+        _update_index(cache_dir, package, index_entry)
         return ResolvedPackage(store_path=store_path, exe_name=exe_name)
 
     # Some or all symlinks are broken/missing, clean up and re-resolve
@@ -186,10 +267,68 @@ def _resolve_package(nixpkgs_path: Path, package: str) -> ResolvedPackage | None
 
     # Create GC root symlink
     _create_gcroot(package, nixpkgs_path, cache_link_base)
+    _update_index(cache_dir, package, index_entry)
 
     return ResolvedPackage(store_path=store_path, exe_name=exe_name)
 
 
+# Packages resolved by this process, keyed by nixpkgs path and package name.
+# Their GC roots keep the store paths alive, so they stay valid for the
+# lifetime of the process.
+_resolved_packages: dict[tuple[Path, str], ResolvedPackage] = {}
+_resolve_lock = threading.Lock()
+
+
+@cache
+def _runtime_nixpkgs_path() -> Path:
+    return runtime_deps_flake().resolve()
+
+
+def _resolve_packages(
+    nixpkgs_path: Path, packages: list[str]
+) -> list[ResolvedPackage] | None:
+    """Resolve packages, returns None if any of them cannot be resolved.
+
+    Packages are resolved once per process. Packages that are neither resolved
+    by this process nor found in the index are evaluated in one go.
+    """
+    keys = [(nixpkgs_path, pkg) for pkg in packages]
+    if all(key in _resolved_packages for key in keys):
+        # long running processes keep using the GC roots of the directory
+        _mark_used(_get_nix_shell_cache_dir(nixpkgs_path))
+        return [_resolved_packages[key] for key in keys]
+
+    with _resolve_lock:
+        missing = [
+            pkg for pkg in packages if (nixpkgs_path, pkg) not in _resolved_packages
+        ]
+
+        # Lazy cleanup: runs at most once per hour per process
+        maybe_cleanup_cache()
+
+        cache_dir = _get_nix_shell_cache_dir(nixpkgs_path)
+        indexed = {pkg: _resolve_from_index(cache_dir, pkg) for pkg in missing}
+        if any(result is not None for result in indexed.values()):
+            _mark_used(cache_dir)
+        not_indexed = [pkg for pkg, result in indexed.items() if result is None]
+        if len(not_indexed) > 1:
+            _nixpkgs_flake(nixpkgs_path).precache(
+                [
+                    selector
+                    for pkg in not_indexed
+                    for selector in _package_selectors(pkg)
+                ]
+            )
+
+        for pkg in missing:
+            result = indexed[pkg] or _resolve_package(nixpkgs_path, pkg)
+            if result is None:
+                return None
+            _resolved_packages[(nixpkgs_path, pkg)] = result
+
+        return [_resolved_packages[key] for key in keys]
+
+
 def _nix_shell_fallback(
     packages: list[str],
     cmd: list[str],
@@ -241,20 +380,12 @@ def nix_shell(packages: list[str], cmd: list[str]) -> list[str]:
     if not missing_packages:
         return cmd
 
-    # Lazy cleanup: runs at most once per hour per process
-    maybe_cleanup_cache()
-
     # Try to resolve packages via cache
-    nixpkgs_path = runtime_deps_flake().resolve()
-
-    resolved: list[ResolvedPackage] = []
-    for pkg in missing_packages:
-        result = _resolve_package(nixpkgs_path, pkg)
-        if result is None:
-            log.error("Falling back nix shell, this should never happen")
-            # Fall back to nix shell for all packages
-            return _nix_shell_fallback(missing_packages, cmd)
-        resolved.append(result)
+    resolved = _resolve_packages(_runtime_nixpkgs_path(), missing_packages)
+    if resolved is None:
+        log.error("Falling back nix shell, this should never happen")
+        # Fall back to nix shell for all packages
+        return _nix_shell_fallback(missing_packages, cmd)
 
     # All packages resolved - use PATH modification
     path_additions = [str(r.store_path / "bin") for r in resolved]
@@ -259,3 +259,44 @@ def test_resolve_multi_package_cache_hit_skips_gcroot_creation() -> None:
         # Results should be equivalent
         assert result1.store_path == result2.store_path
         assert result1.exe_name == result2.exe_name
+
+
+@pytest.mark.usefixtures("clear_nix_cache", "mock_nix_in_sandbox")
+def test_nix_shell_resolves_packages_once() -> None:
+    """Test that nix_shell resolves packages once per process, then from the index."""
+    resolve_calls: list[str] = []
+    original_resolve_package = _resolve_package
+
+    def counting_resolve_package(
+        nixpkgs_path: Path, package: str
+    ) -> ResolvedPackage | None:
+        resolve_calls.append(package)
+        return original_resolve_package(nixpkgs_path, package)
+
+    env = {"IN_NIX_SANDBOX": "", "CLAN_PROVIDED_PACKAGES": ""}
+    with (
+        patch.object(shell_module, "_resolve_package", counting_resolve_package),
+        patch.dict("os.environ", env),
+    ):
+        first = nix_shell(["git", "netcat"], ["nc", "test"])
+        second = nix_shell(["git", "netcat"], ["nc", "test"])
+    assert first == second
+    assert sorted(resolve_calls) == ["git", "netcat"]
+
+    # A new process resolves the packages from the index, without evaluation
+    shell_module._resolved_packages.clear()
+    shell_module._cache_dirs_used.clear()
+    cache_dir = _get_nix_shell_cache_dir(runtime_deps_flake().resolve())
+    os.utime(cache_dir, (0, 0))
+
+    def no_flake(_nixpkgs_path: Path) -> None:
+        msg = "nixpkgs should not be evaluated"
+        raise AssertionError(msg)
+
+    with (
+        patch.object(shell_module, "_nixpkgs_flake", no_flake),
+        patch.dict("os.environ", env),
+    ):
+        assert nix_shell(["git", "netcat"], ["nc", "test"]) == first
+    # index hits mark the directory as used, so the cleanup keeps it
+    assert cache_dir.stat().st_mtime > 0
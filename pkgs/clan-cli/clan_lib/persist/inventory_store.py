@@ -1,16 +1,16 @@
 import json
-from collections.abc import Callable
+from collections.abc import Callable, Iterable, Mapping, Sequence
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any, NotRequired, Protocol, TypedDict, cast
 
 from clan_lib.errors import ClanError
+from clan_lib.flake.views import materialize
 from clan_lib.git import commit_file
 from clan_lib.nix_models.typing import (
     InstancesOutput,
     InventoryInput,
     InventoryMetaOutput,
-    InventoryOutput,
     MachinesOutput,
 )
 from clan_lib.persist.patch_engine import calc_patches
@@ -23,6 +23,10 @@ from clan_lib.persist.path_utils import (
 from clan_lib.persist.write_rules import AttributeMap, compute_attribute_persistence
 
 
+def _is_list(value: Any) -> bool:
+    return isinstance(value, Sequence) and not isinstance(value, str)
+
+
 def unwrap_known_unknown(value: Any) -> Any:
     """Helper utility to unwrap our custom deferred module. (uniqueDeferredSerializableModule)
 
@@ -41,14 +45,14 @@ def unwrap_known_unknown(value: Any) -> Any:
     Otherwise, return the value unchanged.
     """
     if (
-        isinstance(value, dict)
+        isinstance(value, Mapping)
         and "imports" in value
-        and isinstance(value["imports"], list)
+        and _is_list(value["imports"])
         and len(value["imports"]) == 1
-        and isinstance(value["imports"][0], dict)
+        and isinstance(value["imports"][0], Mapping)
         and "_file" in value["imports"][0]
         and "imports" in value["imports"][0]
-        and isinstance(value["imports"][0]["imports"], list)
+        and _is_list(value["imports"][0]["imports"])
         and len(value["imports"][0]["imports"]) == 1
     ):
         return value["imports"][0]["imports"][0]
@@ -58,7 +62,10 @@ def unwrap_known_unknown(value: Any) -> Any:
 def sanitize(data: Any, whitelist_paths: list[str], current_path: list[str]) -> Any:
     """Recursively walks dicts only, unwraps matching values only on whitelisted paths.
     Throws error if a value would be transformed on non-whitelisted path.
+
+    Views of the flake cache are materialized to plain dicts and lists.
     """
+    data = materialize(data)
     if isinstance(data, dict):
         sanitized = {}
         for k, v in data.items():
@@ -87,7 +94,13 @@ class PersistenceInfo:
 class FlakeInterface(Protocol):
     def select(self, selector: str) -> Any: ...
 
-    def invalidate_cache(self) -> None: ...
+    def select_view(self, selector: str) -> Any: ...
+
+    def invalidate_cache(
+        self,
+        reset_tracking: bool = False,
+        changed_paths: Iterable[Path] | None = None,
+    ) -> None: ...
 
     @property
     def path(self) -> Path: ...
@@ -164,9 +177,10 @@ class InventoryStore:
             filtered = cast("InventorySnapshot", raw_value)
         return sanitize(filtered, self._allowed_path_transforms, [])
 
-    def get_readonly_raw(self, keys: set[str]) -> InventoryOutput:
+    def get_readonly_raw(self, keys: set[str]) -> Mapping[str, Any]:
+        """The evaluated inventory as read-only view, see `Flake.select_view`."""
         attrs = "{" + ",".join(sorted(keys)) + "}"
-        return self._flake.select(
+        return self._flake.select_view(
             f"clanInternals.inventoryClass.inventorySerialization.{attrs}"
         )
 
@@ -292,7 +306,7 @@ class InventoryStore:
                     commit_message=f"{self.inventory_file.name}: {message}",
                 )
 
-            self._flake.invalidate_cache()
+            self._flake.invalidate_cache(changed_paths=[self.inventory_file])
 
         if not patchset and not delete_set:
             # No changes, no need to write
@@ -2,6 +2,7 @@ import json
 import os
 import shutil
 import subprocess
+from collections.abc import Iterable
 from pathlib import Path
 from typing import Any
 
@@ -21,7 +22,11 @@ class MockFlake:
         assert f.exists(), f"File {f} does not exist"
         self._file = f
 
-    def invalidate_cache(self) -> None:
+    def invalidate_cache(
+        self,
+        reset_tracking: bool = False,
+        changed_paths: Iterable[Path] | None = None,
+    ) -> None:
         pass
 
     def select(
@@ -64,6 +69,9 @@ class MockFlake:
             raise ClanError(msg)
         return json.loads(res_str)
 
+    def select_view(self, selector: str) -> Any:
+        return self.select(selector)
+
     @property
     def path(self) -> Path:
         return self._file.parent
@@ -0,0 +1,106 @@
+"""Benchmark of calculating the patches of large inventory writes.
+
+Generates a synthetic inventory with about `--paths` leaf paths, all of it
+persisted in the inventory file, and calculates the patches of a bulk edit
+the way `InventoryStore.write` does: a tag is added to every machine, and
+every tenth machine and instance is deleted.
+
+Usage: python -m clan_lib.persist.patch_bench [--paths 10000] [--rounds 3]
+"""
+
+import argparse
+import time
+from copy import deepcopy
+from typing import Any
+
+from clan_lib.persist.patch_engine import calc_patches
+from clan_lib.persist.path_utils import flatten_data_structured
+from clan_lib.persist.write_rules import compute_attribute_persistence
+
+# leaf paths of one machine and its instance, see synthetic_inventory
+PATHS_PER_MACHINE = 17
+
+
+def synthetic_inventory(machines: int) -> dict[str, Any]:
+    return {
+        "machines": {
+            f"machine-{i}": {
+                "name": f"machine-{i}",
+                "description": f"Machine number {i}",
+                "machineClass": "nixos",
+                "tags": ["all", f"rack-{i % 10}"],
+                "deploy": {
+                    "targetHost": f"root@10.0.{i // 256}.{i % 256}",
+                    "buildHost": None,
+                },
+                "installedAt": 1700000000 + i,
+            }
+            for i in range(machines)
+        },
+        "instances": {
+            f"instance-{i}": {
+                "module": {"name": "borgbackup", "input": "clan-core"},
+                "roles": {
+                    "client": {
+                        "machines": {
+                            f"machine-{i}": {
+                                "settings": {
+                                    "paths": ["/home", "/var/lib"],
+                                    "exclude": [],
+                                    "startAt": "daily",
+                                },
+                            },
+                        },
+                        "tags": {"all": {}},
+                        "settings": {"encryption": "repokey"},
+                    },
+                    "server": {
+                        "machines": {},
+                        "tags": {f"rack-{i % 10}": {}},
+                        "settings": {"directory": "/var/lib/borg"},
+                    },
+                },
+            }
+            for i in range(machines)
+        },
+    }
+
+
+def bulk_edit(inventory: dict[str, Any]) -> dict[str, Any]:
+    update = deepcopy(inventory)
+    for i, name in enumerate(list(update["machines"])):
+        if i % 10 == 0:
+            del update["machines"][name]
+            del update["instances"][f"instance-{i}"]
+        else:
+            update["machines"][name]["tags"].append("bulk")
+    return update
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--paths", type=int, default=10000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    inventory = synthetic_inventory(max(args.paths // PATHS_PER_MACHINE, 1))
+    priorities = {key: {"__prio": 100} for key in inventory}
+    attribute_props = compute_attribute_persistence(priorities, inventory, inventory)
+    update = bulk_edit(inventory)
+
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        patches, delete_paths = calc_patches(
+            inventory, update, inventory, attribute_props
+        )
+    duration = (time.perf_counter() - start) / args.rounds
+
+    print(
+        f"{len(flatten_data_structured(inventory))} paths, "
+        f"{len(patches)} patches, {len(delete_paths)} deletions"
+    )
+    print(f"calc_patches {duration * 1000:>10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
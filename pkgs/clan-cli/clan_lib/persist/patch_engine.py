@@ -3,6 +3,7 @@ from typing import Any, cast
 
 from clan_lib.errors import ClanError
 from clan_lib.persist.path_utils import (
+    PathTrie,
     PathTuple,
     flatten_data_structured,
     list_difference,
@@ -108,6 +109,8 @@ Please report this issue at https://git.clan.lol/clan/clan-core/issues
             msg = f"Cannot delete path '{path_to_string(delete_path)}' - '{path_to_string(delete_path[-1:])}' is either required; or is set stacially via .nix files."
             raise ClanError(msg)
 
+    delete_trie = PathTrie(delete_paths)
+
     # Get all paths that might need processing
     all_paths: set[PathTuple] = set(all_values_flat) | set(update_flat)
 
@@ -123,7 +126,7 @@ Please report this issue at https://git.clan.lol/clan/clan-core/issues
             continue
 
         # Skip if path is marked for deletion or under a deletion path
-        if should_skip_path(path, delete_paths):
+        if should_skip_path(path, delete_trie):
             continue
 
         # Skip deletions (they're handled by delete_paths)
@@ -1,4 +1,5 @@
 from collections import Counter
+from collections.abc import Iterable
 from typing import Any, cast
 
 PathTuple = tuple[str, ...]
@@ -14,7 +15,12 @@ def list_difference(all_items: list, filter_items: list) -> list:
     list_difference(all_items, filter_items) == [1, 2]
 
     """
-    return [value for value in all_items if value not in filter_items]
+    try:
+        filter_set = set(filter_items)
+        return [value for value in all_items if value not in filter_set]
+    except TypeError:
+        # unhashable items, e.g. dicts
+        return [value for value in all_items if value not in filter_items]
 
 
 def find_duplicates(string_list: list[str]) -> list[str]:
@@ -166,23 +172,62 @@ def flatten_data_structured(
         {("key.foo",): "val1", ("key", "foo"): "val2"}
 
     """
-    flattened = {}
+    flattened: dict[PathTuple, Any] = {}
+    _flatten_into(flattened, data, parent_path)
+    return flattened
+
+
+def _flatten_into(
+    flattened: dict[PathTuple, Any], data: dict, parent_path: PathTuple
+) -> None:
+    # collects into one dict, instead of merging the dicts of every level
     for key, value in data.items():
         current_path = (*parent_path, key)
 
         if isinstance(value, dict):
             if value:
-                flattened.update(flatten_data_structured(value, current_path))
+                _flatten_into(flattened, value, current_path)
             else:
                 flattened[current_path] = {}
         else:
             flattened[current_path] = value
-    return flattened
 
 
-def should_skip_path(path: tuple, delete_paths: set[tuple]) -> bool:
+class PathTrie:
+    """Prefix trie of paths, to find the paths that are parents of a path.
+
+    Checking a path against a set of paths with path_starts_with takes time
+    linear in the size of the set, the trie only walks the keys of the path.
+    """
+
+    def __init__(self, paths: Iterable[PathTuple] = ()) -> None:
+        # key -> child node, None marks the end of a path
+        self._root: dict[str | None, Any] = {}
+        for path in paths:
+            self.add(path)
+
+    def add(self, path: PathTuple) -> None:
+        node = self._root
+        for key in path:
+            node = node.setdefault(key, {})
+        node[None] = True
+
+    def has_prefix_of(self, path: PathTuple) -> bool:
+        """Check if the trie contains path or one of its parents."""
+        node = self._root
+        for key in path:
+            if None in node:
+                return True
+            child = node.get(key)
+            if child is None:
+                return False
+            node = child
+        return None in node
+
+
+def should_skip_path(path: PathTuple, delete_paths: PathTrie) -> bool:
     """Check if path should be skipped because it's under a deletion path."""
-    return any(path_starts_with(path, delete_path) for delete_path in delete_paths)
+    return delete_paths.has_prefix_of(path)
 
 
 # TODO: use PathTuple
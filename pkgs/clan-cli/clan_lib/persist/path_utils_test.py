@@ -1,6 +1,7 @@
 import pytest
 
 from clan_lib.persist.path_utils import (
+    PathTrie,
     delete_by_path,
     flatten_data_structured,
     list_difference,
@@ -178,6 +179,30 @@ def test_list_unmerge() -> None:
     assert nix_machines == ["machineA"]
 
 
+def test_list_difference_unhashable() -> None:
+    all_items = [{"a": 1}, {"b": 2}, "c"]
+    assert list_difference(all_items, [{"b": 2}]) == [{"a": 1}, "c"]
+    assert list_difference(all_items, ["c"]) == [{"a": 1}, {"b": 2}]
+
+
+# --- PathTrie ---
+
+
+def test_path_trie() -> None:
+    trie = PathTrie([("machines", "jon"), ("instances", "a", "roles")])
+    assert trie.has_prefix_of(("machines", "jon"))
+    assert trie.has_prefix_of(("machines", "jon", "tags"))
+    assert not trie.has_prefix_of(("machines",))
+    assert not trie.has_prefix_of(("machines", "jonas"))
+    assert not trie.has_prefix_of(("instances", "a"))
+    assert trie.has_prefix_of(("instances", "a", "roles", "default"))
+    assert not trie.has_prefix_of(())
+
+    assert not PathTrie().has_prefix_of(("machines",))
+    # the empty path is a prefix of every path
+    assert PathTrie([()]).has_prefix_of(("machines",))
+
+
 # --- flatten_data_structured ---
 
 
@@ -2,9 +2,10 @@ from typing import Any
 
 from clan_lib.errors import ClanError
 from clan_lib.persist.path_utils import (
+    PathTrie,
     PathTuple,
     find_duplicates,
-    path_starts_with,
+    list_difference,
     path_to_string,
 )
 from clan_lib.persist.write_rules import AttributeMap, is_readonly_path
@@ -14,7 +15,7 @@ def validate_no_static_deletion(
     path: PathTuple, new_list: list[Any], static_items: list[Any]
 ) -> None:
     """Validate that we're not trying to delete static items from a list."""
-    missing_static = [item for item in static_items if item not in new_list]
+    missing_static = list_difference(static_items, new_list)
     if missing_static:
         msg = f"Path '{path_to_string(path)}' doesn't contain static items {missing_static} - They are readonly - since they are defined via a .nix file"
         raise ClanError(msg)
@@ -57,12 +58,8 @@ def validate_patch_conflicts(
     patches: set[PathTuple], delete_paths: set[PathTuple]
 ) -> None:
     """Ensure patches don't conflict with deletions."""
-    conflicts = {
-        path
-        for delete_path in delete_paths
-        for path in patches
-        if path_starts_with(path, delete_path)
-    }
+    delete_trie = PathTrie(delete_paths)
+    conflicts = {path for path in patches if delete_trie.has_prefix_of(path)}
 
     if conflicts:
         conflict_list = ", ".join(path_to_string(path) for path in sorted(conflicts))
@@ -1,5 +1,6 @@
 import logging
 import re
+import threading
 import tomllib
 from dataclasses import dataclass, field, fields
 from typing import Any, TypedDict, TypeVar
@@ -188,6 +189,50 @@ class ClanModules:
     core_input_name: str
 
 
+type ModuleKey = tuple[str | None, str | None]
+
+
+@dataclass(frozen=True)
+class InstanceRefIndex:
+    """Reverse index of the instances using a module, see find_instance_refs_for_module.
+
+    Looking up the instances of every module in the inventory scans all
+    instances once per module. The index maps the (name, input) of the module
+    ref of every instance to the instance names, in inventory order.
+    """
+
+    core_input_name: str
+    refs: dict[ModuleKey, list[str]]
+    # instance name -> position in the inventory
+    order: dict[str, int]
+
+    @classmethod
+    def from_instances(
+        cls, instances: InstancesOutput, core_input_name: str
+    ) -> "InstanceRefIndex":
+        refs: dict[ModuleKey, list[str]] = {}
+        order: dict[str, int] = {}
+        for position, (instance_name, instance) in enumerate(instances.items()):
+            local_ref = instance.get("module")
+            if not local_ref:
+                continue
+            key = (local_ref.get("name", instance_name), local_ref.get("input"))
+            refs.setdefault(key, []).append(instance_name)
+            order[instance_name] = position
+        return cls(core_input_name=core_input_name, refs=refs, order=order)
+
+    def find(self, module_ref: InstanceModuleOutput) -> list[str]:
+        """The names of the instances using the module of module_ref."""
+        name = module_ref.get("name")
+        res = self.refs.get((name, module_ref.get("input")), [])
+        # instances can refer to native modules by the core input explicitly
+        if module_ref.get("input") != self.core_input_name:
+            explicit = self.refs.get((name, self.core_input_name), [])
+            if explicit:
+                res = sorted([*res, *explicit], key=self.order.__getitem__)
+        return list(res)
+
+
 def find_instance_refs_for_module(
     instances: InstancesOutput,
     module_ref: InstanceModuleOutput,
@@ -203,24 +248,40 @@ def find_instance_refs_for_module(
         <instance>.module.name != None
         module_ref.input could be None, if explicit input refers to a native module
 
+    To look up many modules, build an InstanceRefIndex once instead.
     """
-    res: list[str] = []
-    for instance_name, instance in instances.items():
-        local_ref = instance.get("module")
-        if not local_ref:
-            continue
+    return InstanceRefIndex.from_instances(instances, core_input_name).find(module_ref)
 
-        local_name: str = local_ref.get("name", instance_name)
-        local_input: str | None = local_ref.get("input")
 
-        # Normal match
-        if (
-            local_name == module_ref.get("name")
-            and local_input == module_ref.get("input")
-        ) or (local_input == core_input_name and local_name == module_ref.get("name")):
-            res.append(instance_name)
+# flake identifier -> (flake hash, index) of the last inventory snapshot
+_instance_ref_indexes: dict[str, tuple[str, InstanceRefIndex]] = {}
+_instance_ref_indexes_lock = threading.Lock()
 
-    return res
+
+def instance_ref_index(flake: Flake, core_input_name: str) -> InstanceRefIndex:
+    """The InstanceRefIndex of the current inventory of flake.
+
+    The inventory is evaluated from the flake, so the index is built once per
+    revision of the flake and rebuilt once its hash changes, e.g. after the
+    inventory has been written.
+    """
+    flake_hash = flake.hash
+    with _instance_ref_indexes_lock:
+        cached = _instance_ref_indexes.get(flake.identifier)
+    if (
+        cached is not None
+        and cached[0] == flake_hash
+        and cached[1].core_input_name == core_input_name
+    ):
+        return cached[1]
+
+    instances = InventoryStore(flake).read().get("instances", {})
+    index = InstanceRefIndex.from_instances(instances, core_input_name)
+    # the hash is only known once the flake has been prefetched
+    if flake_hash is not None and flake.hash == flake_hash:
+        with _instance_ref_indexes_lock:
+            _instance_ref_indexes[flake.identifier] = (flake_hash, index)
+    return index
 
 
 type ServiceName = str
@@ -271,8 +332,6 @@ def list_service_modules(flake: Flake) -> ClanModules:
 
     # moduleName -> ModuleInfo
     builtin_modules: dict[str, Any] = flake.select(inventory_static_modules())
-    inventory_store = InventoryStore(flake)
-    instances = inventory_store.read().get("instances", {})
 
     first_name, first_module = next(iter(builtin_modules.items()))
     clan_input_name = None
@@ -289,6 +348,7 @@ def list_service_modules(flake: Flake) -> ClanModules:
         msg = "Could not determine the clan-core input name"
         raise ClanError(msg)
 
+    instance_refs = instance_ref_index(flake, clan_input_name)
     res: list[Module] = []
     for input_name, module_set in modules.items():
         for module_name, module_info in module_set.items():
@@ -303,9 +363,7 @@ def list_service_modules(flake: Flake) -> ClanModules:
 
             res.append(
                 Module(
-                    instance_refs=find_instance_refs_for_module(
-                        instances, module_ref, clan_input_name
-                    ),
+                    instance_refs=instance_refs.find(module_ref),
                     usage_ref=module_ref,
                     info=ModuleInfo(
                         roles={
@@ -333,7 +391,14 @@ def resolve_service_module_ref(
     :param module_ref: The module reference to check
     :raises ClanError: If the module_ref is invalid or missing required fields
     """
-    service_modules = list_service_modules(flake)
+    return find_service_module(list_service_modules(flake), module_ref)
+
+
+def find_service_module(
+    service_modules: ClanModules,
+    module_ref: InstanceModuleOutput,
+) -> Module:
+    """Same as resolve_service_module_ref, within already listed service_modules"""
     available_modules = service_modules.modules
 
     input_ref = module_ref.get("input", None)
@@ -480,6 +545,7 @@ def list_service_instances(flake: Flake) -> dict[str, InventoryInstanceInfo]:
     inventory = inventory_store.read()
 
     instances = inventory.get("instances", {})
+    service_modules = list_service_modules(flake)
     res: dict[str, InventoryInstanceInfo] = {}
     for instance_name, instance in instances.items():
         persisted_ref = instance.get("module")
@@ -488,7 +554,7 @@ def list_service_instances(flake: Flake) -> dict[str, InventoryInstanceInfo]:
             # raise ClanError("")
             continue
 
-        module = resolve_service_module_ref(flake, persisted_ref)
+        module = find_service_module(service_modules, persisted_ref)
 
         if module is None:
             msg = f"Module for instance '{instance_name}' not found"
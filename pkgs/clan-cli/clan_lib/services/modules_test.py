@@ -1,13 +1,18 @@
+import itertools
 from collections.abc import Callable
-from typing import TYPE_CHECKING
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+from unittest.mock import patch
 
 import pytest
 from clan_cli.tests.fixtures_flakes import nested_dict
 from clan_lib.errors import ClanError
 from clan_lib.flake.flake import Flake
 from clan_lib.services.modules import (
+    InstanceRefIndex,
     delete_service_instance,
     get_service_readmes,
+    instance_ref_index,
     list_service_instances,
     list_service_modules,
     set_service_instance,
@@ -364,3 +369,81 @@ def test_inline_extra_modules(clan_flake: Callable[..., Flake]) -> None:
     instances = list_service_instances(flake)
 
     assert set(instances.keys()) == {"static"}
+
+
+def test_instance_ref_index() -> None:
+    core = "clan-core"
+    refs: list[dict[str, Any]] = [
+        {},
+        {"name": "admin"},
+        {"name": "admin", "input": None},
+        {"name": "admin", "input": core},
+        {"name": "admin", "input": "other"},
+        {"name": "sshd", "input": "other"},
+        {"input": core},
+    ]
+    # every combination of module refs, in different orders
+    instances: dict[str, Any] = {
+        f"{i}-{j}": {"module": ref} if ref else {}
+        for i, j in itertools.product(range(2), range(len(refs)))
+        for ref in [refs[(i * 3 + j) % len(refs)]]
+    }
+    index = InstanceRefIndex.from_instances(instances, core)
+
+    def brute_force(module_ref: dict[str, Any]) -> list[str]:
+        res = []
+        for instance_name, instance in instances.items():
+            local_ref = instance.get("module")
+            if not local_ref:
+                continue
+            local_name = local_ref.get("name", instance_name)
+            local_input = local_ref.get("input")
+            if local_name == module_ref.get("name") and local_input in (
+                module_ref.get("input"),
+                core,
+            ):
+                res.append(instance_name)
+        return res
+
+    for name in ["admin", "sshd", "0-6", "missing"]:
+        for input_name in [None, core, "other"]:
+            module_ref: Any = {"name": name, "input": input_name}
+            assert index.find(module_ref) == brute_force(module_ref)
+    assert index.find({"name": "admin", "input": None}) == [
+        "0-1",
+        "0-2",
+        "0-3",
+        "1-0",
+        "1-5",
+        "1-6",
+    ]
+
+
+def test_instance_ref_index_per_flake_hash() -> None:
+    class FakeFlake:
+        identifier = "path:/clan"
+        path = Path("/clan")
+        hash: str | None = "sha256-a"
+
+    flake: Any = FakeFlake()
+    inventory: dict[str, Any] = {"instances": {"a": {"module": {"name": "admin"}}}}
+    admin: Any = {"name": "admin", "input": None}
+
+    with patch(
+        "clan_lib.services.modules.InventoryStore.read", return_value=inventory
+    ) as read:
+        assert instance_ref_index(flake, "core").find(admin) == ["a"]
+        inventory["instances"]["b"] = {"module": {"name": "admin"}}
+        # same revision of the flake, same snapshot
+        assert instance_ref_index(flake, "core").find(admin) == ["a"]
+        assert read.call_count == 1
+
+        flake.hash = "sha256-b"
+        assert instance_ref_index(flake, "core").find(admin) == ["a", "b"]
+        assert read.call_count == 2
+
+        # without a hash, the index is not cached
+        flake.hash = None
+        instance_ref_index(flake, "core")
+        instance_ref_index(flake, "core")
+        assert read.call_count == 4
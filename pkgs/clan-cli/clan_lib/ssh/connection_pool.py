@@ -0,0 +1,163 @@
+"""Pool of persistent SSH ControlMaster connections.
+
+`Remote.host_connection` used to start a ControlMaster in a temporary
+directory and to shut it down at the end of the context, so the phases of a
+deployment (network probing, secret upload, source upload, nix copy) and
+every further CLI invocation negotiated their own SSH session. Over Tor or
+iroh a single handshake costs seconds.
+
+The pool keeps one control socket per connection in the clan tmp dir, keyed
+by everything that decides where and how ssh connects: user, address, port
+and proxy settings. Masters are not shut down at the end of a context, ssh
+closes them after they have been idle for the ControlPersist timeout. Until
+then every phase and every later CLI invocation reuses the established
+connection.
+
+Before a pooled master is reused, `ssh -O check` makes sure it is still
+running; stale sockets are removed so that a new master is started. A master
+whose host went away (e.g. rebooted) still answers the check until the
+ServerAlive timeout closes it, so commands that kexec or reboot the host drop
+its master with `drop`.
+
+On macOS the default TMPDIR below /var/folders is too long for socket paths,
+so the pool lives in /tmp there, like the temporary control sockets of
+`Remote.host_connection`.
+
+`CLAN_SSH_CONTROL_PERSIST` sets the timeout in ssh's time format (e.g.
+`30s`, `10m`), `0` disables the pool.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import stat
+import subprocess
+import sys
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from clan_lib.dirs import clan_tmp_dir
+
+if TYPE_CHECKING:
+    from clan_lib.ssh.remote import Remote
+
+log = logging.getLogger(__name__)
+
+CONTROL_PERSIST_ENV = "CLAN_SSH_CONTROL_PERSIST"
+DEFAULT_CONTROL_PERSIST = "10m"
+
+# Unix socket paths are limited to 104 bytes on macOS (108 on Linux), and
+# ssh binds the master to "<ControlPath>.<16 random characters>" first.
+MAX_SOCKET_PATH = 104 - 17
+
+# Seconds to wait for a master to answer `ssh -O check` or `ssh -O exit`
+CONTROL_COMMAND_TIMEOUT = 5
+
+
+def control_persist() -> str | None:
+    """The ControlPersist timeout of pooled connections, None if disabled."""
+    value = os.environ.get(CONTROL_PERSIST_ENV, DEFAULT_CONTROL_PERSIST).strip()
+    if value in ("", "0", "no"):
+        return None
+    return value
+
+
+def connection_key(remote: "Remote") -> str:
+    """Identify the SSH connection remote would establish."""
+    key = [
+        remote.user,
+        remote.address,
+        remote.port,
+        remote.socks_port,
+        sorted(remote.ssh_options.items()),
+        str(remote.private_key) if remote.private_key else None,
+        remote.host_key_check,
+    ]
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:16]
+
+
+def pool_dir() -> Path:
+    """The directory containing the control directories of all connections."""
+    tmp_dir = clan_tmp_dir()
+    if sys.platform == "darwin" and str(tmp_dir).startswith("/var/folders/"):
+        return Path("/tmp") / f"clan-ssh-{os.getuid()}"  # noqa: S108 - Required on macOS due to the length of the default TMPDIR
+    return tmp_dir / "ssh"
+
+
+def _control_dir(remote: "Remote") -> Path | None:
+    if remote.verbose_ssh:
+        # With debug output enabled, a backgrounded master keeps the stderr
+        # of the command that started it open until it exits.
+        return None
+    control_dir = pool_dir() / connection_key(remote)
+    if len(str(control_dir / "socket")) > MAX_SOCKET_PATH:
+        log.debug(f"Not pooling ssh connections, {control_dir.parent} is too long")
+        return None
+    return control_dir
+
+
+def pooled_control_dir(remote: "Remote") -> Path | None:
+    """The directory of the shared control socket of remote's connection.
+
+    Returns None if the connection should not be pooled.
+    """
+    control_dir = _control_dir(remote)
+    if control_dir is None:
+        return None
+    control_dir.parent.mkdir(mode=0o700, exist_ok=True)
+    # the pool can be in /tmp, which every user can write to
+    info = control_dir.parent.lstat()
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        log.debug(f"Not pooling ssh connections, {control_dir.parent} is not ours")
+        return None
+    control_dir.mkdir(mode=0o700, exist_ok=True)
+    return control_dir
+
+
+def _control_command(remote: "Remote", socket_path: Path, command: str) -> bool:
+    try:
+        return (
+            subprocess.run(
+                [
+                    "ssh",
+                    "-o",
+                    f"ControlPath={socket_path}",
+                    "-O",
+                    command,
+                    remote.target,
+                ],
+                check=False,
+                capture_output=True,
+                timeout=CONTROL_COMMAND_TIMEOUT,
+            ).returncode
+            == 0
+        )
+    except subprocess.TimeoutExpired:
+        return False
+
+
+def _stop_master(remote: "Remote", socket_path: Path) -> None:
+    _control_command(remote, socket_path, "exit")
+    # ssh keeps the socket file if the master was killed
+    socket_path.unlink(missing_ok=True)
+
+
+def check_master(remote: "Remote", control_dir: Path) -> None:
+    """Stop the master in control_dir if it does not respond anymore."""
+    socket_path = control_dir / "socket"
+    if socket_path.exists() and not _control_command(remote, socket_path, "check"):
+        log.debug(f"Removing stale ssh control socket {socket_path}")
+        _stop_master(remote, socket_path)
+
+
+def drop(remote: "Remote") -> None:
+    """Stop the pooled master of remote's connection, if there is one.
+
+    Used after the host was rebooted or kexec'ed, the master would otherwise
+    stall the next commands until ssh notices that the host is gone.
+    """
+    control_dir = _control_dir(remote)
+    if control_dir is not None and (control_dir / "socket").exists():
+        log.debug(f"Stopping the ssh master of {remote.target}")
+        _stop_master(remote, control_dir / "socket")
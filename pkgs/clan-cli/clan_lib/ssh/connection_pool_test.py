@@ -0,0 +1,106 @@
+import os
+import sys
+from collections.abc import Iterator
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from clan_lib.ssh import connection_pool
+from clan_lib.ssh.remote import Remote
+
+
+@pytest.fixture
+def pool_dir(monkeypatch: pytest.MonkeyPatch) -> Iterator[Path]:
+    # tmp_path is too long for unix socket paths
+    with TemporaryDirectory(prefix="pool") as tmp_dir:
+        monkeypatch.setattr(connection_pool, "clan_tmp_dir", lambda: Path(tmp_dir))
+        monkeypatch.delenv(connection_pool.CONTROL_PERSIST_ENV, raising=False)
+        yield Path(tmp_dir) / "ssh"
+
+
+def test_connection_key() -> None:
+    remote = Remote(address="example.com", user="root")
+    key = connection_pool.connection_key(remote)
+    assert key == connection_pool.connection_key(
+        Remote(address="example.com", user="root", command_prefix="machine")
+    )
+    for other in [
+        remote.override(user="admin"),
+        remote.override(address="example.org"),
+        remote.override(port=2222),
+        remote.override(socks_port=9050),
+        remote.override(ssh_options={"ProxyJump": "jump"}),
+    ]:
+        assert connection_pool.connection_key(other) != key
+
+
+def test_host_connection_shares_control_socket(pool_dir: Path) -> None:
+    remote = Remote(address="example.com", user="root")
+    with remote.host_connection() as first:
+        assert first._control_path_dir is not None
+        assert first._control_path_dir.parent == pool_dir
+    with remote.override(port=22).host_connection() as second:
+        assert second._control_path_dir != first._control_path_dir
+    with remote.host_connection() as third:
+        assert third._control_path_dir == first._control_path_dir
+        opts = third._ssh_cmd_opts()
+        assert f"ControlPersist={connection_pool.DEFAULT_CONTROL_PERSIST}" in opts
+        # nix copy rides the same master
+        sshopts = third.nix_ssh_env()["NIX_SSHOPTS"]
+        assert f"ControlPath={third._control_path_dir / 'socket'}" in sshopts
+    # the socket directory outlives the contexts for later invocations
+    assert first._control_path_dir.is_dir()
+
+
+def test_host_connection_without_pool(
+    pool_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv(connection_pool.CONTROL_PERSIST_ENV, "0")
+    remote = Remote(address="example.com", user="root")
+    with remote.host_connection() as conn:
+        assert conn._control_path_dir is not None
+        assert conn._control_path_dir.parent != pool_dir
+        assert "ControlPersist=1m" in conn._ssh_cmd_opts()
+        control_path_dir = conn._control_path_dir
+    assert not control_path_dir.exists()
+
+
+@pytest.mark.usefixtures("pool_dir")
+def test_stale_socket_is_removed() -> None:
+    remote = Remote(address="example.com", user="root")
+    with remote.host_connection() as conn:
+        assert conn._control_path_dir is not None
+        socket_path = conn._control_path_dir / "socket"
+    # e.g. left behind by a killed master, which would disable multiplexing
+    socket_path.write_text("")
+    with remote.host_connection():
+        assert not socket_path.exists()
+
+    socket_path.write_text("")
+    connection_pool.drop(remote)
+    assert not socket_path.exists()
+    # nothing to drop
+    connection_pool.drop(remote)
+
+
+def test_pool_dir_on_macos(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(sys, "platform", "darwin")
+    monkeypatch.setattr(
+        connection_pool,
+        "clan_tmp_dir",
+        lambda: Path("/var/folders/xy/abcdefghijklmnopqrstuvwxyz/T/clan-cache-501"),
+    )
+    pool_dir = connection_pool.pool_dir()
+    assert pool_dir == Path(f"/tmp/clan-ssh-{os.getuid()}")  # noqa: S108
+    key = connection_pool.connection_key(Remote(address="example.com"))
+    assert len(str(pool_dir / key / "socket")) <= connection_pool.MAX_SOCKET_PATH
+
+
+def test_foreign_pool_dir_is_not_used(
+    pool_dir: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    pool_dir.mkdir()
+    monkeypatch.setattr(os, "getuid", lambda: pool_dir.stat().st_uid + 1)
+    remote = Remote(address="example.com", user="root")
+    assert connection_pool.pooled_control_dir(remote) is None
@@ -18,6 +18,7 @@ from clan_lib.cmd import CmdOut, RunOpts, run
 from clan_lib.colors import AnsiColor
 from clan_lib.errors import ClanError, indent_command  # Assuming these are available
 from clan_lib.nix import nix_shell
+from clan_lib.ssh import connection_pool
 from clan_lib.ssh.host_key import HostKeyCheck, hostkey_to_ssh_opts
 from clan_lib.ssh.socks_wrapper import SocksWrapper
 from clan_lib.ssh.sudo_askpass_proxy import SudoAskpassProxy
@@ -50,6 +51,7 @@ class Remote:
     socks_wrapper: SocksWrapper | None = None
 
     _control_path_dir: Path | None = None
+    _control_persist: str = "1m"
     _askpass_path: str | None = None
 
     def __str__(self) -> str:
@@ -98,6 +100,7 @@ class Remote:
             if socks_wrapper is not None
             else self.socks_wrapper,
             _control_path_dir=self._control_path_dir,
+            _control_persist=self._control_persist,
             _askpass_path=self._askpass_path,
         )
 
@@ -142,29 +145,27 @@ class Remote:
     @contextmanager
     def host_connection(self) -> Iterator["Remote"]:
         """Context manager to manage SSH ControlMaster connections.
-        This will create a temporary directory for the control socket.
+
+        The control socket is taken from the connection pool, so the master
+        is shared with every other context for the same connection and
+        outlives this one, see `clan_lib.ssh.connection_pool`. If the pool
+        is disabled, a temporary directory is used for the control socket
+        and the master is terminated at the end of the context.
         """
+        persist = connection_pool.control_persist()
+        control_dir = connection_pool.pooled_control_dir(self) if persist else None
+        if persist and control_dir is not None:
+            connection_pool.check_master(self, control_dir)
+            yield self._with_control_path(control_dir, persist)
+            return
+
         directory = None
         if sys.platform == "darwin" and os.environ.get("TMPDIR", "").startswith(
             "/var/folders/",
         ):
             directory = "/tmp/"  # noqa: S108 - Required on macOS due to bugs with default TMPDIR
         with TemporaryDirectory(prefix="clan-ssh", dir=directory) as temp_dir:
-            remote = Remote(
-                address=self.address,
-                user=self.user,
-                command_prefix=self.command_prefix,
-                port=self.port,
-                private_key=self.private_key,
-                password=self.password,
-                forward_agent=self.forward_agent,
-                host_key_check=self.host_key_check,
-                verbose_ssh=self.verbose_ssh,
-                ssh_options=self.ssh_options,
-                socks_port=self.socks_port,
-                _control_path_dir=Path(temp_dir),
-                _askpass_path=self._askpass_path,
-            )
+            remote = self._with_control_path(Path(temp_dir), "1m")
             try:
                 yield remote
             finally:
@@ -190,6 +191,25 @@ class Remote:
                         # If exit fails still try to stop the master connection
                         pass
 
+    def _with_control_path(self, control_path_dir: Path, persist: str) -> "Remote":
+        return Remote(
+            address=self.address,
+            user=self.user,
+            command_prefix=self.command_prefix,
+            port=self.port,
+            private_key=self.private_key,
+            password=self.password,
+            forward_agent=self.forward_agent,
+            host_key_check=self.host_key_check,
+            verbose_ssh=self.verbose_ssh,
+            ssh_options=self.ssh_options,
+            socks_port=self.socks_port,
+            socks_wrapper=self.socks_wrapper,
+            _control_path_dir=control_path_dir,
+            _control_persist=persist,
+            _askpass_path=self._askpass_path,
+        )
+
     @contextmanager
     def become_root(self) -> Iterator["Remote"]:
         """Context manager to set up sudo askpass proxy.
@@ -250,6 +270,7 @@ class Remote:
                 ssh_options=self.ssh_options,
                 socks_port=self.socks_port,
                 _control_path_dir=self._control_path_dir,
+                _control_persist=self._control_persist,
                 _askpass_path=askpass_path,
             )
         finally:
@@ -383,11 +404,23 @@ class Remote:
                     "-o",
                     "ControlMaster=auto",
                     "-o",
-                    "ControlPersist=1m",
+                    f"ControlPersist={self._control_persist}",
                     "-o",
                     f"ControlPath={socket_path}",
                 ],
             )
+            if "ServerAliveInterval" not in self.ssh_options:
+                # Masters outlive the command that started them, make them
+                # exit once the host is gone, instead of stalling the
+                # commands that are multiplexed over them later on.
+                ssh_opts.extend(
+                    [
+                        "-o",
+                        "ServerAliveInterval=15",
+                        "-o",
+                        "ServerAliveCountMax=3",
+                    ]
+                )
         return ssh_opts
 
     def ssh_url(self, scheme: str = "ssh") -> str:
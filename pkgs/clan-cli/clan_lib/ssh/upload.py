@@ -1,15 +1,70 @@
+import hashlib
+import io
+import logging
+import os
 import tarfile
+from collections.abc import Iterable, Iterator
+from dataclasses import dataclass
 from pathlib import Path
-from tempfile import TemporaryDirectory
 
 from clan_lib.cmd import Log, RunOpts
 from clan_lib.errors import ClanError
 from clan_lib.ssh.host import Host
 
+log = logging.getLogger(__name__)
+
 # Safety constants for upload paths
 MIN_SAFE_DEPTH = 3  # Minimum path depth for safety
 MIN_EXCEPTION_DEPTH = 2  # Minimum depth for allowed exceptions
 
+COMPRESSLEVEL_ENV = "CLAN_UPLOAD_COMPRESSLEVEL"
+DEFAULT_COMPRESSLEVEL = 9
+MAX_COMPRESSLEVEL = 9
+
+
+def default_compresslevel() -> int:
+    """The gzip level of uploads, set by CLAN_UPLOAD_COMPRESSLEVEL."""
+    value = os.environ.get(COMPRESSLEVEL_ENV, "").strip()
+    if not value:
+        return DEFAULT_COMPRESSLEVEL
+    if not value.isdigit() or int(value) > MAX_COMPRESSLEVEL:
+        msg = f"{COMPRESSLEVEL_ENV} must be a number from 0 to {MAX_COMPRESSLEVEL}, got '{value}'"
+        raise ClanError(msg)
+    return int(value)
+
+
+def _check_destination_depth(remote_dest: Path) -> None:
+    # Check the depth of the remote destination path to prevent accidental deletion
+    # of important directories like /home/user when uploading a directory,
+    # as the process involves `rm -rf` on the destination.
+    # Calculate the depth (number of components after the root '/')
+    # / -> depth 0
+    # /a -> depth 1
+    # /a/b -> depth 2
+    # /a/b/c -> depth 3
+    depth = len(remote_dest.parts) - 1
+
+    # General rule: destination must be at least 3 levels deep for safety.
+    is_too_shallow = depth < MIN_SAFE_DEPTH
+
+    # Exceptions: Allow depth 2 if the path starts with /tmp/, /root/, or /etc/.
+    # This allows destinations like /tmp/mydir or /etc/conf.d, but not /tmp or /etc directly.
+    is_allowed_exception = depth >= MIN_EXCEPTION_DEPTH and (
+        str(remote_dest).startswith("/tmp/")  # noqa: S108 - Path validation check
+        or str(remote_dest).startswith("/root/")
+        or str(remote_dest).startswith("/etc/")
+    )
+
+    # Raise error if the path is too shallow and not an allowed exception.
+    if is_too_shallow and not is_allowed_exception:
+        msg = (
+            f"When uploading a directory, the remote destination '{remote_dest}' is considered unsafe "
+            f"(depth {depth}). It must be at least 3 levels deep (e.g., /path/to/dir), "
+            f"or at least 2 levels deep starting with /tmp/, /root/, or /etc/ (e.g., /tmp/mydir). "
+            f"Reason: The existing destination '{remote_dest}' will be recursively deleted ('rm -rf') before upload."
+        )
+        raise ClanError(msg)
+
 
 def upload(
     host: Host,
@@ -19,103 +74,292 @@ def upload(
     file_group: str = "root",
     dir_mode: int = 0o700,
     file_mode: int = 0o400,
+    compresslevel: int | None = None,
 ) -> None:
-    # Check the depth of the remote destination path to prevent accidental deletion
-    # of important directories like /home/user when uploading a directory,
-    # as the process involves `rm -rf` on the destination.
+    """Upload a file or directory to the host.
+
+    compresslevel is the gzip level of the transferred tarball, 0 disables
+    compression (e.g. on fast local networks). Defaults to
+    CLAN_UPLOAD_COMPRESSLEVEL, or 9 if that is not set.
+    """
+    if compresslevel is None:
+        compresslevel = default_compresslevel()
     if local_src.is_dir():
-        # Calculate the depth (number of components after the root '/')
-        # / -> depth 0
-        # /a -> depth 1
-        # /a/b -> depth 2
-        # /a/b/c -> depth 3
-        depth = len(remote_dest.parts) - 1
-
-        # General rule: destination must be at least 3 levels deep for safety.
-        is_too_shallow = depth < MIN_SAFE_DEPTH
-
-        # Exceptions: Allow depth 2 if the path starts with /tmp/, /root/, or /etc/.
-        # This allows destinations like /tmp/mydir or /etc/conf.d, but not /tmp or /etc directly.
-        is_allowed_exception = depth >= MIN_EXCEPTION_DEPTH and (
-            str(remote_dest).startswith("/tmp/")  # noqa: S108 - Path validation check
-            or str(remote_dest).startswith("/root/")
-            or str(remote_dest).startswith("/etc/")
+        _check_destination_depth(remote_dest)
+
+    if local_src.is_dir():
+        cmd = 'install -d -m "$1" "$0" && find "$0" -mindepth 1 -delete && tar -C "$0" -x"$2"f -'
+    elif local_src.is_file():
+        cmd = 'rm -f "$0" && tar -C "$(dirname "$0")" -x"$2"f -'
+    else:
+        msg = f"Unsupported source type: {local_src}"
+        raise ClanError(msg)
+
+    # The tarball is generated while it is sent to the host, so it is neither
+    # written to disk nor kept in memory as a whole.
+    host.run(
+        [
+            "bash",
+            "-c",
+            cmd,
+            str(remote_dest),
+            f"{dir_mode:o}",
+            "z" if compresslevel > 0 else "",
+        ],
+        quiet=True,
+        opts=RunOpts(
+            input=_tar_stream(
+                _tree_members(local_src)
+                if local_src.is_dir()
+                else [(local_src, remote_dest.name)],
+                file_user=file_user,
+                file_group=file_group,
+                dir_mode=dir_mode,
+                file_mode=file_mode,
+                compresslevel=compresslevel,
+            ),
+            log=Log.BOTH,
+            prefix=host.command_prefix,
+            needs_user_terminal=True,
+        ),
+    )
+
+
+def _tree_members(local_src: Path) -> Iterator[tuple[Path, str]]:
+    """All directories and files below local_src, with their relative paths."""
+    for root, dirs, files in local_src.walk():
+        for name in [*dirs, *files]:
+            path = root / name
+            yield path, str(path.relative_to(local_src))
+
+
+def _tar_stream(
+    members: Iterable[tuple[Path, str]],
+    file_user: str,
+    file_group: str,
+    dir_mode: int,
+    file_mode: int,
+    compresslevel: int,
+) -> Iterator[bytes]:
+    """Generate a tarball of the (path, arcname) members, yielding it chunk by chunk."""
+    buf = io.BytesIO()
+
+    def flush() -> bytes:
+        chunk = buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+        return chunk
+
+    # We set the permissions of the files and directories in the tarball to read only and owned by root
+    # As first uploading the tarball and then changing the permissions can lead an attacker to
+    # do a race condition attack
+    with (
+        tarfile.open(fileobj=buf, mode="w|gz", compresslevel=compresslevel)
+        if compresslevel > 0
+        else tarfile.open(fileobj=buf, mode="w|") as tar
+    ):
+        for path, arcname in members:
+            tarinfo = tar.gettarinfo(path, arcname=arcname)
+            tarinfo.uname = file_user
+            tarinfo.gname = file_group
+            if tarinfo.isdir():
+                tarinfo.mode = dir_mode
+                tar.addfile(tarinfo)
+                continue
+            tarinfo.mode = file_mode
+            with path.open("rb") as f:
+                tar.addfile(tarinfo, f)
+            yield flush()
+    yield flush()
+
+
+@dataclass(frozen=True)
+class _Entry:
+    kind: str  # "d" or "f", as printed by find -printf %y
+    mode: int
+    user: str
+    group: str
+    sha256: str | None = None
+
+
+# Name of the staging directory inside the destination, see _SYNC_SCRIPT
+_STAGING = ".clan-staging"
+
+# Prints whether the files can be chowned (R for root) and the entries below
+# $0 with the hashes of its files, NUL separated
+_MANIFEST_SCRIPT = f"""
+set -eu
+cd "$0" 2>/dev/null || exit 0
+if [ "$(id -u)" = 0 ]; then printf 'R\\0'; fi
+find . -mindepth 1 -path ./{_STAGING} -prune -o -printf 'E %y %m %u %g %P\\0'
+find . -mindepth 1 -path ./{_STAGING} -prune -o -type f -exec sha256sum -z -- {{}} +
+"""
+
+# Extracts the changed entries from the tarball on stdin into a staging
+# directory inside the destination, removes the removed paths ($3...) from
+# the destination and moves the changed entries into place. Staging inside
+# the destination keeps the files on its filesystem (e.g. a tmpfs for
+# secrets), and works if the destination is a mount point. Every file is
+# replaced by a rename, so it is never missing or partially written.
+_SYNC_SCRIPT = f"""
+set -eu
+dest=$0 mode=$1 z=$2
+shift 2
+staging=$dest/{_STAGING}
+install -d -m "$mode" "$dest"
+rm -rf "$staging"
+install -d -m 700 "$staging"
+tar -C "$staging" -x"$z"f -
+(cd "$dest" && rm -rf -- "$@")
+cd "$staging"
+find . -mindepth 1 -type d -printf '%P\\0' | while IFS= read -r -d '' path; do
+  if [ ! -d "$dest/$path" ]; then
+    rm -f "$dest/$path"
+    mkdir "$dest/$path"
+  fi
+  chmod --reference="$path" "$dest/$path"
+  if [ "$(id -u)" = 0 ]; then chown --reference="$path" "$dest/$path"; fi
+done
+find . -type f -printf '%P\\0' | while IFS= read -r -d '' path; do
+  if [ -d "$dest/$path" ]; then rm -rf "$dest/$path"; fi
+  mv -fT "$path" "$dest/$path"
+done
+cd /
+rm -rf "$staging"
+"""
+
+
+def _parse_manifest(output: bytes) -> tuple[bool, dict[str, _Entry]]:
+    """Whether the host can chown files, and the entries of the manifest."""
+    can_chown = False
+    entries: dict[str, _Entry] = {}
+    hashes: dict[str, str] = {}
+    for record in output.split(b"\0"):
+        if not record:
+            continue
+        line = record.decode()
+        if line == "R":
+            can_chown = True
+        elif line.startswith("E "):
+            _, kind, mode, user, group, path = line.split(" ", 5)
+            entries[path] = _Entry(kind, int(mode, 8), user, group)
+        else:
+            sha256, path = line.split("  ", 1)
+            hashes[path.removeprefix("./")] = sha256
+    return can_chown, {
+        path: _Entry(entry.kind, entry.mode, entry.user, entry.group, hashes.get(path))
+        for path, entry in entries.items()
+    }
+
+
+def _sha256(path: Path) -> str:
+    with path.open("rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+def sync_dir(
+    host: Host,
+    local_src: Path,
+    remote_dest: Path,
+    file_user: str = "root",
+    file_group: str = "root",
+    dir_mode: int = 0o700,
+    file_mode: int = 0o400,
+    compresslevel: int | None = None,
+) -> None:
+    """Make remote_dest a copy of the local_src directory, like `upload`.
+
+    The hashes of the files already on the host are fetched first, and only
+    changed files are transferred. Nothing is changed on the host if the
+    directory is up to date. Otherwise the changed files are extracted into a
+    staging directory inside remote_dest and renamed into place one by one.
+    The owners of the files are only compared if the host can change them,
+    i.e. if the commands run as root.
+
+    Falls back to `upload` if the host lacks the GNU tools to list its files.
+    """
+    _check_destination_depth(remote_dest)
+    if compresslevel is None:
+        compresslevel = default_compresslevel()
+
+    manifest = host.run(
+        ["bash", "-c", _MANIFEST_SCRIPT, str(remote_dest)],
+        quiet=True,
+        opts=RunOpts(check=False, log=Log.NONE, prefix=host.command_prefix),
+    )
+    if manifest.returncode != 0:
+        log.debug(
+            f"Could not list {remote_dest} on the host, uploading all files: {manifest.stderr}"
+        )
+        upload(
+            host,
+            local_src,
+            remote_dest,
+            file_user=file_user,
+            file_group=file_group,
+            dir_mode=dir_mode,
+            file_mode=file_mode,
+            compresslevel=compresslevel,
         )
+        return
+    can_chown, remote = _parse_manifest(manifest.stdout_raw)
 
-        # Raise error if the path is too shallow and not an allowed exception.
-        if is_too_shallow and not is_allowed_exception:
-            msg = (
-                f"When uploading a directory, the remote destination '{remote_dest}' is considered unsafe "
-                f"(depth {depth}). It must be at least 3 levels deep (e.g., /path/to/dir), "
-                f"or at least 2 levels deep starting with /tmp/, /root/, or /etc/ (e.g., /tmp/mydir). "
-                f"Reason: The existing destination '{remote_dest}' will be recursively deleted ('rm -rf') before upload."
-            )
-            raise ClanError(msg)
-
-    # Create the tarball from the temporary directory
-    with TemporaryDirectory(prefix="vars-upload-") as tardir:
-        tar_path = Path(tardir) / "upload.tar.gz"
-        # We set the permissions of the files and directories in the tarball to read only and owned by root
-        # As first uploading the tarball and then changing the permissions can lead an attacker to
-        # do a race condition attack
-        with tarfile.open(str(tar_path), "w:gz") as tar:
-            if local_src.is_dir():
-                # Handle directory upload
-                for root, dirs, files in local_src.walk():
-                    for mdir in dirs:
-                        dir_path = Path(root) / mdir
-                        tarinfo = tar.gettarinfo(
-                            dir_path,
-                            arcname=str(dir_path.relative_to(str(local_src))),
-                        )
-                        tarinfo.mode = dir_mode
-                        tarinfo.uname = file_user
-                        tarinfo.gname = file_group
-                        tar.addfile(tarinfo)
-                    for file in files:
-                        file_path = Path(root) / file
-                        tarinfo = tar.gettarinfo(
-                            file_path,
-                            arcname=str(file_path.relative_to(str(local_src))),
-                        )
-                        tarinfo.mode = file_mode
-                        tarinfo.uname = file_user
-                        tarinfo.gname = file_group
-                        with file_path.open("rb") as f:
-                            tar.addfile(tarinfo, f)
-            else:
-                # Handle single file upload
-                tarinfo = tar.gettarinfo(local_src, arcname=remote_dest.name)
-                tarinfo.mode = file_mode
-                tarinfo.uname = file_user
-                tarinfo.gname = file_group
-                with local_src.open("rb") as f:
-                    tar.addfile(tarinfo, f)
-
-        cmd = None
-        if local_src.is_dir():
-            cmd = 'install -d -m "$1" "$0" && find "$0" -mindepth 1 -delete && tar -C "$0" -xzf -'
-        elif local_src.is_file():
-            cmd = 'rm -f "$0" && tar -C "$(dirname "$0")" -xzf -'
+    members = list(_tree_members(local_src))
+    changed: set[str] = set()
+    for path, relative_path in members:
+        entry = remote.pop(relative_path, None)
+        # without root, tar extracts the files owned by the remote user
+        user, group = (
+            (file_user, file_group)
+            if can_chown or entry is None
+            else (entry.user, entry.group)
+        )
+        if path.is_dir():
+            wanted = _Entry("d", dir_mode, user, group)
         else:
-            msg = f"Unsupported source type: {local_src}"
-            raise ClanError(msg)
+            wanted = _Entry("f", file_mode, user, group, _sha256(path))
+        if entry != wanted:
+            changed.add(relative_path)
+    # whatever is left on the host does not exist locally anymore
+    removed = sorted(remote)
 
-        # TODO accept `input` to be  an IO object instead of bytes so that we don't have to read the tarfile into memory.
-        with tar_path.open("rb") as f:
-            host.run(
+    if not changed and not removed:
+        log.info(f"{remote_dest} is up to date")
+        return
+    transferred = changed.union(
+        *(map(str, Path(relative_path).parents[:-1]) for relative_path in changed)
+    )
+    log.info(
+        f"Updating {len(changed)} and removing {len(removed)} entries in {remote_dest}"
+    )
+    host.run(
+        [
+            "bash",
+            "-c",
+            _SYNC_SCRIPT,
+            str(remote_dest),
+            f"{dir_mode:o}",
+            "z" if compresslevel > 0 else "",
+            *removed,
+        ],
+        quiet=True,
+        opts=RunOpts(
+            input=_tar_stream(
+                # the parent directories of changed entries are sent too,
+                # so that tar does not create them with default permissions
                 [
-                    "bash",
-                    "-c",
-                    cmd,
-                    str(remote_dest),
-                    f"{dir_mode:o}",
+                    (path, relative_path)
+                    for path, relative_path in members
+                    if relative_path in transferred
                 ],
-                quiet=True,
-                opts=RunOpts(
-                    input=f,
-                    log=Log.BOTH,
-                    prefix=host.command_prefix,
-                    needs_user_terminal=True,
-                ),
-            )
+                file_user=file_user,
+                file_group=file_group,
+                dir_mode=dir_mode,
+                file_mode=file_mode,
+                compresslevel=compresslevel,
+            ),
+            log=Log.BOTH,
+            prefix=host.command_prefix,
+            needs_user_terminal=True,
+        ),
+    )
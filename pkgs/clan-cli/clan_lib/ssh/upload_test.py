@@ -0,0 +1,144 @@
+import logging
+import os
+import shutil
+import stat
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any
+
+import pytest
+
+from clan_lib.cmd import CmdOut
+from clan_lib.errors import ClanError
+from clan_lib.ssh.localhost import LocalHost
+from clan_lib.ssh.upload import default_compresslevel, sync_dir, upload
+
+
+@pytest.mark.parametrize("compresslevel", [0, 9])
+def test_upload_directory(tmp_path: Path, compresslevel: int) -> None:
+    src = tmp_path / "src"
+    (src / "sub").mkdir(parents=True)
+    (src / "a").write_text("a")
+    (src / "sub" / "b").write_bytes(bytes(range(256)) * 1024)
+    dest = tmp_path / "upload" / "dest"
+    dest.mkdir(parents=True)
+    (dest / "stale").write_text("stale")
+
+    upload(LocalHost(), src, dest, compresslevel=compresslevel)
+
+    assert sorted(p.relative_to(dest).as_posix() for p in dest.rglob("*")) == [
+        "a",
+        "sub",
+        "sub/b",
+    ]
+    assert (dest / "a").read_text() == "a"
+    assert (dest / "sub" / "b").read_bytes() == bytes(range(256)) * 1024
+    assert stat.S_IMODE((dest / "a").stat().st_mode) == 0o400
+    assert stat.S_IMODE((dest / "sub").stat().st_mode) == 0o700
+
+
+def test_default_compresslevel(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("CLAN_UPLOAD_COMPRESSLEVEL", raising=False)
+    assert default_compresslevel() == 9
+    monkeypatch.setenv("CLAN_UPLOAD_COMPRESSLEVEL", "0")
+    assert default_compresslevel() == 0
+    for value in ["10", "-1", "fast"]:
+        monkeypatch.setenv("CLAN_UPLOAD_COMPRESSLEVEL", value)
+        with pytest.raises(ClanError, match="CLAN_UPLOAD_COMPRESSLEVEL"):
+            default_compresslevel()
+
+
+def test_upload_file(tmp_path: Path) -> None:
+    src = tmp_path / "src.txt"
+    src.write_text("content")
+    dest = tmp_path / "dest.txt"
+
+    upload(LocalHost(), src, dest)
+
+    assert dest.read_text() == "content"
+
+
+def test_sync_dir(tmp_path: Path, caplog: pytest.LogCaptureFixture) -> None:
+    src = tmp_path / "src"
+    (src / "keep").mkdir(parents=True)
+    (src / "keep" / "a").write_text("a")
+    (src / "remove").mkdir()
+    (src / "remove" / "b").write_text("b")
+    dest = tmp_path / "upload" / "dest"
+
+    host = LocalHost()
+    sync_dir(host, src, dest)
+    assert (dest / "keep" / "a").read_text() == "a"
+    assert (dest / "remove" / "b").read_text() == "b"
+
+    # nothing changed, the destination is left alone
+    inode = dest.stat().st_ino
+    with caplog.at_level(logging.INFO, logger="clan_lib.ssh.upload"):
+        sync_dir(host, src, dest)
+    assert "is up to date" in caplog.text
+    assert dest.stat().st_ino == inode
+
+    (src / "keep" / "a").write_text("changed")
+    (src / "new").write_text("new")
+    shutil.rmtree(src / "remove")
+    sync_dir(host, src, dest)
+    assert sorted(p.relative_to(dest).as_posix() for p in dest.rglob("*")) == [
+        "keep",
+        "keep/a",
+        "new",
+    ]
+    assert (dest / "keep" / "a").read_text() == "changed"
+    assert stat.S_IMODE((dest / "new").stat().st_mode) == 0o400
+    # the destination is updated in place, so it may be a mount point
+    assert dest.stat().st_ino == inode
+    assert not (dest / ".clan-staging").exists()
+
+
+@dataclass(frozen=True)
+class NobodyHost(LocalHost):
+    """Runs the commands as nobody, like ssh to a host as a regular user."""
+
+    def run(self, cmd: list[str], *args: Any, **kwargs: Any) -> CmdOut:
+        if os.geteuid() == 0:
+            cmd = [
+                "setpriv",
+                "--reuid=nobody",
+                "--regid=nogroup",
+                "--clear-groups",
+                *cmd,
+            ]
+        return super().run(cmd, *args, **kwargs)
+
+
+@pytest.mark.skipif(
+    os.geteuid() == 0 and shutil.which("setpriv") is None,
+    reason="needs setpriv to drop privileges",
+)
+def test_sync_dir_as_user(caplog: pytest.LogCaptureFixture) -> None:
+    with TemporaryDirectory() as tmp:
+        tmp_path = Path(tmp)
+        src = tmp_path / "src"
+        (src / "dir").mkdir(parents=True)
+        (src / "dir" / "a").write_text("a")
+        upload_dir = tmp_path / "upload"
+        upload_dir.mkdir()
+        if os.geteuid() == 0:
+            tmp_path.chmod(0o755)
+            shutil.chown(upload_dir, "nobody", "nogroup")
+        dest = upload_dir / "dest"
+
+        host = NobodyHost()
+        sync_dir(host, src, dest)
+        assert (dest / "dir" / "a").read_text() == "a"
+        assert dest.owner() != "root"
+
+        # the files can't be owned by root, that doesn't make them outdated
+        with caplog.at_level(logging.INFO, logger="clan_lib.ssh.upload"):
+            sync_dir(host, src, dest)
+        assert "is up to date" in caplog.text
+
+        (src / "dir" / "b").write_text("b")
+        sync_dir(host, src, dest)
+        assert (dest / "dir" / "b").read_text() == "b"
+        assert stat.S_IMODE((dest / "dir").stat().st_mode) == 0o700
@@ -1,6 +1,6 @@
 import logging
 from abc import ABC, abstractmethod
-from collections.abc import Callable, Iterable, Sequence
+from collections.abc import Callable, Hashable, Iterable, Sequence
 from dataclasses import dataclass
 from pathlib import Path
 from typing import TYPE_CHECKING, Protocol
@@ -182,6 +182,15 @@ class StoreBase(ABC):
     def store_name(self) -> str:
         pass
 
+    @property
+    def location_key(self) -> Hashable:
+        """Identifies where the store keeps its vars.
+
+        Stores with the same location key see the same vars, so checks of a
+        shared generator only need to run once for all of its machines.
+        """
+        return (type(self), self.clan_dir)
+
     # get a single fact
     @abstractmethod
     def get(
@@ -191,6 +200,18 @@ class StoreBase(ABC):
     ) -> bytes:
         pass
 
+    def get_many(
+        self, items: Sequence[tuple[GeneratorId, str]]
+    ) -> dict[tuple[GeneratorId, str], bytes]:
+        """Get many facts at once.
+
+        Stores that can fetch values more efficiently in bulk (e.g. decrypt
+        them concurrently) should override this.
+        """
+        return {
+            (generator, name): self.get(generator, name) for generator, name in items
+        }
+
     @abstractmethod
     def _set(
         self, generator: GeneratorId, name: str, value: bytes, policy: StoreRequest
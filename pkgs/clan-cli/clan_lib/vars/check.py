@@ -1,13 +1,17 @@
 import logging
+import threading
+from collections.abc import Callable, Hashable, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
 from typing import TYPE_CHECKING
 
 from clan_lib.errors import ClanError
 from clan_lib.flake.flake import Flake
 from clan_lib.machines.machines import Machine
+from clan_lib.vars._types import StoreBase
 from clan_lib.vars.secret_modules import sops
 
 if TYPE_CHECKING:
-    from .generator import Var
+    from .generator import Generator, Var
 
 log = logging.getLogger(__name__)
 
@@ -46,51 +50,86 @@ class VarStatus:
         return log or "All vars are present and valid."
 
 
-def vars_status(
-    machine_name: str,
-    flake: Flake,
-    generator_name: str | None = None,
-) -> VarStatus:
-    from .generator import get_machine_generators  # noqa: PLC0415
+class _SharedChecks:
+    """Results of checks that are the same for every machine.
+
+    Shared generators are used by many machines, but whether their files
+    exist and whether their invalidation hash is up to date only depends on
+    the store, so these checks run once for the whole fleet.
+    """
 
-    machine = Machine(name=machine_name, flake=flake)
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._results: dict[Hashable, Future[bool]] = {}
+
+    def get(self, key: Hashable, check: Callable[[], bool]) -> bool:
+        with self._lock:
+            future = self._results.get(key)
+            owner = future is None
+            if future is None:
+                future = self._results[key] = Future()
+        if owner:
+            try:
+                future.set_result(check())
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+        return future.result()
+
+
+def _machine_vars_status(
+    machine: Machine,
+    generators: list["Generator"],
+    shared_checks: _SharedChecks,
+) -> VarStatus:
     missing_secret_vars = []
     missing_public_vars = []
     # signals if a var needs to be updated (eg. needs re-encryption due to new users added)
     unfixed_secret_vars = []
     invalid_generators = []
 
-    generators = get_machine_generators([machine.name], machine.flake)
-    if generator_name:
-        for generator in generators:
-            if generator_name == generator.name:
-                generators = [generator]
-                break
-        else:
-            err_msg = (
-                f"Generator '{generator_name}' not found in machine {machine.name}"
-            )
-            raise ClanError(err_msg)
+    secret_store = machine.secret_vars_store
+    public_store = machine.public_vars_store
+
+    def exists(store: StoreBase, generator: "Generator", file: "Var") -> bool:
+        key = ("exists", store.location_key, generator.key, file.name)
+        return shared_checks.get(key, lambda: store.exists(generator.key, file.name))
+
+    def hash_is_valid(generator: "Generator") -> bool:
+        validation = generator.validation()
+        key = (
+            "hash",
+            secret_store.location_key,
+            public_store.location_key,
+            generator.key,
+            validation,
+        )
+        return shared_checks.get(
+            key,
+            lambda: (
+                secret_store.hash_is_valid(generator.key, validation)
+                and public_store.hash_is_valid(generator.key, validation)
+            ),
+        )
 
     for generator in generators:
         for file in generator.files:
-            file.store(
-                machine.secret_vars_store if file.secret else machine.public_vars_store,
-            )
+            file.store(secret_store if file.secret else public_store)
             file.generator(generator)
 
             if file.secret:
-                if not machine.secret_vars_store.exists(generator.key, file.name):
+                file_exists = exists(secret_store, generator, file)
+                if not file_exists:
                     machine.info(
                         f"Secret var '{file.name}' for service '{generator.name}' in machine {machine.name} is missing.",
                     )
                     missing_secret_vars.append(file)
                 if (
-                    isinstance(machine.secret_vars_store, sops.SecretStore)
+                    isinstance(secret_store, sops.SecretStore)
                     and generator.share
                     and file.deploy
-                    and file.exists
-                    and not machine.secret_vars_store.machine_has_access(
+                    and file_exists
+                    and not secret_store.machine_has_access(
                         generator=generator.key,
                         secret_name=file.name,
                         machine=machine.name,
@@ -104,7 +143,7 @@ def vars_status(
                     missing_secret_vars.append(file)
 
                 else:
-                    health_msg = machine.secret_vars_store.health_check(
+                    health_msg = secret_store.health_check(
                         machine=machine.name,
                         generators=[generator],
                         file_name=file.name,
@@ -115,20 +154,13 @@ def vars_status(
                         )
                         unfixed_secret_vars.append(file)
 
-            elif not machine.public_vars_store.exists(generator.key, file.name):
+            elif not exists(public_store, generator, file):
                 machine.info(
                     f"Public var '{file.name}' for service '{generator.name}' in machine {machine.name} is missing.",
                 )
                 missing_public_vars.append(file)
         # check if invalidation hash is up to date
-        if not (
-            machine.secret_vars_store.hash_is_valid(
-                generator.key, generator.validation()
-            )
-            and machine.public_vars_store.hash_is_valid(
-                generator.key, generator.validation()
-            )
-        ):
+        if not hash_is_valid(generator):
             invalid_generators.append(generator.name)
             machine.info(
                 f"Generator '{generator.name}' in machine {machine.name} has outdated invalidation hash.",
@@ -141,16 +173,86 @@ def vars_status(
     )
 
 
-def check_vars(
+def vars_status_many(
+    machine_names: Sequence[str],
+    flake: Flake,
+    generator_name: str | None = None,
+    jobs: int | None = None,
+) -> dict[str, VarStatus]:
+    """Check the vars of many machines at once.
+
+    The generators of all machines are evaluated together, checks that don't
+    depend on the machine run once per shared generator, and the machines are
+    checked on up to `jobs` threads.
+    """
+    from .generator import get_machine_generators, get_machine_selectors  # noqa: PLC0415
+
+    # one evaluation for all machines, the per-machine lookups below are cached
+    flake.precache(get_machine_selectors(machine_names))
+    shared_checks = _SharedChecks()
+
+    def machine_status(machine_name: str) -> VarStatus:
+        machine = Machine(name=machine_name, flake=flake)
+        generators = get_machine_generators([machine.name], machine.flake)
+        if generator_name:
+            for generator in generators:
+                if generator_name == generator.name:
+                    generators = [generator]
+                    break
+            else:
+                err_msg = (
+                    f"Generator '{generator_name}' not found in machine {machine.name}"
+                )
+                raise ClanError(err_msg)
+        return _machine_vars_status(machine, generators, shared_checks)
+
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="vars-check") as pool:
+        return dict(
+            zip(machine_names, pool.map(machine_status, machine_names), strict=True)
+        )
+
+
+def vars_status(
     machine_name: str,
     flake: Flake,
     generator_name: str | None = None,
-) -> bool:
-    status = vars_status(machine_name, flake, generator_name=generator_name)
-    log.info(f"Check results for machine '{machine_name}': \n{status.text()}")
+) -> VarStatus:
+    return vars_status_many([machine_name], flake, generator_name=generator_name)[
+        machine_name
+    ]
+
+
+def _status_ok(status: VarStatus) -> bool:
     return not (
         status.missing_secret_vars
         or status.missing_public_vars
         or status.unfixed_secret_vars
         or status.invalid_generators
     )
+
+
+def check_vars(
+    machine_name: str,
+    flake: Flake,
+    generator_name: str | None = None,
+) -> bool:
+    status = vars_status(machine_name, flake, generator_name=generator_name)
+    log.info(f"Check results for machine '{machine_name}': \n{status.text()}")
+    return _status_ok(status)
+
+
+def check_vars_many(
+    machine_names: Sequence[str],
+    flake: Flake,
+    generator_name: str | None = None,
+    jobs: int | None = None,
+) -> dict[str, bool]:
+    """Check the vars of many machines, returns whether they are ok by machine."""
+    statuses = vars_status_many(
+        machine_names, flake, generator_name=generator_name, jobs=jobs
+    )
+    results = {}
+    for machine_name, status in statuses.items():
+        log.info(f"Check results for machine '{machine_name}': \n{status.text()}")
+        results[machine_name] = _status_ok(status)
+    return results
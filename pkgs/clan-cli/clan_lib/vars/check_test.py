@@ -0,0 +1,42 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from clan_lib.vars.check import _SharedChecks
+
+
+def test_shared_checks_run_once() -> None:
+    shared_checks = _SharedChecks()
+    calls: list[str] = []
+    lock = threading.Lock()
+
+    def check(key: str) -> bool:
+        def run() -> bool:
+            with lock:
+                calls.append(key)
+            time.sleep(0.02)
+            return key == "a"
+
+        return shared_checks.get(key, run)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(check, ["a", "b"] * 8))
+
+    assert results == [True, False] * 8
+    assert sorted(calls) == ["a", "b"]
+
+
+def test_shared_checks_errors() -> None:
+    shared_checks = _SharedChecks()
+
+    def fail() -> bool:
+        msg = "broken store"
+        raise ValueError(msg)
+
+    with pytest.raises(ValueError, match="broken store"):
+        shared_checks.get("key", fail)
+    # the error is remembered as well
+    with pytest.raises(ValueError, match="broken store"):
+        shared_checks.get("key", lambda: True)
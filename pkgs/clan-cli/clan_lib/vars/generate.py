@@ -1,5 +1,6 @@
 import importlib
 import logging
+import threading
 from collections.abc import Callable
 from dataclasses import dataclass
 from typing import TYPE_CHECKING
@@ -8,6 +9,7 @@ from clan_lib.api import API
 from clan_lib.api.directory import get_clan_dir
 from clan_lib.errors import ClanError
 from clan_lib.flake.flake import Flake
+from clan_lib.git import commit_session
 from clan_lib.machines.machines import Machine
 from clan_lib.nix import current_system
 from clan_lib.nix_selectors import (
@@ -269,6 +271,7 @@ def run_generators(
     prompt_values: dict[str, dict[str, str]] | PromptFunc | None = None,
     no_sandbox: bool = False,
     auto_accept_prompts: bool = True,
+    jobs: int = 1,
 ) -> None:
     """Run the specified generators for machines.
 
@@ -287,6 +290,8 @@ def run_generators(
             no stored value are still asked. Set False (e.g. `--regenerate`) to
             re-ask even when a value exists. Only applies when prompt_values is
             None (using the default prompt function).
+        jobs: Maximum number of generators executed at the same time.
+            Generators only start once the generators they depend on are done.
 
     Raises:
         ClanError: If the machine or generator is not found, or if there are issues with
@@ -349,32 +354,41 @@ def run_generators(
             msg = "This should never happen"
             raise ClanError(msg)
 
-        generator.execute(
-            prompt_values=prompt_values.get(generator.name, {}),
-            no_sandbox=no_sandbox,
-            closure=[],
+    # commit the outputs of all generators at once, instead of one commit per
+    # generator
+    with commit_session(flake.path, "vars: update via generators"):
+        store_lock = threading.Lock()
+        graph.execute_parallel(
+            generators_to_run,
+            lambda generator: generator.execute(
+                prompt_values=prompt_values.get(generator.name, {}),
+                no_sandbox=no_sandbox,
+                closure=[],
+                store_lock=store_lock,
+            ),
+            jobs=jobs,
         )
 
-    # Re-encrypt shared secrets if recipients changed (e.g. machine added)
-    for generator in [g for g in all_generators if g.share]:
-        for file in generator.files:
-            # Skip files that are either:
-            # - Not encrypted
-            # - Don't exist yet
-            if not file.secret or not file.exists:
-                continue
-
-            for machine in [
-                Machine(name=machine_name, flake=flake)
-                for machine_name in generator.machines
-            ]:
-                machine.secret_vars_store.fix(
-                    machine.name,
-                    [generator],
-                    file_name=file.name,
-                )
-
-    flake.invalidate_cache()
+        # Re-encrypt shared secrets if recipients changed (e.g. machine added)
+        for generator in [g for g in all_generators if g.share]:
+            for file in generator.files:
+                # Skip files that are either:
+                # - Not encrypted
+                # - Don't exist yet
+                if not file.secret or not file.exists:
+                    continue
+
+                for machine in [
+                    Machine(name=machine_name, flake=flake)
+                    for machine_name in generator.machines
+                ]:
+                    machine.secret_vars_store.fix(
+                        machine.name,
+                        [generator],
+                        file_name=file.name,
+                    )
+
+    flake.invalidate_cache(changed_paths=[clan_dir / "vars", clan_dir / "sops"])
 
 
 def get_flake_generators(
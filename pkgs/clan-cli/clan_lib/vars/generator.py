@@ -4,7 +4,7 @@ import logging
 import os
 import pprint
 from collections.abc import Iterable, Sequence
-from contextlib import ExitStack
+from contextlib import AbstractContextManager, ExitStack, nullcontext
 from dataclasses import dataclass, field
 from pathlib import Path
 from tempfile import TemporaryDirectory
@@ -12,6 +12,7 @@ from typing import TYPE_CHECKING
 
 from clan_lib.cmd import RunOpts, run
 from clan_lib.errors import ClanError
+from clan_lib.flake.views import materialize
 from clan_lib.git import commit_files
 from clan_lib.nix import current_system, nix_config, nix_test_store
 from clan_lib.nix_selectors import (
@@ -251,14 +252,14 @@ def get_machine_generators(
 
     for machine_name in machine_names:
         # Get all generator metadata in one select (safe fields only)
-        generators_data = flake.select(
+        generators_data = flake.select_view(
             vars_generators_metadata(system, [machine_name])
         )[machine_name]
         if not generators_data:
             continue
 
         # Get all file metadata in one select
-        files_data = flake.select(vars_generators_files(system, [machine_name]))[
+        files_data = flake.select_view(vars_generators_files(system, [machine_name]))[
             machine_name
         ]
 
@@ -323,7 +324,10 @@ def get_machine_generators(
                 files.append(var)
 
             # Build prompts
-            prompts = [Prompt.from_nix(p) for p in gen_data.get("prompts", {}).values()]
+            prompts = [
+                Prompt.from_nix(materialize(p))
+                for p in gen_data.get("prompts", {}).values()
+            ]
 
             share = gen_data["share"]
             placement: Placement = (
@@ -583,14 +587,30 @@ class Generator:
             in the form { loc: { VAR.name: bytes } }
 
         """
-        result = {}
-        for unpack_location, dep_key in self.dependency_map.items():
-            dep_generator = self._resolve_dep_generator(dep_key, generators)
-            result[unpack_location] = {
-                file.name: self.get_file_bytes(dep_generator.key, file)
+        dep_generators = {
+            unpack_location: self._resolve_dep_generator(dep_key, generators)
+            for unpack_location, dep_key in self.dependency_map.items()
+        }
+        # decrypt the secrets of all dependencies in one batch
+        secrets: dict[tuple[GeneratorId, str], bytes] = {}
+        if self._secret_store is not None:
+            secrets = self._secret_store.get_many(
+                [
+                    (dep_generator.key, file.name)
+                    for dep_generator in dep_generators.values()
+                    for file in dep_generator.files
+                    if file.secret
+                ]
+            )
+        return {
+            unpack_location: {
+                file.name: secrets[(dep_generator.key, file.name)]
+                if file.secret and self._secret_store is not None
+                else self.get_file_bytes(dep_generator.key, file)
                 for file in dep_generator.files
             }
-        return result
+            for unpack_location, dep_generator in dep_generators.items()
+        }
 
     def ask_prompts(self) -> dict[str, str]:
         """Interactively ask for all prompt values for this generator.
@@ -616,6 +636,7 @@ class Generator:
         closure: Sequence["Generator"],
         prompt_values: dict[str, str] | None = None,
         no_sandbox: bool = False,
+        store_lock: AbstractContextManager | None = None,
     ) -> None:
         """Execute this generator to produce its output files.
 
@@ -623,6 +644,8 @@ class Generator:
             closure: List of all available Generators, that can be referenced for example in dependencies
             prompt_values: Optional dictionary of prompt values. If not provided, prompts will be asked interactively.
             no_sandbox: Whether to disable sandboxing when executing the generator
+            store_lock: Held while the outputs are written to the vars stores and committed,
+                when generators are executed concurrently
 
         """
         if (
@@ -703,56 +726,59 @@ class Generator:
                 cmd = ["bash", "-c", str(final_script)]
 
             run(cmd, RunOpts(env=env, cwd=tmpdir))
-            files_to_commit = []
-
-            # store secrets
-            public_changed = False
-            secret_changed = False
-            for file in self.files:
-                secret_file = tmpdir_out / file.name
-                if not secret_file.is_file():
-                    msg = f"did not generate a file for '{file.name}' when running the following command:\n"
-                    msg += str(final_script)
-                    # list all files in the output directory
-                    if tmpdir_out.is_dir():
-                        msg += "\nOutput files:\n"
-                        for f in tmpdir_out.iterdir():
-                            msg += f"  - {f.name}\n"
-                    raise ClanError(msg)
-                if file.secret:
-                    file_paths = self._secret_store.set(
-                        self,
-                        file,
-                        secret_file.read_bytes(),
-                        log_info=lambda msg: log_prefixed(
-                            msg, prefix=self.key.placement.log_prefix()
-                        ),
+
+            # the vars stores and the git index are shared by all generators
+            with store_lock or nullcontext():
+                files_to_commit = []
+
+                # store secrets
+                public_changed = False
+                secret_changed = False
+                for file in self.files:
+                    secret_file = tmpdir_out / file.name
+                    if not secret_file.is_file():
+                        msg = f"did not generate a file for '{file.name}' when running the following command:\n"
+                        msg += str(final_script)
+                        # list all files in the output directory
+                        if tmpdir_out.is_dir():
+                            msg += "\nOutput files:\n"
+                            for f in tmpdir_out.iterdir():
+                                msg += f"  - {f.name}\n"
+                        raise ClanError(msg)
+                    if file.secret:
+                        file_paths = self._secret_store.set(
+                            self,
+                            file,
+                            secret_file.read_bytes(),
+                            log_info=lambda msg: log_prefixed(
+                                msg, prefix=self.key.placement.log_prefix()
+                            ),
+                        )
+                        secret_changed = True
+                    else:
+                        file_paths = self._public_store.set(
+                            self,
+                            file,
+                            secret_file.read_bytes(),
+                            log_info=lambda msg: log_prefixed(
+                                msg, prefix=self.key.placement.log_prefix()
+                            ),
+                        )
+                        public_changed = True
+                    files_to_commit.extend(file_paths)
+
+                validation = self.validation()
+                if public_changed:
+                    files_to_commit += self._public_store.set_validation(
+                        self.key, validation
                     )
-                    secret_changed = True
-                else:
-                    file_paths = self._public_store.set(
-                        self,
-                        file,
-                        secret_file.read_bytes(),
-                        log_info=lambda msg: log_prefixed(
-                            msg, prefix=self.key.placement.log_prefix()
-                        ),
+                if secret_changed:
+                    files_to_commit += self._secret_store.set_validation(
+                        self.key, validation
                     )
-                    public_changed = True
-                files_to_commit.extend(file_paths)
 
-            validation = self.validation()
-            if public_changed:
-                files_to_commit += self._public_store.set_validation(
-                    self.key, validation
-                )
-            if secret_changed:
-                files_to_commit += self._secret_store.set_validation(
-                    self.key, validation
+                commit_files(
+                    files_to_commit,
+                    self._flake.path,
+                    f"vars: update via generator {self.key}",
                 )
-
-        commit_files(
-            files_to_commit,
-            self._flake.path,
-            f"vars: update via generator {self.key}",
-        )
@@ -1,12 +1,14 @@
 from __future__ import annotations
 
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import copy_context
 from graphlib import TopologicalSorter
 from typing import TYPE_CHECKING, Any, Protocol
 
 from clan_lib.errors import ClanError
 
 if TYPE_CHECKING:
-    from collections.abc import Iterable, Mapping
+    from collections.abc import Callable, Iterable, Mapping, Sequence
 
 
 class Comparable(Protocol):
@@ -134,3 +136,52 @@ def requested_closure[T: Comparable, N: GeneratorGraphNode](
     closure = add_missing_dependencies(closure, generators)
     closure = add_dependents(closure, generators)
     return toposort_closure(closure, generators)
+
+
+def execute_parallel[N: GeneratorGraphNode](
+    ordered: Sequence[N],
+    execute: Callable[[N], None],
+    jobs: int = 1,
+) -> None:
+    """Execute generators with up to `jobs` of them running at the same time.
+
+    A generator is started once all of its dependencies within `ordered` have
+    been executed, dependencies outside of it are expected to exist already.
+    After the first failure no further generators are started, the error is
+    raised once the running ones are finished.
+    """
+    if jobs < 1:
+        msg = f"jobs must be at least 1, got {jobs}"
+        raise ValueError(msg)
+    if jobs == 1:
+        for node in ordered:
+            execute(node)
+        return
+
+    nodes = {node.key: node for node in ordered}
+    position = {key: i for i, key in enumerate(nodes)}
+    sorter = TopologicalSorter(
+        {key: set(node.dependencies) & nodes.keys() for key, node in nodes.items()}
+    )
+    sorter.prepare()
+
+    error: BaseException | None = None
+    running: dict[Future[None], Any] = {}
+    with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="vars") as pool:
+        while sorter.is_active() and error is None:
+            # start ready generators in the order of `ordered` to keep output stable
+            for key in sorted(sorter.get_ready(), key=position.__getitem__):
+                # in the caller's context, e.g. to commit in its commit session
+                running[pool.submit(copy_context().run, execute, nodes[key])] = key
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = running.pop(future)
+                if future.exception() is not None:
+                    error = error or future.exception()
+                else:
+                    sorter.done(key)
+        # generators that were queued but did not start yet
+        for future in running:
+            future.cancel()
+    if error is not None:
+        raise error
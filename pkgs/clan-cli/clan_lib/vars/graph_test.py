@@ -1,5 +1,9 @@
+import threading
+from dataclasses import dataclass, field
 from unittest.mock import Mock
 
+import pytest
+
 from clan_lib.vars._types import GeneratorId, PerMachine, Shared
 from clan_lib.vars.generator import (
     Generator,
@@ -7,6 +11,7 @@ from clan_lib.vars.generator import (
 from clan_lib.vars.graph import (
     GeneratorGraphNode,
     all_missing_closure,
+    execute_parallel,
     requested_closure,
 )
 from clan_lib.vars.var import Var
@@ -164,3 +169,49 @@ def test_shared_generator_invalidates_multiple_machines_dependents() -> None:
         _pm("gen_1", machine_1),
         _pm("gen_2", machine_2),
     }, "All generators should be included in requested_closure due to shared dependency"
+
+
+@dataclass
+class _Node:
+    key: GeneratorId
+    dependencies: list[GeneratorId] = field(default_factory=list)
+    exists: bool = False
+
+
+def test_execute_parallel() -> None:
+    # a <- b, a <- c, (b, c) <- d, b and c can run at the same time
+    a = _Node(_shared("a"))
+    b = _Node(_shared("b"), [a.key])
+    c = _Node(_shared("c"), [a.key])
+    d = _Node(_shared("d"), [b.key, c.key, _shared("exists")])
+    both_running = threading.Barrier(2, timeout=5)
+    lock = threading.Lock()
+    finished: list[str] = []
+
+    def execute(node: _Node) -> None:
+        if node in (b, c):
+            both_running.wait()
+        with lock:
+            assert all(dep.name in finished for dep in node.dependencies[:2])
+            finished.append(node.key.name)
+
+    execute_parallel([a, b, c, d], execute, jobs=2)
+    assert finished[0] == "a"
+    assert sorted(finished[1:3]) == ["b", "c"]
+    assert finished[3] == "d"
+
+
+def test_execute_parallel_stops_on_error() -> None:
+    a = _Node(_shared("a"))
+    b = _Node(_shared("b"), [a.key])
+    executed: list[str] = []
+
+    def execute(node: _Node) -> None:
+        executed.append(node.key.name)
+        if node is a:
+            msg = "generator failed"
+            raise RuntimeError(msg)
+
+    with pytest.raises(RuntimeError, match="generator failed"):
+        execute_parallel([a, b], execute, jobs=4)
+    assert executed == ["a"]
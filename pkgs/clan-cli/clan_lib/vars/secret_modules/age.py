@@ -12,7 +12,7 @@ from clan_lib.cmd import run as cmd_run
 from clan_lib.dirs import runtime_deps_flake
 from clan_lib.errors import ClanCmdError, ClanError
 from clan_lib.flake import Flake
-from clan_lib.git import commit_files
+from clan_lib.git import commit_files, commit_session
 from clan_lib.nix import current_system, nix_command, nix_shell
 from clan_lib.nix_selectors import (
     secrets_age_plugins,
@@ -20,7 +20,7 @@ from clan_lib.nix_selectors import (
     vars_settings_recipients,
 )
 from clan_lib.ssh.host import Host
-from clan_lib.ssh.upload import upload
+from clan_lib.ssh.upload import sync_dir
 from clan_lib.vars._types import (
     GeneratorId,
     GeneratorStore,
@@ -648,7 +648,7 @@ class SecretStore(StoreBase):
         with TemporaryDirectory(prefix="age-upload-") as _tempdir:
             upload_dir = Path(_tempdir).resolve()
             self.populate_dir(generators, machine, upload_dir, phases)
-            upload(host, upload_dir, Path(self.get_upload_directory(machine)))
+            sync_dir(host, upload_dir, Path(self.get_upload_directory(machine)))
 
     # ── Health check and fix ──────────────────────────────────────────────
 
@@ -700,6 +700,15 @@ class SecretStore(StoreBase):
         - Deployed per-machine secrets are never re-encrypted (machine key
           doesn't change)
         """
+        with commit_session(self.flake.path, f"secrets: fix vars for {machine}"):
+            self._fix(machine, generators, file_name)
+
+    def _fix(
+        self,
+        machine: str,
+        generators: Sequence[GeneratorStore],
+        file_name: str | None,
+    ) -> None:
         # Re-key the machine key if user recipients changed
         if self.machine_pubkey_file(machine).exists():
             encrypted_key_file = self.machine_encrypted_key_file(machine)
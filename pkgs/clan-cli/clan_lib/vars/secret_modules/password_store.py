@@ -4,7 +4,7 @@ import os
 import shutil
 import subprocess
 import tarfile
-from collections.abc import Iterable, Sequence
+from collections.abc import Hashable, Iterable, Sequence
 from pathlib import Path
 from tempfile import TemporaryDirectory
 from typing import override
@@ -39,6 +39,12 @@ class SecretStore(StoreBase):
     def store_name(self) -> str:
         return "password_store"
 
+    @property
+    @override
+    def location_key(self) -> Hashable:
+        # pass and passage use different store directories
+        return (type(self), self._pass_command(), self.store_dir())
+
     def store_dir(self) -> Path:
         """Get the password store directory, cached per machine."""
         if self._pass_command() == "passage":
@@ -3,7 +3,7 @@ from collections.abc import Iterable, Sequence
 from dataclasses import dataclass
 from pathlib import Path
 from tempfile import TemporaryDirectory
-from typing import override
+from typing import TYPE_CHECKING, override
 
 from clan_cli.secrets import sops
 from clan_cli.secrets.folders import (
@@ -13,16 +13,18 @@ from clan_cli.secrets.folders import (
     sops_users_folder,
 )
 from clan_cli.secrets.machines import add_machine, add_secret, has_machine
+from clan_cli.secrets.recipient_index import RecipientIndex, recipient_index
 from clan_cli.secrets.secrets import (
     allow_member,
     collect_keys_for_path,
-    decrypt_secret,
+    collect_keys_for_type,
     decrypt_secret_raw,
+    decrypt_secrets_raw,
     encrypt_secret,
     groups_folder,
     has_secret,
 )
-from clan_cli.secrets.sops import load_age_plugins
+from clan_cli.secrets.sops import load_age_plugins, update_keys_many
 
 from clan_lib.errors import ClanError
 from clan_lib.flake import Flake
@@ -30,7 +32,7 @@ from clan_lib.git import commit_files
 from clan_lib.nix import current_system
 from clan_lib.nix_selectors import vars_sops_default_groups, vars_sops_secret_upload_dir
 from clan_lib.ssh.host import Host
-from clan_lib.ssh.upload import upload
+from clan_lib.ssh.upload import sync_dir
 from clan_lib.vars._types import (
     GeneratorId,
     GeneratorStore,
@@ -38,6 +40,9 @@ from clan_lib.vars._types import (
     StoreRequest,
 )
 
+if TYPE_CHECKING:
+    from clan_lib.vars.var import Var
+
 
 @dataclass
 class SopsKey:
@@ -97,6 +102,15 @@ class SecretStore(StoreBase):
     def store_name(self) -> str:
         return "sops"
 
+    @property
+    def recipient_index(self) -> RecipientIndex:
+        return recipient_index(self.clan_dir)
+
+    def default_groups(self, machine: str) -> list[str]:
+        return self.flake.select(vars_sops_default_groups(current_system(), [machine]))[
+            machine
+        ]["sops"]["defaultGroups"]
+
     def user_has_access(
         self,
         user: str,
@@ -121,8 +135,8 @@ class SecretStore(StoreBase):
         secret_name: str,
     ) -> bool:
         secret_path = self.secret_path(generator, secret_name)
-        recipient = sops.SopsKey.load_dir(key_dir)
-        recipients = sops.get_recipients(secret_path)
+        recipient = self.recipient_index.keys(key_dir)
+        recipients = self.recipient_index.recipients(secret_path)
         return len(recipient.intersection(recipients)) > 0
 
     def secret_path(self, generator: GeneratorId, secret_name: str) -> Path:
@@ -155,6 +169,7 @@ class SecretStore(StoreBase):
         """
         file_found = False
         outdated = []
+        default_groups = self.default_groups(machine)
         for generator in generators:
             for file in generator.files:
                 # if we check only a single file, continue on all the other ones
@@ -164,9 +179,12 @@ class SecretStore(StoreBase):
                     else:
                         continue
                 if file.secret and self.exists(generator.key, file.name):
-                    needs_update, msg = self.needs_fix(generator, file.name, machine)
+                    needs_update, msg = self.needs_fix(
+                        generator, file.name, machine, default_groups
+                    )
                     if needs_update:
                         outdated.append((generator.name, file.name, msg))
+        self.recipient_index.save()
         if file_name and not file_found:
             msg = f"file {file_name} was not found"
             raise ClanError(msg)
@@ -227,6 +245,28 @@ class SecretStore(StoreBase):
             self._secret_cache[path] = value
         return value
 
+    def _decrypt_many(self, paths: Sequence[Path]) -> dict[Path, bytes]:
+        """Decrypt the secrets at paths in one batch, reusing cached values."""
+        cache = self._secret_cache if self._secret_cache is not None else {}
+        missing = list(dict.fromkeys(p for p in paths if p not in cache))
+        values = {p: cache[p] for p in paths if p in cache}
+        if missing:
+            decrypted = decrypt_secrets_raw(
+                missing, age_plugins=load_age_plugins(self.flake)
+            )
+            if self._secret_cache is not None:
+                self._secret_cache.update(decrypted)
+            values.update(decrypted)
+        return values
+
+    @override
+    def get_many(
+        self, items: Sequence[tuple[GeneratorId, str]]
+    ) -> dict[tuple[GeneratorId, str], bytes]:
+        paths = {item: self.secret_path(*item) for item in items}
+        values = self._decrypt_many(list(paths.values()))
+        return {item: values[path] for item, path in paths.items()}
+
     def delete(self, generator: GeneratorId, name: str) -> Iterable[Path]:
         secret_dir = self.directory(generator, name)
         shutil.rmtree(secret_dir)
@@ -247,50 +287,56 @@ class SecretStore(StoreBase):
         output_dir: Path,
         phases: list[str],
     ) -> None:
+        key_path = None
         if "users" in phases or "services" in phases:
-            key_name = f"{machine}-age.key"
-            if not has_secret(sops_secrets_folder(self.clan_dir) / key_name):
+            key_path = sops_secrets_folder(self.clan_dir) / f"{machine}-age.key"
+            if not has_secret(key_path):
                 # skip uploading the secret, not managed by us
                 return
-            key = decrypt_secret(
-                sops_secrets_folder(self.clan_dir) / key_name,
-                age_plugins=load_age_plugins(self.flake),
-            )
+
+        files: list[tuple[Path, GeneratorStore, Var]] = []
+        for generator in generators:
+            for file in generator.files:
+                if file.needed_for not in phases:
+                    continue
+                if file.needed_for == "activation":
+                    target_path = (
+                        output_dir / "activation" / generator.key.rel_dir() / file.name
+                    )
+                elif file.needed_for == "partitioning":
+                    target_path = output_dir / generator.key.rel_dir() / file.name
+                else:
+                    continue
+                files.append((target_path, generator, file))
+
+        # Decrypt the machine key and all secrets in one batch, instead of
+        # starting sops for one file after another.
+        # Missing secrets are left to `file.value`, which reports them.
+        secret_paths = {
+            target_path: self.secret_path(generator.key, file.name)
+            for target_path, generator, file in files
+            if file.secret and self.exists(generator.key, file.name)
+        }
+        decrypted = self._decrypt_many(
+            [*([key_path] if key_path else []), *secret_paths.values()]
+        )
+
+        if key_path is not None:
             (output_dir / "key.txt").touch(mode=0o600)
-            (output_dir / "key.txt").write_text(key)
-
-        if "activation" in phases:
-            for generator in generators:
-                for file in generator.files:
-                    if file.needed_for == "activation":
-                        target_path = (
-                            output_dir
-                            / "activation"
-                            / generator.key.rel_dir()
-                            / file.name
-                        )
-                        target_path.parent.mkdir(
-                            parents=True,
-                            exist_ok=True,
-                        )
-                        # chmod after in case it doesn't have u+w
-                        target_path.touch(mode=0o600)
-                        target_path.write_bytes(file.value)
-                        target_path.chmod(file.mode)
+            (output_dir / "key.txt").write_bytes(decrypted[key_path])
 
-        if "partitioning" in phases:
-            for generator in generators:
-                for file in generator.files:
-                    if file.needed_for == "partitioning":
-                        target_path = output_dir / generator.key.rel_dir() / file.name
-                        target_path.parent.mkdir(
-                            parents=True,
-                            exist_ok=True,
-                        )
-                        # chmod after in case it doesn't have u+w
-                        target_path.touch(mode=0o600)
-                        target_path.write_bytes(file.value)
-                        target_path.chmod(file.mode)
+        for target_path, _, file in files:
+            target_path.parent.mkdir(
+                parents=True,
+                exist_ok=True,
+            )
+            # chmod after in case it doesn't have u+w
+            target_path.touch(mode=0o600)
+            if target_path in secret_paths:
+                target_path.write_bytes(decrypted[secret_paths[target_path]])
+            else:
+                target_path.write_bytes(file.value)
+            target_path.chmod(file.mode)
 
     @override
     def get_upload_directory(self, machine: str) -> str:
@@ -312,7 +358,7 @@ class SecretStore(StoreBase):
         with TemporaryDirectory(prefix="sops-upload-") as _tempdir:
             sops_upload_dir = Path(_tempdir).resolve()
             self.populate_dir(generators, machine, sops_upload_dir, phases)
-            upload(host, sops_upload_dir, Path(self.get_upload_directory(machine)))
+            sync_dir(host, sops_upload_dir, Path(self.get_upload_directory(machine)))
 
     def exists(self, generator: GeneratorId, name: str) -> bool:
         secret_folder = self.secret_path(generator, name)
@@ -333,37 +379,35 @@ class SecretStore(StoreBase):
             flake_dir=self.flake.path,
         )
 
-    def collect_keys_for_secret(self, machine: str, path: Path) -> set[sops.SopsKey]:
-        from clan_cli.secrets.secrets import (  # noqa: PLC0415
-            collect_keys_for_path,
-            collect_keys_for_type,
-        )
-
-        keys = collect_keys_for_path(path)
-        default_groups = self.flake.select(
-            vars_sops_default_groups(current_system(), [machine])
-        )[machine]["sops"]["defaultGroups"]
+    def collect_keys_for_secret(
+        self, machine: str, path: Path, default_groups: list[str] | None = None
+    ) -> set[sops.SopsKey]:
+        if default_groups is None:
+            default_groups = self.default_groups(machine)
+        index = self.recipient_index
+        keys = collect_keys_for_path(path, index)
+        groups_dir = sops_groups_folder(self.clan_dir)
         for group in default_groups:
-            keys.update(
-                collect_keys_for_type(
-                    self.clan_dir / "sops" / "groups" / group / "machines",
-                ),
-            )
-            keys.update(
-                collect_keys_for_type(
-                    self.clan_dir / "sops" / "groups" / group / "users",
-                ),
-            )
+            keys.update(collect_keys_for_type(groups_dir / group / "machines", index))
+            keys.update(collect_keys_for_type(groups_dir / group / "users", index))
 
         return keys
 
     def needs_fix(
-        self, generator: GeneratorStore, name: str, machine: str
+        self,
+        generator: GeneratorStore,
+        name: str,
+        machine: str,
+        default_groups: list[str] | None = None,
     ) -> tuple[bool, str | None]:
         secret_path = self.secret_path(generator.key, name)
-        current_recipients = sops.get_recipients(secret_path)
-        wanted_recipients = self.collect_keys_for_secret(machine, secret_path)
+        current_recipients = self.recipient_index.recipients(secret_path)
+        wanted_recipients = self.collect_keys_for_secret(
+            machine, secret_path, default_groups
+        )
         needs_update = current_recipients != wanted_recipients
+        if not needs_update:
+            return False, None
         recipients_to_add = wanted_recipients - current_recipients
         var_id = f"{generator.name}/{name}"
         key_details = []
@@ -411,13 +455,14 @@ class SecretStore(StoreBase):
             ClanError: If the specified file_name is not found
 
         """
-        from clan_cli.secrets.secrets import (  # noqa: PLC0415
-            disallow_member,
-            update_keys,
-        )
+        from clan_cli.secrets.secrets import disallow_member  # noqa: PLC0415
 
         file_found = False
         files_to_commit: list[Path] = []
+        # secrets to re-encrypt, updated in one batch at the end
+        outdated: list[tuple[Path, set[sops.SopsKey]]] = []
+        age_plugins = load_age_plugins(self.flake)
+        default_groups = self.default_groups(machine)
         for generator in generators:
             for file in generator.files:
                 # if we check only a single file, continue on all the other ones
@@ -431,8 +476,6 @@ class SecretStore(StoreBase):
 
                 secret_path = self.secret_path(generator.key, file.name)
 
-                age_plugins = load_age_plugins(self.flake)
-
                 # Secrets not marked for deployment don't need
                 # machine access — remove stale symlinks if present.
                 if not file.deploy:
@@ -455,9 +498,6 @@ class SecretStore(StoreBase):
                         )
                     )
 
-                default_groups = self.flake.select(
-                    vars_sops_default_groups(current_system(), [machine])
-                )[machine]["sops"]["defaultGroups"]
                 for group in default_groups:
                     files_to_commit.extend(
                         allow_member(
@@ -473,19 +513,17 @@ class SecretStore(StoreBase):
                 # Only re-encrypt if the actual recipients in the file
                 # differ from the wanted recipients (e.g. after git merges
                 # that added new machine keys or group members).
-                wanted_recipients = collect_keys_for_path(secret_path)
-                current_recipients = sops.get_recipients(secret_path)
+                wanted_recipients = collect_keys_for_path(
+                    secret_path, self.recipient_index
+                )
+                current_recipients = self.recipient_index.recipients(secret_path)
                 if current_recipients != wanted_recipients:
-                    files_to_commit.extend(
-                        update_keys(
-                            secret_path,
-                            wanted_recipients,
-                            age_plugins=age_plugins,
-                        )
-                    )
+                    outdated.append((secret_path, wanted_recipients))
+        self.recipient_index.save()
         if file_name and not file_found:
             msg = f"file {file_name} was not found"
             raise ClanError(msg)
+        files_to_commit.extend(update_keys_many(outdated, age_plugins=age_plugins))
         commit_files(
             files_to_commit,
             self.flake.path,